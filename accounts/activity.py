@@ -0,0 +1,103 @@
+# accounts/activity.py
+"""
+Coalesced tracking of when users were last active.
+
+Requests only record activity in a Redis sorted set (member: user id, score: unix time), and
+each process records a given user at most once per ACTIVITY_RECORD_INTERVAL_SECONDS. A periodic
+task moves the set aside and writes it to User.last_activity_at with one UPDATE ... FROM (VALUES ...)
+statement per batch, so accounts_user is never written to on the request path.
+"""
+import datetime
+import logging
+import threading
+import time
+
+import redis
+from cachetools import TTLCache
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+ACTIVITY_KEY = 'user-activity'
+FLUSHING_KEY = 'user-activity:flushing'
+
+_redis_client = None
+# Users already recorded by this process within the interval
+_recently_recorded = TTLCache(maxsize=settings.ACTIVITY_THROTTLE_CACHE_SIZE, ttl=settings.ACTIVITY_RECORD_INTERVAL_SECONDS)
+_recently_recorded_lock = threading.Lock()
+
+
+def get_activity_redis():
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = redis.Redis.from_url(
+            settings.ACTIVITY_REDIS_URL,
+            socket_timeout=settings.ACTIVITY_REDIS_TIMEOUT_SECONDS,
+            socket_connect_timeout=settings.ACTIVITY_REDIS_TIMEOUT_SECONDS,
+        )
+    return _redis_client
+
+
+def record_activity(user_id):
+    """
+    Notes that the user was active now. Cheap enough for every request: usually an in-memory
+    lookup, at most one ZADD per user and interval. Redis errors are logged, never raised.
+    """
+    with _recently_recorded_lock:
+        if user_id in _recently_recorded:
+            return
+        _recently_recorded[user_id] = True
+    try:
+        get_activity_redis().zadd(ACTIVITY_KEY, {user_id: time.time()})
+    except redis.RedisError as e:
+        logger.warning(f"Could not record activity of user ID {user_id}: {e}")
+
+
+def _write_batch(rows):
+    User = get_user_model()
+    table = connection.ops.quote_name(User._meta.db_table)
+    values_sql = ', '.join(['(%s::bigint, %s::timestamptz)'] * len(rows))
+    params = [value for row in rows for value in row]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            UPDATE {table} AS u
+            SET last_activity_at = v.seen_at
+            FROM (VALUES {values_sql}) AS v(id, seen_at)
+            WHERE u.id = v.id AND (u.last_activity_at IS NULL OR u.last_activity_at < v.seen_at)
+            """,
+            params
+        )
+        return cursor.rowcount
+
+
+def flush_activity(batch_size=1000):
+    """
+    Writes the recorded activity to User.last_activity_at. Returns the number of users updated.
+    The set is renamed before reading so activity recorded meanwhile goes to a fresh set; a set
+    left behind by an interrupted flush is written first.
+    """
+    client = get_activity_redis()
+    if not client.exists(FLUSHING_KEY):
+        try:
+            client.rename(ACTIVITY_KEY, FLUSHING_KEY)
+        except redis.ResponseError:
+            # No activity recorded since the last flush
+            return 0
+
+    updated_count = 0
+    start = 0
+    while True:
+        entries = client.zrange(FLUSHING_KEY, start, start + batch_size - 1, withscores=True)
+        if not entries:
+            break
+        rows = [
+            (int(user_id), datetime.datetime.fromtimestamp(score, tz=datetime.timezone.utc))
+            for user_id, score in entries
+        ]
+        updated_count += _write_batch(rows)
+        start += batch_size
+    client.delete(FLUSHING_KEY)
+    return updated_count
@@ -0,0 +1,18 @@
+# accounts/middleware.py
+from .activity import record_activity
+
+
+class ActivityTrackingMiddleware:
+    """
+    Records that the requesting user was active (see accounts.activity).
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        # Checked after the view: DRF authenticates JWT requests there and sets request.user then
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            record_activity(user.pk)
+        return response
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-19 10:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0005_alter_user_is_active'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='notifications_read_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
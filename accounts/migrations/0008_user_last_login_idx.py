@@ -0,0 +1,17 @@
+# Generated by Django 5.2.1 on 2026-10-19 16:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0007_user_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['last_login', 'id'], name='user_last_login_idx'),
+        ),
+    ]
@@ -1,6 +1,8 @@
 from django.db import models
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 from django.utils import timezone
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.db.models.functions import Lower, Upper
 
 class UserManager(BaseUserManager):
     def create_user(self, email, name, dob=None, password=None, password2=None, **extra_fields):
@@ -55,11 +57,28 @@ class User(AbstractBaseUser, PermissionsMixin):
     otp = models.CharField(max_length=6, blank=True, null=True)
     otp_created_at = models.DateTimeField(blank=True, null=True)
 
+    # High-water mark for "mark all notifications read": anything created at or before it counts as read
+    notifications_read_until = models.DateTimeField(blank=True, null=True)
+
+    # Last request seen from the user, written in batches by accounts.activity (up to a few minutes behind)
+    last_activity_at = models.DateTimeField(blank=True, null=True)
+
     USERNAME_FIELD = 'email'
     # REQUIRED_FIELDS = ['name'] 
 
     objects = UserManager()
 
+    class Meta:
+        indexes = [
+            # Trigram indexes matching the UPPER(...) LIKE queries Django emits for icontains (admin search)
+            GinIndex(OpClass(Upper('email'), name='gin_trgm_ops'), name='user_email_trgm_idx'),
+            GinIndex(OpClass(Upper('name'), name='gin_trgm_ops'), name='user_name_trgm_idx'),
+            # Case-insensitive lookups of recipients' accounts by email
+            models.Index(Lower('email'), name='user_email_lower_idx'),
+            # Keyset scans over users inactive since a cutoff (capsule inactivity transfer)
+            models.Index(fields=['last_activity_at', 'id'], name='user_last_activity_idx'),
+        ]
+
     def __str__(self):
         return self.email
     
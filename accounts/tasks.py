@@ -0,0 +1,17 @@
+from celery import shared_task
+from django.conf import settings
+import logging
+
+from .activity import flush_activity
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(name='accounts.flush_user_activity', ignore_result=True)
+def flush_user_activity_task():
+    """
+    Periodic task that writes the activity recorded in Redis to User.last_activity_at.
+    """
+    updated_count = flush_activity(batch_size=settings.ACTIVITY_FLUSH_BATCH_SIZE)
+    if updated_count:
+        logger.info(f"Updated last activity of {updated_count} users.")
@@ -1,3 +1,108 @@
-from django.test import TestCase
+import datetime
+import os
+import unittest
+from unittest import mock
 
-# Create your tests here.
+import redis
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from . import activity
+from .models import User
+
+# A Redis database the activity tests may clear
+ACTIVITY_TEST_REDIS_URL = os.environ.get('ACTIVITY_TEST_REDIS_URL', 'redis://localhost:6379/15')
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class UserLoginViewTests(TestCase):
+    def test_login_stamps_last_login(self):
+        user = User.objects.create_user(email='ada@example.com', name='Ada', password='secret', is_active=True)
+        self.assertIsNone(user.last_login)
+
+        response = self.client.post(
+            reverse('accounts:user_login'), {'email': 'ada@example.com', 'password': 'secret'}, content_type='application/json'
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('access', response.json()['tokens'])
+        user.refresh_from_db()
+        self.assertIsNotNone(user.last_login)
+
+
+class RecordActivityTests(SimpleTestCase):
+    def setUp(self):
+        activity._recently_recorded.clear()
+        self.addCleanup(activity._recently_recorded.clear)
+        self.client = mock.Mock()
+        patcher = mock.patch('accounts.activity.get_activity_redis', return_value=self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_each_user_is_recorded_once_per_interval(self):
+        activity.record_activity(1)
+        activity.record_activity(1)
+        activity.record_activity(2)
+
+        self.assertEqual(self.client.zadd.call_count, 2)
+        self.assertEqual(self.client.zadd.call_args_list[0].args[0], activity.ACTIVITY_KEY)
+
+    def test_redis_errors_never_reach_the_request(self):
+        self.client.zadd.side_effect = redis.TimeoutError("Timeout reading from socket")
+
+        with self.assertLogs('accounts.activity', 'WARNING'):
+            activity.record_activity(1)
+
+
+def _activity_redis_available():
+    try:
+        return redis.Redis.from_url(ACTIVITY_TEST_REDIS_URL, socket_connect_timeout=0.2).ping()
+    except redis.RedisError:
+        return False
+
+
+@unittest.skipUnless(_activity_redis_available(), f"Needs a Redis server at {ACTIVITY_TEST_REDIS_URL}.")
+class FlushActivityTests(TestCase):
+    def setUp(self):
+        self.redis = redis.Redis.from_url(ACTIVITY_TEST_REDIS_URL)
+        self.redis.delete(activity.ACTIVITY_KEY, activity.FLUSHING_KEY)
+        self.addCleanup(self.redis.delete, activity.ACTIVITY_KEY, activity.FLUSHING_KEY)
+        patcher = mock.patch('accounts.activity.get_activity_redis', return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.users = [
+            User.objects.create_user(email=f'user{index}@example.com', name=f'User {index}', password='secret')
+            for index in range(3)
+        ]
+
+    def test_flush_writes_last_activity_in_batches(self):
+        seen_at = datetime.datetime(2026, 10, 19, 12, 0, tzinfo=datetime.timezone.utc)
+        self.redis.zadd(activity.ACTIVITY_KEY, {user.pk: seen_at.timestamp() for user in self.users})
+
+        self.assertEqual(activity.flush_activity(batch_size=2), 3)
+
+        self.assertEqual(set(User.objects.values_list('last_activity_at', flat=True)), {seen_at})
+        self.assertFalse(self.redis.exists(activity.ACTIVITY_KEY, activity.FLUSHING_KEY))
+        self.assertEqual(activity.flush_activity(), 0)
+
+    def test_older_activity_never_overwrites_newer(self):
+        newer = datetime.datetime(2026, 10, 19, 12, 0, tzinfo=datetime.timezone.utc)
+        User.objects.filter(pk=self.users[0].pk).update(last_activity_at=newer)
+        self.redis.zadd(activity.ACTIVITY_KEY, {self.users[0].pk: (newer - datetime.timedelta(hours=1)).timestamp()})
+
+        self.assertEqual(activity.flush_activity(), 0)
+
+        self.users[0].refresh_from_db()
+        self.assertEqual(self.users[0].last_activity_at, newer)
+
+    def test_set_left_by_an_interrupted_flush_is_written_first(self):
+        seen_at = datetime.datetime(2026, 10, 19, 12, 0, tzinfo=datetime.timezone.utc)
+        self.redis.zadd(activity.FLUSHING_KEY, {self.users[0].pk: seen_at.timestamp()})
+        self.redis.zadd(activity.ACTIVITY_KEY, {self.users[1].pk: seen_at.timestamp()})
+
+        self.assertEqual(activity.flush_activity(), 1)
+        self.users[0].refresh_from_db()
+        self.assertEqual(self.users[0].last_activity_at, seen_at)
+        # Recorded meanwhile: kept for the next flush
+        self.assertEqual(self.redis.zcard(activity.ACTIVITY_KEY), 1)
+        self.assertEqual(activity.flush_activity(), 1)
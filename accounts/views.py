@@ -14,10 +14,12 @@ from .serializers import(
     VerifyAccountSerializer   # Added
                          )
 from .models import User
+from .activity import record_activity
 from .renderer import UserRenderer # Assuming you have this custom renderer
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.authtoken.models import Token
 from django.contrib.auth import authenticate, login, logout, update_session_auth_hash
+from django.contrib.auth.models import update_last_login
 from rest_framework_simplejwt.tokens import RefreshToken, TokenError
 import logging
 from django.conf import settings # Import settings
@@ -29,6 +31,9 @@ logger = logging.getLogger(__name__)
 
 
 def get_tokens_for_user(user):
+    # Issuing tokens is a login: stamp last_login (authenticate() does not) and count it as activity
+    update_last_login(None, user)
+    record_activity(user.pk)
     refresh = RefreshToken.for_user(user)
 
     return {
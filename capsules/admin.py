@@ -1,17 +1,18 @@
 from django.contrib import admin
-from .models import Capsule, CapsuleContent, CapsuleRecipient, DeliveryLog, Notification
+from .models import Capsule, CapsuleContent, CapsuleContentVariant, CapsuleRecipient, CapsuleReminder, DeadLetterDelivery, DeliveryLog, DeliveryLogDailySummary, MediaBlob, MediaUpload, Notification, OutboxMessage
+from .admin_performance import LargeTableAdminMixin
 
 # Register your models here.
 
 @admin.register(Capsule)
-class CapsuleAdmin(admin.ModelAdmin):
+class CapsuleAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = (
         'id', 'title', 'owner', 'creation_date', 'delivery_date', 'is_delivered', 'privacy_status', 'is_archived'
     )
-    list_filter = ('is_delivered', 'privacy_status', 'is_archived', 'delivery_method')
+    list_filter = ('is_delivered', 'privacy_status', 'is_archived', 'delivery_method', ('delivery_date', admin.DateFieldListFilter))
     search_fields = ('title', 'owner__email', 'owner__name')
-    date_hierarchy = 'delivery_date'
     ordering = ('-delivery_date',)
+    list_select_related = ('owner',)
     fieldsets = (
         (None, {
             'fields': ('title', 'owner', 'description', 'creation_date', 'delivery_date', 'delivery_time', 'is_delivered', 'is_archived')
@@ -20,20 +21,67 @@ class CapsuleAdmin(admin.ModelAdmin):
             'fields': ('delivery_method', 'privacy_status')
         }),
         ('Legacy Management', {
-            'fields': ('transfer_on_inactivity', 'transfer_recipient_email')
+            'fields': ('transfer_on_inactivity', 'transfer_recipient_email', 'transferred_at')
         }),
     )
     raw_id_fields = ('owner',)
 
 @admin.register(CapsuleContent)
-class CapsuleContentAdmin(admin.ModelAdmin):
+class CapsuleContentAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = ('id', 'capsule', 'content_type', 'upload_date', 'order')
     list_filter = ('content_type',)
     search_fields = ('capsule__title',)
     ordering = ('capsule', 'order')
+    list_select_related = ('capsule__owner',)
+    raw_id_fields = ('capsule', 'blob')
+
+@admin.register(CapsuleContentVariant)
+class CapsuleContentVariantAdmin(LargeTableAdminMixin, admin.ModelAdmin):
+    list_display = ('id', 'content', 'kind', 'format', 'width', 'height', 'file_size', 'created_at')
+    list_filter = ('kind', 'format')
+    ordering = ('-created_at',)
+    list_select_related = ('content__capsule',)
+    raw_id_fields = ('content',)
+
+@admin.register(MediaBlob)
+class MediaBlobAdmin(LargeTableAdminMixin, admin.ModelAdmin):
+    list_display = ('id', 'sha256', 'file_size', 'reference_count', 'created_at')
+    search_fields = ('sha256',)
+    ordering = ('-created_at',)
+    readonly_fields = ('sha256', 'reference_count')
+
+@admin.register(MediaUpload)
+class MediaUploadAdmin(admin.ModelAdmin):
+    list_display = ('id', 'owner', 'filename', 'offset', 'upload_length', 'status', 'updated_at')
+    list_filter = ('status',)
+    ordering = ('-created_at',)
+    list_select_related = ('owner',)
+    raw_id_fields = ('owner',)
+
+@admin.register(DeadLetterDelivery)
+class DeadLetterDeliveryAdmin(LargeTableAdminMixin, admin.ModelAdmin):
+    list_display = ('id', 'capsule', 'recipient', 'delivery_method', 'is_permanent', 'attempts', 'created_at', 'replayed_at')
+    list_filter = ('delivery_method', 'is_permanent', ('replayed_at', admin.EmptyFieldListFilter))
+    ordering = ('-id',)
+    list_select_related = ('capsule__owner', 'recipient__capsule')
+    raw_id_fields = ('capsule', 'recipient')
+
+@admin.register(OutboxMessage)
+class OutboxMessageAdmin(LargeTableAdminMixin, admin.ModelAdmin):
+    list_display = ('id', 'task_name', 'args', 'eta', 'created_at', 'published_at')
+    list_filter = ('task_name', ('published_at', admin.EmptyFieldListFilter))
+    ordering = ('-id',)
+
+@admin.register(CapsuleReminder)
+class CapsuleReminderAdmin(LargeTableAdminMixin, admin.ModelAdmin):
+    list_display = ('id', 'capsule', 'days_before', 'created_at')
+    list_filter = ('days_before',)
+    ordering = ('-created_at',)
+    list_select_related = ('capsule__owner',)
+    raw_id_fields = ('capsule',)
 
 @admin.register(CapsuleRecipient)
-class CapsuleRecipientAdmin(admin.ModelAdmin):
+class CapsuleRecipientAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = (
         'id', 
         'capsule_title', 
@@ -46,25 +94,39 @@ class CapsuleRecipientAdmin(admin.ModelAdmin):
     list_filter = ('received_status', 'capsule__delivery_date')
     search_fields = ('recipient_email', 'capsule__title')
     readonly_fields = ('access_token', 'token_generated_at', 'sent_date') # Make token fields read-only
+    list_select_related = ('capsule',)
+    raw_id_fields = ('capsule', 'recipient_user')
 
     def capsule_title(self, obj):
         return obj.capsule.title
     capsule_title.short_description = 'Capsule Title' # Column header
+    capsule_title.admin_order_field = 'capsule__title'
 
 @admin.register(DeliveryLog)
-class DeliveryLogAdmin(admin.ModelAdmin):
+class DeliveryLogAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = (
         'id', 'capsule', 'delivery_attempt_time', 'delivery_method', 'recipient_email', 'recipient_user', 'status'
     )
-    list_filter = ('delivery_method', 'status')
+    list_filter = ('delivery_method', 'status', ('delivery_attempt_time', admin.DateFieldListFilter))
     search_fields = ('capsule__title', 'recipient_email', 'recipient_user__email')
     ordering = ('-delivery_attempt_time',)
+    list_select_related = ('capsule__owner', 'recipient_user')
+    raw_id_fields = ('capsule', 'recipient_user')
+
+@admin.register(DeliveryLogDailySummary)
+class DeliveryLogDailySummaryAdmin(admin.ModelAdmin):
+    list_display = ('day', 'delivery_method', 'status', 'attempt_count')
+    list_filter = ('delivery_method', 'status')
+    date_hierarchy = 'day'
+    ordering = ('-day',)
 
 @admin.register(Notification)
-class NotificationAdmin(admin.ModelAdmin):
+class NotificationAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = (
         'id', 'user', 'capsule', 'notification_type', 'is_read', 'created_at', 'read_at'
     )
     list_filter = ('notification_type', 'is_read')
     search_fields = ('user__email', 'capsule__title', 'message')
     ordering = ('-created_at',)
+    list_select_related = ('user', 'capsule__owner')
+    raw_id_fields = ('user', 'capsule')
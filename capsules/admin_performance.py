@@ -0,0 +1,77 @@
+# capsules/admin_performance.py
+"""
+Helpers that keep Django admin changelists fast on very large tables.
+"""
+import json
+import logging
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import QuerySet
+from django.utils.functional import cached_property
+
+logger = logging.getLogger(__name__)
+
+# Below this many (estimated) rows an exact COUNT(*) is cheap enough to run
+ESTIMATED_COUNT_THRESHOLD = getattr(settings, 'ADMIN_ESTIMATED_COUNT_THRESHOLD', 10000)
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that reports PostgreSQL's row estimate instead of running COUNT(*) on large tables.
+    Unfiltered querysets use pg_class.reltuples (summed over partitions for partitioned tables),
+    filtered ones use the planner's row estimate for the query.
+    """
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not isinstance(queryset, QuerySet) or connections[queryset.db].vendor != 'postgresql':
+            return super().count
+
+        try:
+            if queryset.query.where:
+                estimate = self._planner_estimate(queryset)
+            else:
+                estimate = self._table_estimate(queryset)
+        except Exception as e:
+            logger.warning(f"Could not estimate row count for {queryset.model.__name__}, falling back to COUNT(*): {e}")
+            return super().count
+
+        if estimate < ESTIMATED_COUNT_THRESHOLD:
+            return super().count
+        return estimate
+
+    @staticmethod
+    def _table_estimate(queryset):
+        table_name = queryset.model._meta.db_table
+        with connections[queryset.db].cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT COALESCE(SUM(GREATEST(reltuples, 0)), 0)::bigint
+                FROM pg_class
+                WHERE oid = to_regclass(%s)
+                   OR oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = to_regclass(%s))
+                """,
+                [table_name, table_name]
+            )
+            return cursor.fetchone()[0]
+
+    @staticmethod
+    def _planner_estimate(queryset):
+        sql, params = queryset.order_by().query.sql_with_params()
+        with connections[queryset.db].cursor() as cursor:
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+
+
+class LargeTableAdminMixin:
+    """
+    ModelAdmin mixin for tables with millions of rows: estimated page counts and no
+    second "x of y total" COUNT(*) in the changelist.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
@@ -0,0 +1,98 @@
+# capsules/archives.py
+"""
+On-the-fly ZIP archives of a capsule's contents.
+The archive is written to a small in-memory buffer that is drained after every chunk, so a capsule
+of any size is streamed with bounded memory and without temporary files.
+"""
+import logging
+import zipfile
+
+from django.utils import timezone
+
+from .models import CapsuleContentType
+from .utils import open_content_stream
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_CHUNK_SIZE = 64 * 1024
+
+# Images, video and audio are already compressed; deflating them again only costs CPU
+STORED_CONTENT_TYPES = {CapsuleContentType.IMAGE, CapsuleContentType.VIDEO, CapsuleContentType.AUDIO}
+
+
+class _ZipStreamBuffer:
+    """
+    Write-only, non-seekable file object for zipfile. zipfile falls back to data descriptors
+    when it cannot seek, so entries can be written without knowing their size up front.
+    """
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _archive_entry_name(content, position):
+    if content.content_type == CapsuleContentType.TEXT:
+        base_name = f"message_{content.id}.txt"
+    else:
+        base_name = content.download_name or f"file_{content.id}"
+    return f"{position:03d}_{base_name}"
+
+
+def _zip_info(name, content, compress_type):
+    local_upload_date = timezone.localtime(content.upload_date)
+    info = zipfile.ZipInfo(name, date_time=local_upload_date.timetuple()[:6])
+    info.compress_type = compress_type
+    return info
+
+
+def iter_capsule_zip(capsule, chunk_size=ARCHIVE_CHUNK_SIZE):
+    """
+    Yields the bytes of a ZIP archive containing every content item of the capsule.
+    Files are fetched from the media host one at a time and copied into the archive chunk by chunk.
+    """
+    buffer = _ZipStreamBuffer()
+    with zipfile.ZipFile(buffer, mode='w') as archive:
+        contents = capsule.contents.order_by('order', 'pk')
+        for position, content in enumerate(contents.iterator(chunk_size=200), start=1):
+            name = _archive_entry_name(content, position)
+
+            if content.content_type == CapsuleContentType.TEXT or not content.file:
+                text = content.text_content or ''
+                archive.writestr(_zip_info(name, content, zipfile.ZIP_DEFLATED), text.encode('utf-8'))
+                yield buffer.drain()
+                continue
+
+            try:
+                response = open_content_stream(content)
+            except Exception as e:
+                # Skip files the media host cannot serve rather than failing the whole archive
+                logger.error(f"Could not fetch CapsuleContent ID {content.id} for capsule ID {capsule.id} archive: {e}")
+                continue
+
+            compress_type = zipfile.ZIP_STORED if content.content_type in STORED_CONTENT_TYPES else zipfile.ZIP_DEFLATED
+            try:
+                with archive.open(_zip_info(name, content, compress_type), mode='w', force_zip64=True) as entry:
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        entry.write(chunk)
+                        yield buffer.drain()
+            finally:
+                response.close()
+            yield buffer.drain()
+    # Closing the archive writes the central directory
+    yield buffer.drain()
@@ -0,0 +1,83 @@
+# capsules/blobs.py
+"""
+Content-addressed storage for capsule media.
+
+Uploaded files are hashed chunk by chunk (never read into memory whole) and stored once per
+SHA-256 digest as a MediaBlob. Every CapsuleContent using the blob holds a reference; the stored
+asset is destroyed only when the reference count drops to zero. Content items created for an
+existing blob copy the variants of an earlier item instead of being processed again.
+
+acquire_blob() is meant to run outside the transaction that creates the content: the upload and
+the blob row lock then last only as long as the blob's own INSERT or UPDATE, and a caller whose
+transaction fails gives the reference back with release_blob().
+"""
+import hashlib
+import logging
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import MediaBlob
+
+logger = logging.getLogger(__name__)
+
+
+def compute_sha256(uploaded_file):
+    """
+    Returns (hex_digest, size) of an uploaded file, reading it in chunks.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in uploaded_file.chunks():
+        digest.update(chunk)
+        size += len(chunk)
+    uploaded_file.seek(0)
+    return digest.hexdigest(), size
+
+
+def _reference_existing_blob(sha256):
+    # UPDATE takes the row lock, so this cannot interleave with release_blob deleting the row
+    if MediaBlob.objects.filter(sha256=sha256).update(reference_count=F('reference_count') + 1):
+        return MediaBlob.objects.get(sha256=sha256)
+    return None
+
+
+def acquire_blob(uploaded_file):
+    """
+    Returns the MediaBlob for the file's contents with one more reference, uploading the file
+    only if no blob with the same SHA-256 exists yet.
+    """
+    sha256, size = compute_sha256(uploaded_file)
+    blob = _reference_existing_blob(sha256)
+    if blob is not None:
+        logger.info(f"Reusing stored blob {sha256[:12]} for '{uploaded_file.name}' ({size} bytes).")
+        return blob
+
+    blob = MediaBlob(sha256=sha256, file_size=size, reference_count=1)
+    blob.file = uploaded_file
+    try:
+        with transaction.atomic():
+            blob.save()
+    except IntegrityError:
+        # Another request stored the same bytes first; drop our copy and share theirs
+        blob.destroy_file()
+        blob = _reference_existing_blob(sha256)
+        if blob is None:
+            raise
+    return blob
+
+
+def release_blob(blob_id):
+    """
+    Drops one reference to a blob. The row is deleted with the last reference and its stored
+    file destroyed once the surrounding transaction commits.
+    """
+    with transaction.atomic():
+        blob = MediaBlob.objects.select_for_update().filter(pk=blob_id).first()
+        if blob is None:
+            return
+        if blob.reference_count > 1:
+            MediaBlob.objects.filter(pk=blob_id).update(reference_count=F('reference_count') - 1)
+            return
+        blob.delete()
+        transaction.on_commit(blob.destroy_file, robust=True)
@@ -0,0 +1,53 @@
+# capsules/caching.py
+"""
+Per-user cache keys for the aggregated read endpoints (dashboard summary, calendar).
+
+Every key embeds a per-user version number. Writes that change what those endpoints report
+(capsule or notification saves and deletes) bump the version, which orphans all of the user's
+cached entries at once; they then expire on their own TTL.
+"""
+import time
+
+from django.core.cache import cache
+
+VERSION_KEY = 'user-cache-version:{user_id}'
+
+
+def _fresh_version():
+    # Never reuses a number an evicted version key may have had
+    return time.time_ns()
+
+
+def get_user_cache_version(user_id):
+    key = VERSION_KEY.format(user_id=user_id)
+    version = cache.get(key)
+    if version is None:
+        # add() so two concurrent first requests do not overwrite a bump
+        cache.add(key, _fresh_version(), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_user_cache_version(user_id):
+    key = VERSION_KEY.format(user_id=user_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, _fresh_version(), None)
+
+
+def user_cache_key(user_id, name, *parts):
+    suffix = ':'.join(str(part) for part in parts)
+    return f"{name}:{user_id}:v{get_user_cache_version(user_id)}" + (f":{suffix}" if suffix else '')
+
+
+def get_or_set_for_user(user_id, name, compute, timeout, *parts):
+    """
+    Returns the cached value of `name` for the user, computing and caching it on a miss.
+    """
+    key = user_cache_key(user_id, name, *parts)
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        cache.set(key, value, timeout)
+    return value
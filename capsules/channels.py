@@ -0,0 +1,230 @@
+# capsules/channels.py
+"""
+Delivery channels for capsules (email, in-app, SMS) behind one batch interface.
+
+deliver_capsule_task streams a capsule's pending recipients in keyset batches and passes each
+batch to the channel of the capsule's delivery_method. Every channel implements
+send_many(capsule, recipients) and returns the recipients it cannot reach (no account for
+in-app, no phone number for SMS); those fall back to email.
+
+- Email keeps one task per recipient, so each send goes through the rate limiter, backoff and
+  dead-letter handling of deliver_capsule_email_task.
+- In-app delivers a whole batch with one bulk INSERT of notifications plus a few bulk updates.
+- SMS sends a batch through the configured SMS backend (see capsules.sms). Failed messages are
+  retried with backoff through deliver_capsule_recipients_task and dead-lettered after
+  DELIVERY_MAX_RETRIES retries; without a configured backend the batch falls back to email.
+"""
+import logging
+import uuid
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils import timezone
+
+from .delivery_failures import backoff_delay, dead_letter_delivery
+from .models import (
+    Capsule,
+    CapsuleDeliveryMethod,
+    CapsuleRecipient,
+    CapsuleRecipientStatus,
+    DeliveryLog,
+    DeliveryLogStatus,
+    Notification,
+    NotificationType,
+)
+from .signals import invalidate_user_cache_on_commit
+from .sms import get_sms_backend
+
+logger = logging.getLogger(__name__)
+logger.disabled = settings.DISABLE_LOGGING
+
+RECIPIENT_FIELDS = ('id', 'recipient_email', 'recipient_user_id', 'recipient_phone', 'access_token')
+
+
+def owner_display_name(owner):
+    return owner.name or owner.email or "A friend"
+
+
+def capsule_link(access_token):
+    return f"{settings.FRONTEND_BASE_URL}/view-capsule/{access_token}/"
+
+
+def _mark_delivered(capsule, recipients, delivery_method):
+    """Bulk-records successful deliveries to `recipients` and tells the owner once per batch."""
+    now = timezone.now()
+    recipient_ids = [recipient['id'] for recipient in recipients]
+    with transaction.atomic():
+        CapsuleRecipient.objects.filter(pk__in=recipient_ids).update(received_status=CapsuleRecipientStatus.SENT, sent_date=now)
+        Capsule.objects.filter(pk=capsule.pk).update(is_delivered=True, is_unlocked=True)
+        DeliveryLog.objects.bulk_create([
+            DeliveryLog(
+                capsule_id=capsule.pk,
+                delivery_method=delivery_method,
+                recipient_email=recipient['recipient_email'],
+                recipient_user_id=recipient['recipient_user_id'],
+                status=DeliveryLogStatus.SUCCESS,
+            )
+            for recipient in recipients
+        ])
+        Notification.objects.create(
+            user_id=capsule.owner_id,
+            capsule_id=capsule.pk,
+            message=f"Your time capsule '{capsule.title}' has been delivered to {len(recipients)} recipient(s) by {CapsuleDeliveryMethod(delivery_method).label}.",
+            notification_type=NotificationType.DELIVERY_SUCCESS
+        )
+
+
+class DeliveryChannel:
+    method = None
+
+    def __init__(self, attempt=0):
+        # Number of earlier attempts at the recipients this channel is given (retries)
+        self.attempt = attempt
+
+    def send_many(self, capsule, recipients):
+        """
+        Delivers `capsule` to `recipients` (dicts with RECIPIENT_FIELDS) and returns the
+        recipients this channel cannot reach.
+        """
+        raise NotImplementedError
+
+
+class EmailChannel(DeliveryChannel):
+    method = CapsuleDeliveryMethod.EMAIL
+
+    def send_many(self, capsule, recipients):
+        from .tasks import deliver_capsule_email_task
+
+        for recipient in recipients:
+            deliver_capsule_email_task.apply_async(args=[capsule.pk, recipient['id']])
+        return []
+
+
+class InAppChannel(DeliveryChannel):
+    method = CapsuleDeliveryMethod.IN_APP
+
+    def send_many(self, capsule, recipients):
+        registered = [recipient for recipient in recipients if recipient['recipient_user_id']]
+        if registered:
+            owner_name = owner_display_name(capsule.owner)
+            with transaction.atomic():
+                Notification.objects.bulk_create([
+                    Notification(
+                        user_id=recipient['recipient_user_id'],
+                        capsule_id=capsule.pk,
+                        message=f"{owner_name} shared the time capsule '{capsule.title}' with you. It is now unlocked.",
+                        notification_type=NotificationType.NEW_SHARED_CAPSULE
+                    )
+                    for recipient in registered
+                ])
+                _mark_delivered(capsule, registered, self.method)
+                # bulk_create sends no post_save, so cached unread counts are invalidated here
+                for user_id in {recipient['recipient_user_id'] for recipient in registered}:
+                    invalidate_user_cache_on_commit(user_id)
+        return [recipient for recipient in recipients if not recipient['recipient_user_id']]
+
+
+class SmsChannel(DeliveryChannel):
+    method = CapsuleDeliveryMethod.SMS
+
+    def send_many(self, capsule, recipients):
+        reachable = [recipient for recipient in recipients if recipient['recipient_phone']]
+        unreachable = [recipient for recipient in recipients if not recipient['recipient_phone']]
+        if not reachable:
+            return unreachable
+
+        for recipient in reachable:
+            if not recipient['access_token']:
+                recipient['access_token'] = uuid.uuid4()
+                CapsuleRecipient.objects.filter(pk=recipient['id']).update(
+                    access_token=recipient['access_token'], token_generated_at=timezone.now()
+                )
+        owner_name = owner_display_name(capsule.owner)
+        try:
+            errors = get_sms_backend().send_messages([
+                (
+                    recipient['recipient_phone'],
+                    f"{owner_name} sent you a time capsule, '{capsule.title}': {capsule_link(recipient['access_token'])}"
+                )
+                for recipient in reachable
+            ])
+        except ImproperlyConfigured as e:
+            logger.error(f"SMS delivery of capsule ID {capsule.pk} unavailable, sending by email instead: {e}")
+            return recipients
+
+        sent = [recipient for recipient, error in zip(reachable, errors) if error is None]
+        if sent:
+            _mark_delivered(capsule, sent, self.method)
+        failed = [(recipient, error) for recipient, error in zip(reachable, errors) if error is not None]
+        if failed:
+            self._handle_failures(capsule, failed)
+        return unreachable
+
+    def _handle_failures(self, capsule, failed):
+        from .tasks import deliver_capsule_recipients_task
+
+        DeliveryLog.objects.bulk_create([
+            DeliveryLog(
+                capsule_id=capsule.pk,
+                delivery_method=self.method,
+                recipient_email=recipient['recipient_email'],
+                recipient_user_id=recipient['recipient_user_id'],
+                status=DeliveryLogStatus.FAILURE,
+                error_message="SMS sending failed.",
+                details=error
+            )
+            for recipient, error in failed
+        ])
+        if self.attempt < settings.DELIVERY_MAX_RETRIES:
+            countdown = backoff_delay(self.attempt)
+            deliver_capsule_recipients_task.apply_async(
+                args=[capsule.pk, [recipient['id'] for recipient, _ in failed]],
+                kwargs={'attempt': self.attempt + 1},
+                countdown=countdown,
+                queue=settings.DELIVERY_RETRY_QUEUE
+            )
+            logger.warning(f"SMS sending failed for {len(failed)} recipient(s) of capsule ID {capsule.pk}; retrying in {countdown:.0f}s.")
+            return
+        for recipient, error in failed:
+            dead_letter_delivery(capsule.pk, recipient['id'], error, False, self.attempt + 1, self.method)
+
+
+CHANNELS = {
+    CapsuleDeliveryMethod.EMAIL: EmailChannel,
+    CapsuleDeliveryMethod.IN_APP: InAppChannel,
+    CapsuleDeliveryMethod.SMS: SmsChannel,
+}
+
+
+def _dispatch(capsule, pending, batch_size, attempt=0):
+    channel = CHANNELS.get(capsule.delivery_method, EmailChannel)(attempt)
+    pending = pending.filter(received_status=CapsuleRecipientStatus.PENDING).order_by('pk').values(*RECIPIENT_FIELDS)
+    handled_count = 0
+    last_pk = 0
+    while True:
+        recipients = list(pending.filter(pk__gt=last_pk)[:batch_size])
+        if not recipients:
+            break
+        last_pk = recipients[-1]['id']
+        unreachable = channel.send_many(capsule, recipients)
+        if unreachable:
+            EmailChannel().send_many(capsule, unreachable)
+        handled_count += len(recipients)
+    return handled_count
+
+
+def dispatch_capsule(capsule, batch_size=1000):
+    """
+    Delivers `capsule` to all of its pending recipients through its delivery channel, falling
+    back to email for recipients the channel cannot reach. Returns the number of recipients handled.
+    """
+    return _dispatch(capsule, CapsuleRecipient.objects.filter(capsule=capsule), batch_size)
+
+
+def dispatch_recipients(capsule, recipient_ids, attempt=0, batch_size=1000):
+    """
+    Like dispatch_capsule(), limited to the pending recipients among `recipient_ids` (retries and
+    dead-letter replays). `attempt` counts the earlier attempts at them.
+    """
+    return _dispatch(capsule, CapsuleRecipient.objects.filter(capsule=capsule, pk__in=recipient_ids), batch_size, attempt)
@@ -0,0 +1,85 @@
+# capsules/dashboard.py
+"""
+Aggregates behind the dashboard and delivery calendar endpoints, computed in SQL and cached
+per user (see capsules.caching for invalidation).
+"""
+import datetime
+
+from django.conf import settings
+from django.db.models import Count, F, Q
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from .caching import get_or_set_for_user
+from .models import Capsule, Notification
+
+
+def _compute_dashboard_summary(user):
+    today = timezone.localdate()
+    week_end = today + datetime.timedelta(days=7)
+    capsules = Capsule.objects.filter(owner=user)
+
+    # One aggregate query for all counters
+    counts = capsules.aggregate(
+        total=Count('pk'),
+        delivered=Count('pk', filter=Q(is_delivered=True)),
+        pending=Count('pk', filter=Q(is_delivered=False)),
+        archived=Count('pk', filter=Q(is_archived=True)),
+        upcoming_this_week=Count(
+            'pk', filter=Q(is_delivered=False, delivery_date__gte=today, delivery_date__lt=week_end)
+        ),
+    )
+
+    # Walks the (owner, delivery_date) index and stops after the limit
+    upcoming = list(
+        capsules
+        .filter(is_delivered=False, delivery_date__gte=today)
+        .order_by('delivery_date', 'delivery_time', 'pk')
+        .values('id', 'title', 'delivery_date', 'delivery_time')[:settings.DASHBOARD_UPCOMING_LIMIT]
+    )
+
+    return {
+        'counts': counts,
+        'upcoming': upcoming,
+        'unread_notifications': Notification.objects.unread_for(user).count(),
+    }
+
+
+def get_dashboard_summary(user):
+    return get_or_set_for_user(
+        user.id, 'dashboard-summary', lambda: _compute_dashboard_summary(user),
+        settings.DASHBOARD_CACHE_TIMEOUT, timezone.localdate().isoformat()
+    )
+
+
+def _compute_delivery_calendar(user, start_date, end_date, granularity):
+    capsules = Capsule.objects.filter(owner=user, delivery_date__gte=start_date, delivery_date__lte=end_date)
+    if granularity == 'month':
+        capsules = capsules.annotate(period=TruncMonth('delivery_date'))
+    else:
+        capsules = capsules.annotate(period=F('delivery_date'))
+
+    rows = (
+        capsules
+        .values('period')
+        .annotate(
+            scheduled=Count('pk', filter=Q(is_delivered=False)),
+            delivered=Count('pk', filter=Q(is_delivered=True)),
+        )
+        .order_by('period')
+    )
+    return [
+        {'period': row['period'], 'scheduled': row['scheduled'], 'delivered': row['delivered']}
+        for row in rows
+    ]
+
+
+def get_delivery_calendar(user, start_date, end_date, granularity):
+    """
+    Per-day or per-month counts of the user's scheduled and delivered capsules with
+    delivery_date in [start_date, end_date]. Periods without capsules are omitted.
+    """
+    return get_or_set_for_user(
+        user.id, 'delivery-calendar', lambda: _compute_delivery_calendar(user, start_date, end_date, granularity),
+        settings.CALENDAR_CACHE_TIMEOUT, granularity, start_date.isoformat(), end_date.isoformat()
+    )
@@ -0,0 +1,136 @@
+# capsules/delivery_failures.py
+"""
+Failed capsule deliveries: error classification, retry backoff and the dead-letter table.
+
+Transient errors (connection problems, 4xx SMTP replies, rate limits) are retried with
+exponential backoff and full jitter, so a provider outage does not come back as synchronized
+retry waves. Permanent errors (5xx replies about the recipient, malformed addresses) are not
+retried. Either way a delivery that will not be retried again ends up in DeadLetterDelivery,
+from where replay_dead_letters() (the replay_dead_letters command) re-queues it in bulk.
+"""
+import logging
+import random
+import smtplib
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import (
+    CapsuleDeliveryMethod,
+    CapsuleRecipient,
+    CapsuleRecipientStatus,
+    DeadLetterDelivery,
+    Notification,
+    NotificationType,
+)
+from .outbox import enqueue_tasks
+
+logger = logging.getLogger(__name__)
+logger.disabled = settings.DISABLE_LOGGING
+
+
+class DeliveryError(Exception):
+    """A delivery attempt failed; `permanent` says whether retrying could ever help."""
+    def __init__(self, message, permanent=False):
+        super().__init__(message)
+        self.permanent = permanent
+
+
+def is_permanent_email_error(exc):
+    """
+    Whether sending failed for a reason retrying will not fix: a 5xx reply about the recipient
+    or the message, or an address that cannot be encoded. Authentication and sender errors are
+    configuration problems and count as transient, so deliveries resume once they are fixed.
+    """
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        return bool(exc.recipients) and all(code >= 500 for code, _ in exc.recipients.values())
+    if isinstance(exc, (smtplib.SMTPAuthenticationError, smtplib.SMTPSenderRefused)):
+        return False
+    if isinstance(exc, smtplib.SMTPResponseException):
+        return 500 <= exc.smtp_code < 600
+    return isinstance(exc, (ValueError, UnicodeError))
+
+
+def backoff_delay(retries):
+    """
+    Seconds to wait before retry number `retries` + 1: uniformly random between zero and an
+    exponentially growing, capped ceiling ("full jitter").
+    """
+    ceiling = min(settings.DELIVERY_RETRY_MAX_SECONDS, settings.DELIVERY_RETRY_BASE_SECONDS * 2 ** retries)
+    return random.uniform(0, ceiling)
+
+
+def dead_letter_delivery(capsule_id, recipient_id, error_message, permanent, attempts, delivery_method):
+    """
+    Gives up on a delivery: records it in the dead-letter table, marks the recipient FAILED and
+    tells the owner.
+    """
+    with transaction.atomic():
+        recipient = (
+            CapsuleRecipient.objects
+            .filter(pk=recipient_id, capsule_id=capsule_id)
+            .values('recipient_email', 'capsule__title', 'capsule__owner_id')
+            .first()
+        )
+        if recipient is None:
+            return
+        DeadLetterDelivery.objects.create(
+            capsule_id=capsule_id,
+            recipient_id=recipient_id,
+            delivery_method=delivery_method,
+            error_message=error_message,
+            is_permanent=permanent,
+            attempts=attempts,
+        )
+        CapsuleRecipient.objects.filter(pk=recipient_id).update(received_status=CapsuleRecipientStatus.FAILED)
+        Notification.objects.create(
+            user_id=recipient['capsule__owner_id'],
+            capsule_id=capsule_id,
+            message=f"Failed to deliver your time capsule '{recipient['capsule__title']}' to {recipient['recipient_email']}. Reason: {error_message}",
+            notification_type=NotificationType.DELIVERY_FAIL
+        )
+    logger.error(f"Delivery of capsule ID {capsule_id} to recipient ID {recipient_id} dead-lettered after {attempts} attempt(s): {error_message}")
+
+
+def replay_dead_letters(queryset, batch_size=1000):
+    """
+    Re-queues the open dead letters in `queryset`: in primary-key batches, their recipients are
+    reset to PENDING, the rows are marked replayed and the delivery tasks go to the outbox.
+    Returns the number of deliveries replayed.
+    """
+    from .tasks import deliver_capsule_email_task, deliver_capsule_recipients_task
+
+    open_letters = (
+        queryset
+        .filter(replayed_at__isnull=True)
+        .order_by('pk')
+        .values_list('pk', 'capsule_id', 'recipient_id', 'delivery_method')
+    )
+    replayed_count = 0
+    last_pk = 0
+    while True:
+        letters = list(open_letters.filter(pk__gt=last_pk)[:batch_size])
+        if not letters:
+            break
+        with transaction.atomic():
+            DeadLetterDelivery.objects.filter(pk__in=[letter[0] for letter in letters]).update(replayed_at=timezone.now())
+            CapsuleRecipient.objects.filter(pk__in=[letter[2] for letter in letters]).update(
+                received_status=CapsuleRecipientStatus.PENDING
+            )
+            # Email keeps one task per recipient; other channels re-dispatch just the replayed recipients
+            enqueue_tasks(deliver_capsule_email_task.name, [
+                [capsule_id, recipient_id]
+                for _, capsule_id, recipient_id, delivery_method in letters
+                if delivery_method == CapsuleDeliveryMethod.EMAIL
+            ])
+            other_recipient_ids = {}
+            for _, capsule_id, recipient_id, delivery_method in letters:
+                if delivery_method != CapsuleDeliveryMethod.EMAIL:
+                    other_recipient_ids.setdefault(capsule_id, []).append(recipient_id)
+            enqueue_tasks(deliver_capsule_recipients_task.name, [
+                [capsule_id, recipient_ids] for capsule_id, recipient_ids in other_recipient_ids.items()
+            ])
+        replayed_count += len(letters)
+        last_pk = letters[-1][0]
+    return replayed_count
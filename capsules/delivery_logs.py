@@ -0,0 +1,171 @@
+# capsules/delivery_logs.py
+"""
+Maintenance helpers for the DeliveryLog table.
+
+On PostgreSQL the table is declaratively partitioned by month on delivery_attempt_time
+(see migration 0015). Partitions are created ahead of time and old ones are detached and
+dropped once their rows have been rolled up into DeliveryLogDailySummary, so retention
+never turns into a row-by-row DELETE. There is no DEFAULT partition: rows in it would make
+creating the partition for their month fail. Partition bounds and summary days are both in UTC.
+
+Operational dependency: inserts only succeed into months that have a partition. The nightly
+maintain_delivery_log_partitions beat task keeps DELIVERY_LOG_PARTITIONS_AHEAD months ready, so
+if it stops running for longer than that, every DeliveryLog insert fails (and with it the
+delivery bookkeeping) until ensure_partitions() runs again.
+"""
+import datetime
+import logging
+
+from django.db import connection as default_connection
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+
+logger = logging.getLogger(__name__)
+
+PARENT_TABLE = 'capsules_deliverylog'
+PARTITION_PREFIX = f'{PARENT_TABLE}_p'  # e.g. capsules_deliverylog_p202610
+
+
+def month_start(value):
+    return datetime.date(value.year, value.month, 1)
+
+
+def add_months(month, count):
+    years, month_index = divmod(month.month - 1 + count, 12)
+    return datetime.date(month.year + years, month_index + 1, 1)
+
+
+def partition_name(month):
+    return f"{PARTITION_PREFIX}{month:%Y%m}"
+
+
+def _day_bound(day):
+    # Partition bounds and summary days are UTC midnights
+    return datetime.datetime.combine(day, datetime.time.min, tzinfo=datetime.timezone.utc)
+
+
+def is_partitioned(connection=None):
+    connection = connection or default_connection
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)", [PARENT_TABLE])
+        return cursor.fetchone() is not None
+
+
+def existing_partition_months(connection=None):
+    """
+    Returns {month_date: table_name} for every monthly partition attached to the parent table.
+    Partitions not named like a month (none are created by this app) are not included.
+    """
+    connection = connection or default_connection
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT child.relname
+            FROM pg_inherits
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE pg_inherits.inhparent = to_regclass(%s)
+            """,
+            [PARENT_TABLE]
+        )
+        names = [row[0] for row in cursor.fetchall()]
+
+    months = {}
+    for name in names:
+        suffix = name[len(PARTITION_PREFIX):] if name.startswith(PARTITION_PREFIX) else ''
+        if len(suffix) == 6 and suffix.isdigit():
+            months[datetime.date(int(suffix[:4]), int(suffix[4:]), 1)] = name
+    return months
+
+
+def create_partition(month, connection=None):
+    connection = connection or default_connection
+    name = partition_name(month)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF "{PARENT_TABLE}" FOR VALUES FROM (%s) TO (%s)',
+            [_day_bound(month), _day_bound(add_months(month, 1))]
+        )
+    return name
+
+
+def ensure_partitions(months_ahead, start_month=None, connection=None):
+    """
+    Creates monthly partitions from `start_month` (default: the current month) through
+    `months_ahead` months into the future. Returns the names of partitions that were created.
+    """
+    connection = connection or default_connection
+    if not is_partitioned(connection):
+        logger.warning(f"{PARENT_TABLE} is not partitioned; skipping partition creation.")
+        return []
+
+    current_month = month_start(datetime.datetime.now(datetime.timezone.utc).date())
+    month = start_month or current_month
+    last_month = add_months(current_month, months_ahead)
+    existing = existing_partition_months(connection)
+
+    created = []
+    while month <= last_month:
+        if month not in existing:
+            created.append(create_partition(month, connection))
+            logger.info(f"Created delivery log partition {created[-1]}")
+        month = add_months(month, 1)
+    return created
+
+
+def drop_expired_partitions(retain_months, connection=None):
+    """
+    Rolls up and then detaches and drops every monthly partition that ends before the
+    retention window. Returns the names of partitions that were dropped.
+    """
+    connection = connection or default_connection
+    if not is_partitioned(connection):
+        logger.warning(f"{PARENT_TABLE} is not partitioned; skipping partition retention.")
+        return []
+
+    current_month = month_start(datetime.datetime.now(datetime.timezone.utc).date())
+    oldest_kept_month = add_months(current_month, -retain_months)
+
+    dropped = []
+    for month, name in sorted(existing_partition_months(connection).items()):
+        if month >= oldest_kept_month:
+            continue
+        # Make sure the summary table covers the month before its detail rows disappear
+        rollup_delivery_logs(month, add_months(month, 1))
+        with connection.cursor() as cursor:
+            cursor.execute(f'ALTER TABLE "{PARENT_TABLE}" DETACH PARTITION "{name}"')
+            cursor.execute(f'DROP TABLE "{name}"')
+        dropped.append(name)
+        logger.info(f"Dropped delivery log partition {name}")
+    return dropped
+
+
+def rollup_delivery_logs(start_date, end_date):
+    """
+    Recomputes DeliveryLogDailySummary rows for UTC days in [start_date, end_date).
+    Safe to run repeatedly for the same range: existing summary rows are overwritten.
+    """
+    from .models import DeliveryLog, DeliveryLogDailySummary
+
+    rows = (
+        DeliveryLog.objects
+        .filter(
+            delivery_attempt_time__gte=_day_bound(start_date),
+            delivery_attempt_time__lt=_day_bound(end_date),
+        )
+        .annotate(day=TruncDate('delivery_attempt_time', tzinfo=datetime.timezone.utc))
+        .values('day', 'delivery_method', 'status')
+        .annotate(attempt_count=Count('id'))
+        .order_by()
+    )
+    summaries = [DeliveryLogDailySummary(**row) for row in rows]
+    DeliveryLogDailySummary.objects.bulk_create(
+        summaries,
+        batch_size=1000,
+        update_conflicts=True,
+        unique_fields=['day', 'delivery_method', 'status'],
+        update_fields=['attempt_count'],
+    )
+    logger.info(f"Rolled up {len(summaries)} delivery log summary rows for {start_date} to {end_date}.")
+    return len(summaries)
@@ -0,0 +1,44 @@
+# capsules/exports.py
+"""
+Streaming NDJSON export of everything a user owns: capsules, their contents, recipients and delivery logs.
+Each table is walked once with a server-side cursor, so memory use stays flat no matter how many rows there are.
+"""
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Capsule, CapsuleContent, CapsuleRecipient, DeliveryLog
+
+DEFAULT_EXPORT_CHUNK_SIZE = 2000
+
+CAPSULE_EXPORT_FIELDS = (
+    'id', 'title', 'description', 'creation_date', 'delivery_date', 'delivery_time',
+    'is_delivered', 'is_archived', 'is_unlocked', 'delivery_method', 'privacy_status',
+    'transfer_on_inactivity', 'transfer_recipient_email', 'transferred_at',
+)
+CONTENT_EXPORT_FIELDS = ('id', 'capsule_id', 'content_type', 'text_content', 'file', 'upload_date', 'order')
+RECIPIENT_EXPORT_FIELDS = ('id', 'capsule_id', 'recipient_email', 'recipient_phone', 'received_status', 'sent_date')
+DELIVERY_LOG_EXPORT_FIELDS = (
+    'id', 'capsule_id', 'delivery_attempt_time', 'delivery_method', 'recipient_email',
+    'status', 'error_message', 'details',
+)
+
+
+def _ndjson_line(record_type, row):
+    return json.dumps({'type': record_type, **row}, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+
+def iter_user_export(user, chunk_size=DEFAULT_EXPORT_CHUNK_SIZE):
+    """
+    Yields the user's data as NDJSON lines, one record per line with a 'type' key
+    ('capsule', 'content', 'recipient' or 'delivery_log').
+    """
+    exports = (
+        ('capsule', Capsule.objects.filter(owner=user).order_by('pk'), CAPSULE_EXPORT_FIELDS),
+        ('content', CapsuleContent.objects.filter(capsule__owner=user).order_by('capsule_id', 'order', 'pk'), CONTENT_EXPORT_FIELDS),
+        ('recipient', CapsuleRecipient.objects.filter(capsule__owner=user).order_by('capsule_id', 'pk'), RECIPIENT_EXPORT_FIELDS),
+        ('delivery_log', DeliveryLog.objects.filter(capsule__owner=user).order_by('capsule_id', 'delivery_attempt_time'), DELIVERY_LOG_EXPORT_FIELDS),
+    )
+    for record_type, queryset, fields in exports:
+        for row in queryset.values(*fields).iterator(chunk_size=chunk_size):
+            yield _ndjson_line(record_type, row)
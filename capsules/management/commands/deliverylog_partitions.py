@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from capsules import delivery_logs
+
+
+class Command(BaseCommand):
+    help = "Creates upcoming monthly DeliveryLog partitions and drops partitions older than the retention window."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--months-ahead', type=int, default=settings.DELIVERY_LOG_PARTITIONS_AHEAD,
+            help="How many future months should already have a partition."
+        )
+        parser.add_argument(
+            '--retain-months', type=int, default=settings.DELIVERY_LOG_RETENTION_MONTHS,
+            help="Partitions entirely older than this many months are rolled up and dropped."
+        )
+        parser.add_argument(
+            '--no-drop', action='store_true',
+            help="Only create partitions, never drop old ones."
+        )
+
+    def handle(self, *args, **options):
+        if not delivery_logs.is_partitioned():
+            raise CommandError("The delivery log table is not partitioned (PostgreSQL with migration 0015 is required).")
+
+        created = delivery_logs.ensure_partitions(options['months_ahead'])
+        for name in created:
+            self.stdout.write(f"Created partition {name}")
+
+        if not options['no_drop']:
+            dropped = delivery_logs.drop_expired_partitions(options['retain_months'])
+            for name in dropped:
+                self.stdout.write(f"Dropped partition {name}")
+
+        self.stdout.write(self.style.SUCCESS("Delivery log partitions are up to date."))
@@ -0,0 +1,34 @@
+import sys
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from capsules.exports import DEFAULT_EXPORT_CHUNK_SIZE, iter_user_export
+
+
+class Command(BaseCommand):
+    help = "Streams a user's capsules, contents, recipients and delivery logs as NDJSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument('email', help="Email address of the user to export.")
+        parser.add_argument('--output', '-o', help="File to write to (defaults to stdout).")
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_EXPORT_CHUNK_SIZE,
+                            help="Rows fetched from the database per round trip.")
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        try:
+            user = User.objects.get(email=options['email'])
+        except User.DoesNotExist:
+            raise CommandError(f"No user with email {options['email']}.")
+
+        output = open(options['output'], 'w', encoding='utf-8') if options['output'] else sys.stdout
+        try:
+            line_count = 0
+            for line in iter_user_export(user, chunk_size=options['chunk_size']):
+                output.write(line)
+                line_count += 1
+        finally:
+            if output is not sys.stdout:
+                output.close()
+        self.stderr.write(self.style.SUCCESS(f"Exported {line_count} records for {user.email}."))
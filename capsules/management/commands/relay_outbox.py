@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from capsules import outbox
+
+
+class Command(BaseCommand):
+    help = "Publishes Celery tasks written to the transactional outbox to the broker."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.OUTBOX_RELAY_BATCH_SIZE,
+            help="Messages published (and marked published) per transaction."
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=settings.OUTBOX_RELAY_POLL_SECONDS,
+            help="Seconds to wait between polls when the outbox is empty."
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help="Publish everything pending and exit instead of running continuously."
+        )
+
+    def handle(self, *args, **options):
+        if options['once']:
+            published_count = outbox.drain_outbox(options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f"Published {published_count} outbox messages."))
+            return
+
+        self.stdout.write(f"Relaying the outbox every {options['poll_interval']}s (Ctrl+C to stop).")
+        outbox.run_relay(options['batch_size'], options['poll_interval'])
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from capsules.delivery_failures import replay_dead_letters
+from capsules.models import DeadLetterDelivery
+
+
+class Command(BaseCommand):
+    help = "Re-queues dead-lettered capsule deliveries (transient failures only, unless told otherwise)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--capsule', type=int, help="Only replay deliveries of this capsule ID.")
+        parser.add_argument(
+            '--since', help="Only replay deliveries dead-lettered at or after this ISO date/time."
+        )
+        parser.add_argument(
+            '--include-permanent', action='store_true',
+            help="Also replay deliveries that failed with a permanent error (e.g. after fixing addresses)."
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help="Only report how many deliveries would be replayed."
+        )
+
+    def handle(self, *args, **options):
+        dead_letters = DeadLetterDelivery.objects.filter(replayed_at__isnull=True)
+        if options['capsule']:
+            dead_letters = dead_letters.filter(capsule_id=options['capsule'])
+        if options['since']:
+            dead_letters = dead_letters.filter(created_at__gte=options['since'])
+        if not options['include_permanent']:
+            dead_letters = dead_letters.filter(is_permanent=False)
+
+        if options['dry_run']:
+            self.stdout.write(f"{dead_letters.count()} dead-lettered deliveries would be replayed.")
+            return
+
+        replayed_count = replay_dead_letters(dead_letters, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Queued {replayed_count} dead-lettered deliveries for another attempt."))
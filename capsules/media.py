@@ -0,0 +1,314 @@
+# capsules/media.py
+"""
+Derivative generation for uploaded capsule media.
+
+Images get several downscaled WebP and JPEG copies, recorded as CapsuleContentVariant rows,
+so list pages and the public view can serve a srcset instead of full-resolution originals.
+
+Videos are normalised with a local ffmpeg binary to H.264/AAC MP4 with the moov atom up front
+(faststart), get a poster frame, and optionally HLS renditions so playback can start after
+the first segment.
+"""
+import io
+import json
+import logging
+import os
+import subprocess
+import tempfile
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from PIL import Image, ImageOps
+
+from .models import CapsuleContent, CapsuleContentVariant, CapsuleContentVariantKind, MediaProcessingStatus, hls_storage_prefix
+from .utils import open_content_stream
+
+logger = logging.getLogger(__name__)
+
+IMAGE_VARIANT_MIME_TYPES = {
+    'webp': 'image/webp',
+    'jpeg': 'image/jpeg',
+}
+
+
+def _download_content(content):
+    response = open_content_stream(content)
+    try:
+        buffer = io.BytesIO()
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            buffer.write(chunk)
+    finally:
+        response.close()
+    buffer.seek(0)
+    return buffer
+
+
+def _encode_image(image, variant_format):
+    output = io.BytesIO()
+    quality = settings.IMAGE_VARIANT_QUALITY
+    if variant_format == 'jpeg':
+        image.convert('RGB').save(output, 'JPEG', quality=quality, optimize=True, progressive=True)
+    else:
+        has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+        image.convert('RGBA' if has_alpha else 'RGB').save(output, 'WEBP', quality=quality, method=4)
+    return output.getvalue()
+
+
+def generate_image_variants(content):
+    """
+    Creates the configured widths x formats of an image content item.
+    Widths that already have a variant are skipped, so the function is safe to re-run.
+    Returns the number of variants created.
+    """
+    existing = set(
+        content.variants.filter(kind=CapsuleContentVariantKind.IMAGE).values_list('format', 'width')
+    )
+    stem = os.path.splitext(content.download_name)[0]
+
+    created_count = 0
+    with Image.open(_download_content(content)) as original:
+        image = ImageOps.exif_transpose(original)
+        # Never upscale; an image narrower than every configured width still gets one variant at its own width
+        widths = sorted({width for width in settings.IMAGE_VARIANT_WIDTHS if width < image.width}) or [image.width]
+
+        for width in widths:
+            resized = image.copy()
+            resized.thumbnail((width, image.height), Image.Resampling.LANCZOS)
+            for variant_format in settings.IMAGE_VARIANT_FORMATS:
+                if (variant_format, width) in existing:
+                    continue
+                data = _encode_image(resized, variant_format)
+                extension = 'jpg' if variant_format == 'jpeg' else variant_format
+                variant = CapsuleContentVariant(
+                    content=content,
+                    kind=CapsuleContentVariantKind.IMAGE,
+                    format=variant_format,
+                    width=width,
+                    height=resized.height,
+                    file_size=len(data),
+                )
+                variant.file = SimpleUploadedFile(
+                    f"{stem}_{width}w.{extension}", data, content_type=IMAGE_VARIANT_MIME_TYPES[variant_format]
+                )
+                variant.save()
+                created_count += 1
+
+    logger.info(f"Generated {created_count} image variants for CapsuleContent ID {content.id}.")
+    return created_count
+
+
+def copy_blob_variants(content):
+    """
+    Gives a content item the variants already generated for another item with the same blob,
+    so identical bytes uploaded again are not resized or transcoded again. The copies point at
+    the same stored files, which are deleted with the last variant row referencing them.
+    Returns the number of variants copied (0 when no processed item with the blob exists yet).
+    """
+    if not content.blob_id:
+        return 0
+    source = (
+        CapsuleContent.objects
+        .filter(
+            blob_id=content.blob_id,
+            processing_status__in=[MediaProcessingStatus.NOT_REQUIRED, MediaProcessingStatus.READY],
+            variants__isnull=False,
+        )
+        .exclude(pk=content.pk)
+        .order_by('pk')
+        .first()
+    )
+    if source is None:
+        return 0
+    copies = CapsuleContentVariant.objects.bulk_create([
+        CapsuleContentVariant(
+            content=content,
+            kind=variant.kind,
+            format=variant.format,
+            width=variant.width,
+            height=variant.height,
+            file=variant.file.name,
+            file_size=variant.file_size,
+        )
+        for variant in source.variants.all()
+    ], ignore_conflicts=True)
+    if source.processing_status == MediaProcessingStatus.READY:
+        CapsuleContent.objects.filter(pk=content.pk).update(processing_status=MediaProcessingStatus.READY)
+    logger.info(f"Copied {len(copies)} variants of CapsuleContent ID {source.id} to ID {content.id}.")
+    return len(copies)
+
+
+# --- Video transcoding ---
+
+class VideoProcessingError(Exception):
+    """Raised when ffmpeg/ffprobe cannot process a video."""
+
+
+def _run_media_command(command):
+    try:
+        subprocess.run(
+            command,
+            check=True,
+            capture_output=True,
+            timeout=settings.VIDEO_TRANSCODE_TIMEOUT_SECONDS,
+        )
+    except subprocess.CalledProcessError as e:
+        stderr = e.stderr.decode('utf-8', errors='replace')[-2000:] if e.stderr else ''
+        raise VideoProcessingError(f"{os.path.basename(command[0])} exited with status {e.returncode}: {stderr}") from e
+    except (subprocess.TimeoutExpired, FileNotFoundError) as e:
+        raise VideoProcessingError(str(e)) from e
+
+
+def _run_ffmpeg(*args):
+    _run_media_command([settings.FFMPEG_BINARY, '-hide_banner', '-loglevel', 'error', '-y', *args])
+
+
+def _probe_video_size(path):
+    try:
+        result = subprocess.run(
+            [
+                settings.FFPROBE_BINARY, '-v', 'error', '-select_streams', 'v:0',
+                '-show_entries', 'stream=width,height', '-of', 'json', path,
+            ],
+            check=True,
+            capture_output=True,
+            timeout=60,
+        )
+        stream = json.loads(result.stdout)['streams'][0]
+        return int(stream['width']), int(stream['height'])
+    except (subprocess.SubprocessError, FileNotFoundError, KeyError, IndexError, ValueError) as e:
+        raise VideoProcessingError(f"Could not read video dimensions: {e}") from e
+
+
+def _download_content_to_path(content, path):
+    response = open_content_stream(content)
+    try:
+        with open(path, 'wb') as destination:
+            for chunk in response.iter_content(chunk_size=1024 * 1024):
+                destination.write(chunk)
+    finally:
+        response.close()
+
+
+def _save_variant_file(content, kind, variant_format, width, height, path, file_name):
+    # Streamed from disk: a transcoded video is never read into memory as a whole
+    variant, _ = CapsuleContentVariant.objects.update_or_create(
+        content=content, kind=kind, format=variant_format, width=width,
+        defaults={'height': height, 'file_size': os.path.getsize(path)},
+    )
+    replaced_name = variant.file.name
+    with open(path, 'rb') as source:
+        variant.file = File(source, name=file_name)
+        variant.save()
+    # A re-run replaces the file; the old one may still be shared with copied variants
+    if replaced_name and not CapsuleContentVariant.objects.filter(file=replaced_name).exists():
+        variant.file.storage.delete(replaced_name)
+    return variant
+
+
+def _upload_raw(path, name):
+    with open(path, 'rb') as source:
+        return default_storage.save(name, File(source, name=os.path.basename(name)))
+
+
+def _package_hls_rendition(content, mp4_path, work_dir, target_height, bitrate):
+    """
+    Cuts one HLS rendition, uploads its segments and returns the playlist text with segment
+    references rewritten to their storage names (signed per request, see media_delivery).
+    """
+    rendition_dir = os.path.join(work_dir, f"hls_{target_height}p")
+    os.makedirs(rendition_dir)
+    playlist_path = os.path.join(rendition_dir, 'index.m3u8')
+    _run_ffmpeg(
+        '-i', mp4_path,
+        '-vf', f'scale=-2:{target_height}',
+        '-c:v', 'libx264', '-preset', 'veryfast', '-b:v', bitrate, '-maxrate', bitrate, '-bufsize', bitrate,
+        '-c:a', 'aac', '-b:a', '128k',
+        '-hls_time', str(settings.VIDEO_HLS_SEGMENT_SECONDS),
+        '-hls_playlist_type', 'vod',
+        '-hls_segment_filename', os.path.join(rendition_dir, 'segment_%04d.ts'),
+        playlist_path,
+    )
+
+    prefix = f"{hls_storage_prefix(content)}{target_height}p/"
+    playlist_lines = []
+    with open(playlist_path) as playlist:
+        for line in playlist.read().splitlines():
+            if line and not line.startswith('#'):
+                line = _upload_raw(os.path.join(rendition_dir, line), prefix + line)
+            playlist_lines.append(line)
+    return "\n".join(playlist_lines) + "\n"
+
+
+def _package_hls(content, mp4_path, work_dir, source_width, source_height):
+    renditions = [
+        (height, bitrate) for height, bitrate in settings.VIDEO_HLS_RENDITIONS if height <= source_height
+    ] or [(source_height - source_height % 2, settings.VIDEO_HLS_RENDITIONS[0][1])]
+
+    master_lines = ['#EXTM3U', '#EXT-X-VERSION:3']
+    for height, bitrate in renditions:
+        playlist_text = _package_hls_rendition(content, mp4_path, work_dir, height, bitrate)
+        playlist_path = os.path.join(work_dir, f"{height}p.m3u8")
+        with open(playlist_path, 'w') as playlist:
+            playlist.write(playlist_text)
+        playlist_name = _upload_raw(playlist_path, f"{hls_storage_prefix(content)}{height}p.m3u8")
+
+        width = round(source_width * height / source_height / 2) * 2
+        bandwidth = int(bitrate.rstrip('k')) * 1000 + 128000
+        master_lines.append(f'#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},RESOLUTION={width}x{height}')
+        master_lines.append(playlist_name)
+
+    master_path = os.path.join(work_dir, 'master.m3u8')
+    with open(master_path, 'w') as master:
+        master.write("\n".join(master_lines) + "\n")
+    _save_variant_file(
+        content, CapsuleContentVariantKind.HLS, 'm3u8', source_width, source_height,
+        master_path, 'master.m3u8'
+    )
+
+
+def transcode_video(content):
+    """
+    Normalises a video content item to H.264/AAC MP4 with faststart, extracts a poster frame and,
+    when VIDEO_HLS_ENABLED is set, packages HLS renditions. Results are stored as variants.
+    Raises VideoProcessingError if ffmpeg fails.
+    """
+    with tempfile.TemporaryDirectory(dir=settings.MEDIA_PROCESSING_TMP_DIR) as work_dir:
+        source_path = os.path.join(work_dir, 'source')
+        _download_content_to_path(content, source_path)
+
+        mp4_path = os.path.join(work_dir, 'video.mp4')
+        _run_ffmpeg(
+            '-i', source_path,
+            '-map', '0:v:0', '-map', '0:a:0?',
+            '-c:v', 'libx264', '-preset', 'medium', '-crf', '23', '-pix_fmt', 'yuv420p',
+            '-vf', 'scale=trunc(iw/2)*2:trunc(ih/2)*2',
+            '-c:a', 'aac', '-b:a', '128k',
+            '-movflags', '+faststart',
+            mp4_path,
+        )
+        width, height = _probe_video_size(mp4_path)
+        stem = os.path.splitext(content.download_name)[0]
+        _save_variant_file(
+            content, CapsuleContentVariantKind.VIDEO, 'mp4', width, height,
+            mp4_path, f"{stem}.mp4"
+        )
+
+        poster_path = os.path.join(work_dir, 'poster.jpg')
+        try:
+            _run_ffmpeg('-ss', '1', '-i', mp4_path, '-frames:v', '1', '-q:v', '3', poster_path)
+        except VideoProcessingError:
+            pass
+        if not os.path.exists(poster_path):
+            # Clips shorter than a second: take the very first frame instead
+            _run_ffmpeg('-i', mp4_path, '-frames:v', '1', '-q:v', '3', poster_path)
+        _save_variant_file(
+            content, CapsuleContentVariantKind.POSTER, 'jpeg', width, height,
+            poster_path, f"{stem}_poster.jpg"
+        )
+
+        if settings.VIDEO_HLS_ENABLED:
+            _package_hls(content, mp4_path, work_dir, width, height)
+
+    logger.info(f"Transcoded video CapsuleContent ID {content.id} ({width}x{height}).")
@@ -0,0 +1,251 @@
+# capsules/media_delivery.py
+"""
+Access-checked delivery of capsule media files with HTTP Range support.
+
+The views decide who may see a file; this module decides how the bytes leave the server:
+
+- Files on remote storage (Cloudinary, S3) get a redirect to a short-lived signed URL; the media
+  host serves the ranges itself. Signed URLs are cached per time bucket, so requests within one
+  bucket share a URL (and the browser's cached copy) instead of signing it again.
+- Local files are handed to the front-end web server with X-Accel-Redirect (nginx) or X-Sendfile
+  (Apache/lighttpd) when MEDIA_SENDFILE_BACKEND is set, so Django never touches the bytes.
+- Otherwise Django answers with a FileResponse over the requested byte range. The response keeps
+  the real file descriptor, so servers with a sendfile-capable wsgi.file_wrapper (gunicorn) copy
+  the range from the page cache to the socket without passing it through Python.
+
+HLS playlists are stored with the storage names of what they reference and are rewritten per
+request: rendition playlists become links back to the access-checked endpoint, segments become
+signed URLs.
+"""
+import hashlib
+import mimetypes
+import os
+import re
+import time
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseRedirect
+from django.utils.http import http_date, parse_http_date_safe
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class BoundedFile:
+    """
+    Read-only view of `length` bytes of an open file, starting at its current position.
+    fileno() is passed through so sendfile-capable servers can still use zero-copy; they take
+    the number of bytes to send from Content-Length.
+    """
+    def __init__(self, file, length):
+        self._file = file
+        self._remaining = length
+        self.name = file.name
+
+    def read(self, size=-1):
+        if self._remaining <= 0:
+            return b''
+        if size is None or size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._file.read(size)
+        self._remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self._file.fileno()
+
+    def close(self):
+        self._file.close()
+
+
+def parse_range_header(header_value, file_size):
+    """
+    Returns (start, end) inclusive for a single "bytes=" range, None when the header is absent,
+    malformed or asks for several ranges (the full file is served then), or raises ValueError
+    when the range cannot be satisfied (which includes every range of an empty file).
+    """
+    match = RANGE_RE.match((header_value or '').strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if file_size == 0:
+        raise ValueError("Empty file")
+    if not first:
+        # Suffix range: the last N bytes
+        suffix_length = int(last)
+        if suffix_length == 0:
+            raise ValueError("Empty suffix range")
+        return max(file_size - suffix_length, 0), file_size - 1
+    start = int(first)
+    end = min(int(last), file_size - 1) if last else file_size - 1
+    if start >= file_size or start > end:
+        raise ValueError("Range not satisfiable")
+    return start, end
+
+
+def signed_urls(storage, names, ttl):
+    """
+    Returns {name: signed URL} for the stored `names`. Time is cut into buckets of `ttl` seconds
+    and every URL is signed once per bucket, valid until `ttl` seconds after the bucket ends, so
+    a URL handed out at any point of the bucket is still valid for at least `ttl` seconds.
+    """
+    now = int(time.time())
+    bucket_end = (now // ttl + 1) * ttl
+    keys = {
+        f"signed-url:{type(storage).__name__}:{ttl}:{bucket_end}:{hashlib.sha1(name.encode('utf-8')).hexdigest()}": name
+        for name in names
+    }
+    cached = cache.get_many(keys)
+    urls = {keys[key]: url for key, url in cached.items()}
+    fresh = {
+        key: storage.signed_url(name, expire=bucket_end - now + ttl)
+        for key, name in keys.items() if key not in cached
+    }
+    if fresh:
+        cache.set_many(fresh, bucket_end - now)
+        urls.update((keys[key], url) for key, url in fresh.items())
+    return urls
+
+
+def _content_type(name):
+    return mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+
+def _set_disposition(response, name):
+    filename = os.path.basename(name)
+    response['Content-Disposition'] = f"inline; filename*=UTF-8''{quote(filename)}"
+
+
+def _offloaded_response(name, path, download_name):
+    response = HttpResponse(content_type=_content_type(name))
+    if settings.MEDIA_SENDFILE_BACKEND == 'x-accel-redirect':
+        # nginx maps this internal location onto MEDIA_ROOT and handles Range itself
+        response['X-Accel-Redirect'] = quote(f"{settings.MEDIA_ACCEL_REDIRECT_LOCATION.rstrip('/')}/{name}")
+    else:
+        response['X-Sendfile'] = path
+    _set_disposition(response, download_name)
+    return response
+
+
+def _if_range_matches(request, etag, mtime):
+    """
+    Whether a Range request may be answered with a part of the current file: true without
+    If-Range, otherwise only if its validator is our strong ETag or the exact Last-Modified date.
+    """
+    validator = request.headers.get('If-Range')
+    if validator is None:
+        return True
+    validator = validator.strip()
+    if validator.startswith(('"', 'W/')):
+        # Weak ETags never match for ranges
+        return validator == etag
+    return parse_http_date_safe(validator) == int(mtime)
+
+
+def _file_range_response(request, name, path, download_name):
+    stat = os.stat(path)
+    file_size = stat.st_size
+    etag = f'"{stat.st_mtime_ns:x}-{file_size:x}"'
+    range_header = request.headers.get('Range')
+    if not _if_range_matches(request, etag, stat.st_mtime):
+        # The client's partial copy is outdated: send the whole current file instead
+        range_header = None
+    try:
+        byte_range = parse_range_header(range_header, file_size)
+    except ValueError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f"bytes */{file_size}"
+        return response
+
+    file = open(path, 'rb')
+    if byte_range is None:
+        response = FileResponse(file, content_type=_content_type(name))
+    else:
+        start, end = byte_range
+        file.seek(start)
+        response = FileResponse(BoundedFile(file, end - start + 1), status=206, content_type=_content_type(name))
+        response['Content-Range'] = f"bytes {start}-{end}/{file_size}"
+        response['Content-Length'] = str(end - start + 1)
+    response['Accept-Ranges'] = 'bytes'
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['ETag'] = etag
+    _set_disposition(response, download_name)
+    return response
+
+
+def serve_media_file(request, field_file, download_name=None):
+    """
+    Returns the response delivering `field_file` (a FieldFile) to a client that has already
+    passed the access checks. `download_name` is the file name offered to the client, by
+    default the stored one.
+    """
+    response = _serve(request, field_file, download_name or field_file.name)
+    # Private media: never let shared caches keep a copy
+    response['Cache-Control'] = 'private, max-age=300'
+    return response
+
+
+def _serve(request, field_file, download_name):
+    storage, name = field_file.storage, field_file.name
+    local_path = storage.local_path(name)
+    if local_path is None:
+        return HttpResponseRedirect(signed_urls(storage, [name], settings.MEDIA_REDIRECT_URL_TTL_SECONDS)[name])
+    if settings.MEDIA_SENDFILE_BACKEND:
+        return _offloaded_response(name, local_path, download_name)
+    return _file_range_response(request, name, local_path, download_name)
+
+
+HLS_PLAYLIST_CONTENT_TYPE = 'application/vnd.apple.mpegurl'
+
+
+def _read_playlist(storage, name):
+    # Stored playlists never change, so their text is cached instead of fetched per request
+    cache_key = f"hls-playlist:{hashlib.sha1(name.encode('utf-8')).hexdigest()}"
+    text = cache.get(cache_key)
+    if text is None:
+        with storage.open(name) as playlist:
+            text = playlist.read().decode('utf-8')
+        cache.set(cache_key, text, settings.MEDIA_HLS_PLAYLIST_CACHE_SECONDS)
+    return text
+
+
+def _is_stored_reference(line):
+    # URI lines naming a stored file; playlists written before media became private hold absolute URLs
+    return bool(line) and not line.startswith('#') and '://' not in line
+
+
+def serve_hls_playlist(request, field_file, rendition=None):
+    """
+    Returns an HLS playlist for a client that has already passed the access checks. Without
+    `rendition` this is the master playlist, whose renditions are linked back to the current
+    endpoint with ?rendition=<index>; with it, that rendition's playlist with every segment
+    replaced by a signed URL valid for at least MEDIA_HLS_URL_TTL_SECONDS.
+    """
+    storage = field_file.storage
+    master_lines = _read_playlist(storage, field_file.name).splitlines()
+    if rendition is None:
+        lines = []
+        rendition_index = 0
+        for line in master_lines:
+            if _is_stored_reference(line):
+                query = request.GET.copy()
+                query['rendition'] = str(rendition_index)
+                line = f"?{query.urlencode()}"
+                rendition_index += 1
+            lines.append(line)
+    else:
+        rendition_names = [line for line in master_lines if _is_stored_reference(line)]
+        if not rendition.isdigit() or int(rendition) >= len(rendition_names):
+            raise Http404("Rendition not found.")
+        rendition_lines = _read_playlist(storage, rendition_names[int(rendition)]).splitlines()
+        segment_urls = signed_urls(
+            storage, [line for line in rendition_lines if _is_stored_reference(line)], settings.MEDIA_HLS_URL_TTL_SECONDS
+        )
+        lines = [segment_urls.get(line, line) for line in rendition_lines]
+    response = HttpResponse("\n".join(lines) + "\n", content_type=HLS_PLAYLIST_CONTENT_TYPE)
+    # Holds signed URLs: private to this client, and not kept past their lifetime
+    response['Cache-Control'] = 'private, max-age=300'
+    return response
@@ -0,0 +1,125 @@
+# Generated by Django 5.2.1 on 2026-10-19 10:02
+
+import datetime
+
+from django.db import migrations, models
+
+
+CREATE_PARTITIONED_TABLE_SQL = """
+ALTER TABLE capsules_deliverylog RENAME TO capsules_deliverylog_legacy;
+
+CREATE TABLE capsules_deliverylog (
+    id bigint GENERATED BY DEFAULT AS IDENTITY,
+    delivery_attempt_time timestamp with time zone NOT NULL,
+    delivery_method varchar(50) NOT NULL,
+    recipient_email varchar(254) NULL,
+    status varchar(50) NOT NULL,
+    error_message text NULL,
+    details text NULL,
+    capsule_id bigint NOT NULL REFERENCES capsules_capsule (id) DEFERRABLE INITIALLY DEFERRED,
+    recipient_user_id bigint NULL REFERENCES accounts_user (id) DEFERRABLE INITIALLY DEFERRED,
+    PRIMARY KEY (id, delivery_attempt_time)
+) PARTITION BY RANGE (delivery_attempt_time);
+
+CREATE INDEX capsules_deliverylog_capsule_id_idx ON capsules_deliverylog (capsule_id);
+CREATE INDEX capsules_deliverylog_recipient_user_id_idx ON capsules_deliverylog (recipient_user_id);
+"""
+
+COPY_LEGACY_ROWS_SQL = """
+INSERT INTO capsules_deliverylog (
+    id, delivery_attempt_time, delivery_method, recipient_email, status,
+    error_message, details, capsule_id, recipient_user_id
+)
+SELECT
+    id, delivery_attempt_time, delivery_method, recipient_email, status,
+    error_message, details, capsule_id, recipient_user_id
+FROM capsules_deliverylog_legacy;
+
+SELECT setval(
+    pg_get_serial_sequence('capsules_deliverylog', 'id'),
+    (SELECT COALESCE(MAX(id), 0) + 1 FROM capsules_deliverylog),
+    false
+);
+
+DROP TABLE capsules_deliverylog_legacy;
+"""
+
+
+def _month_start(value):
+    return datetime.date(value.year, value.month, 1)
+
+
+def _add_months(month, count):
+    years, month_index = divmod(month.month - 1 + count, 12)
+    return datetime.date(month.year + years, month_index + 1, 1)
+
+
+def _month_bound(month):
+    return datetime.datetime.combine(month, datetime.time.min, tzinfo=datetime.timezone.utc)
+
+
+def partition_delivery_log(apps, schema_editor):
+    """
+    Converts capsules_deliverylog into a table partitioned by month on delivery_attempt_time.
+    The primary key becomes (id, delivery_attempt_time) at the database level, which Postgres
+    requires for partitioned tables; Django keeps addressing rows by id.
+
+    There is no DEFAULT partition: it would make creating a monthly partition fail as soon as
+    it held rows in that month's range. Partitions are instead created for every month of
+    existing data plus three months ahead, and the maintain_delivery_log_partitions task keeps
+    creating them before they are needed.
+    """
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute(CREATE_PARTITIONED_TABLE_SQL)
+        cursor.execute("SELECT MIN(delivery_attempt_time), MAX(delivery_attempt_time) FROM capsules_deliverylog_legacy")
+        oldest_attempt, newest_attempt = cursor.fetchone()
+
+        current_month = _month_start(datetime.datetime.now(datetime.timezone.utc).date())
+        month = _month_start(oldest_attempt.astimezone(datetime.timezone.utc).date()) if oldest_attempt else current_month
+        last_month = _add_months(current_month, 3)
+        if newest_attempt:
+            last_month = max(last_month, _month_start(newest_attempt.astimezone(datetime.timezone.utc).date()))
+        while month <= last_month:
+            cursor.execute(
+                f'CREATE TABLE "capsules_deliverylog_p{month:%Y%m}" PARTITION OF capsules_deliverylog FOR VALUES FROM (%s) TO (%s)',
+                [_month_bound(month), _month_bound(_add_months(month, 1))]
+            )
+            month = _add_months(month, 1)
+
+        cursor.execute(COPY_LEGACY_ROWS_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0005_alter_user_is_active'),
+        ('capsules', '0014_alter_capsulecontent_file'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeliveryLogDailySummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(help_text='The UTC day the delivery attempts were made.')),
+                ('delivery_method', models.CharField(choices=[('email', 'Email'), ('in_app', 'In-App Notification'), ('sms', 'SMS')], help_text='The method used for the delivery attempts.', max_length=50)),
+                ('status', models.CharField(choices=[('success', 'Success'), ('failure', 'Failure'), ('pending', 'Pending (e.g., for async email service)')], help_text='The outcome of the delivery attempts.', max_length=50)),
+                ('attempt_count', models.PositiveIntegerField(default=0, help_text='Number of delivery attempts with this day, method and status.')),
+            ],
+            options={
+                'verbose_name': 'Delivery Log Daily Summary',
+                'verbose_name_plural': 'Delivery Log Daily Summaries',
+                'ordering': ['-day'],
+                'constraints': [models.UniqueConstraint(fields=('day', 'delivery_method', 'status'), name='unique_deliverylog_daily_summary')],
+            },
+        ),
+        migrations.RunPython(partition_delivery_log, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='deliverylog',
+            index=models.Index(fields=['-delivery_attempt_time'], name='deliverylog_attempt_time_idx'),
+        ),
+    ]
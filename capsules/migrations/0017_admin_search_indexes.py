@@ -0,0 +1,39 @@
+# Generated by Django 5.2.1 on 2026-10-19 11:20
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+from django.conf import settings
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('capsules', '0016_notification_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddIndex(
+            model_name='capsule',
+            index=models.Index(fields=['delivery_date'], name='capsule_delivery_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='capsule',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('title'), name='gin_trgm_ops'), name='capsule_title_trgm_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='capsulerecipient',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('recipient_email'), name='gin_trgm_ops'), name='recipient_email_trgm_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='deliverylog',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('recipient_email'), name='gin_trgm_ops'), name='deliverylog_email_trgm_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('message'), name='gin_trgm_ops'), name='notification_message_trgm_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.1 on 2026-10-19 12:05
+
+import cloudinary.models
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('capsules', '0017_admin_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CapsuleContentVariant',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('image', 'Resized Image')], help_text='What kind of derivative this is.', max_length=20)),
+                ('format', models.CharField(help_text="File format of the variant (e.g. 'webp', 'jpeg').", max_length=10)),
+                ('width', models.PositiveIntegerField(help_text='Width of the variant in pixels.')),
+                ('height', models.PositiveIntegerField(blank=True, help_text='Height of the variant in pixels.', null=True)),
+                ('file', cloudinary.models.CloudinaryField(help_text='The stored variant file.', max_length=255, verbose_name='file')),
+                ('file_size', models.PositiveBigIntegerField(blank=True, help_text='Size of the variant file in bytes.', null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, help_text='Date and time when this variant was generated.')),
+                ('content', models.ForeignKey(help_text='The content item this variant was generated from.', on_delete=django.db.models.deletion.CASCADE, related_name='variants', to='capsules.capsulecontent')),
+            ],
+            options={
+                'verbose_name': 'Capsule Content Variant',
+                'verbose_name_plural': 'Capsule Content Variants',
+                'ordering': ['content', 'kind', 'format', 'width'],
+                'constraints': [models.UniqueConstraint(fields=('content', 'kind', 'format', 'width'), name='unique_capsule_content_variant')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.1 on 2026-10-19 12:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('capsules', '0018_capsulecontentvariant'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='capsulecontent',
+            name='processing_status',
+            field=models.CharField(choices=[('not_required', 'Not Required'), ('pending', 'Pending'), ('processing', 'Processing'), ('ready', 'Ready'), ('failed', 'Failed')], default='not_required', help_text='Status of background processing (e.g. video transcoding) for this content.', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='capsulecontent',
+            name='processing_error',
+            field=models.TextField(blank=True, help_text='Error message from the last failed processing attempt.', null=True),
+        ),
+        migrations.AlterField(
+            model_name='capsulecontentvariant',
+            name='kind',
+            field=models.CharField(choices=[('image', 'Resized Image'), ('video', 'Transcoded Video'), ('hls', 'HLS Playlist'), ('poster', 'Poster Frame')], help_text='What kind of derivative this is.', max_length=20),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.1 on 2026-10-19 13:05
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('capsules', '0019_capsulecontent_processing_status'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaUpload',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('filename', models.CharField(help_text='Original name of the uploaded file.', max_length=255)),
+                ('mime_type', models.CharField(blank=True, help_text='MIME type announced by the client.', max_length=100)),
+                ('upload_length', models.PositiveBigIntegerField(help_text='Total size of the file in bytes.')),
+                ('offset', models.PositiveBigIntegerField(default=0, help_text='Number of bytes received so far.')),
+                ('status', models.CharField(choices=[('in_progress', 'In Progress'), ('complete', 'Complete')], default='in_progress', help_text='Whether all bytes have been received.', max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('owner', models.ForeignKey(help_text='The user uploading the file.', on_delete=django.db.models.deletion.CASCADE, related_name='media_uploads', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Media Upload',
+                'verbose_name_plural': 'Media Uploads',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['updated_at'], name='mediaupload_updated_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.1 on 2026-10-19 13:40
+
+import cloudinary.models
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('capsules', '0020_mediaupload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(help_text='Hex SHA-256 digest of the file contents.', max_length=64, unique=True)),
+                ('file', cloudinary.models.CloudinaryField(help_text='The stored asset.', max_length=255, verbose_name='file')),
+                ('file_size', models.PositiveBigIntegerField(help_text='Size of the file in bytes.')),
+                ('reference_count', models.PositiveIntegerField(default=0, help_text='Number of capsule content items using this asset.')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Media Blob',
+                'verbose_name_plural': 'Media Blobs',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='capsulecontent',
+            name='blob',
+            field=models.ForeignKey(blank=True, help_text="Shared stored asset this content's file points at. Null for text and legacy uploads.", null=True, on_delete=django.db.models.deletion.PROTECT, related_name='contents', to='capsules.mediablob'),
+        ),
+    ]
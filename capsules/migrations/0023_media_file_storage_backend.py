@@ -0,0 +1,30 @@
+# Generated by Django 5.2.1 on 2026-10-19 14:45
+
+import capsules.models
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('capsules', '0021_mediablob_capsulecontent_blob'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='capsulecontent',
+            name='file',
+            field=models.FileField(blank=True, help_text="File content for 'image', 'video', 'audio', 'document' types. Null for text content.", max_length=255, null=True, upload_to='capsule_media/%Y/%m/', validators=[django.core.validators.FileExtensionValidator(allowed_extensions=['jpg', 'jpeg', 'png', 'gif', 'webp', 'bmp', 'tiff', 'mp4', 'avi', 'mov', 'webm', 'mkv', 'flv', 'wmv', 'mp3', 'wav', 'ogg', 'm4a', 'flac', 'aac', 'wma', 'pdf', 'doc', 'docx', 'txt', 'rtf', 'odt', 'epub'])]),
+        ),
+        migrations.AlterField(
+            model_name='capsulecontentvariant',
+            name='file',
+            field=models.FileField(help_text='The stored variant file.', max_length=255, upload_to='capsule_variants/%Y/%m/'),
+        ),
+        migrations.AlterField(
+            model_name='mediablob',
+            name='file',
+            field=models.FileField(help_text='The stored asset.', max_length=255, upload_to=capsules.models.media_blob_upload_path),
+        ),
+    ]
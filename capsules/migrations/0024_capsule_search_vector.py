@@ -0,0 +1,55 @@
+# Generated by Django 5.2.1 on 2026-10-19 15:20
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import BtreeGinExtension
+from django.db import migrations
+
+BACKFILL_BATCH_SIZE = 5000
+
+# The tsvector as capsules.search built it when this migration was written, frozen here so the
+# migration does not change with the application code
+BACKFILL_SQL = """
+    UPDATE capsules_capsule AS capsule
+    SET search_vector =
+        setweight(to_tsvector('english', COALESCE(capsule.title, '')), 'A')
+        || setweight(to_tsvector('english', COALESCE(capsule.description, '')), 'B')
+        || setweight(to_tsvector('english', COALESCE((
+            SELECT string_agg(content.text_content, ' ')
+            FROM capsules_capsulecontent AS content
+            WHERE content.capsule_id = capsule.id AND content.text_content IS NOT NULL
+        ), '')), 'C')
+    WHERE capsule.id > %s AND capsule.id <= %s
+"""
+
+
+def backfill_search_vectors(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM capsules_capsule")
+        max_id = cursor.fetchone()[0]
+        for lower_id in range(0, max_id, BACKFILL_BATCH_SIZE):
+            cursor.execute(BACKFILL_SQL, [lower_id, lower_id + BACKFILL_BATCH_SIZE])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('capsules', '0023_media_file_storage_backend'),
+    ]
+
+    operations = [
+        BtreeGinExtension(),
+        migrations.AddField(
+            model_name='capsule',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, help_text='Full-text search document for the capsule.', null=True),
+        ),
+        migrations.RunPython(backfill_search_vectors, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='capsule',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['owner', 'search_vector'], name='capsule_owner_search_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.1 on 2026-10-19 15:50
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('capsules', '0024_capsule_search_vector'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='capsule',
+            index=models.Index(fields=['owner', 'delivery_date'], name='capsule_owner_delivery_idx'),
+        ),
+    ]
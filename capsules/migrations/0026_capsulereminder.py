@@ -0,0 +1,32 @@
+# Generated by Django 5.2.1 on 2026-10-19 16:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('capsules', '0025_capsule_owner_delivery_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CapsuleReminder',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('days_before', models.PositiveSmallIntegerField(help_text='The reminder stage, in days before the delivery date.')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('capsule', models.ForeignKey(help_text='The capsule the reminder was sent for.', on_delete=django.db.models.deletion.CASCADE, related_name='reminders', to='capsules.capsule')),
+            ],
+            options={
+                'verbose_name': 'Capsule Reminder',
+                'verbose_name_plural': 'Capsule Reminders',
+                'constraints': [models.UniqueConstraint(fields=('capsule', 'days_before'), name='unique_capsule_reminder_stage')],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='capsule',
+            index=models.Index(condition=models.Q(('is_delivered', False)), fields=['delivery_date', 'id'], name='capsule_undelivered_date_idx'),
+        ),
+    ]
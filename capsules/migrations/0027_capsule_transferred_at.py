@@ -0,0 +1,24 @@
+# Generated by Django 5.2.1 on 2026-10-19 16:40
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('capsules', '0026_capsulereminder'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='capsule',
+            name='transferred_at',
+            field=models.DateTimeField(blank=True, help_text="When the capsule was transferred to transfer_recipient_email after the owner's inactivity.", null=True),
+        ),
+        migrations.AddIndex(
+            model_name='capsule',
+            index=models.Index(condition=models.Q(('transfer_on_inactivity', True), ('transferred_at__isnull', True)), fields=['owner'], name='capsule_pending_transfer_idx'),
+        ),
+    ]
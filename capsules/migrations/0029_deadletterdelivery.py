@@ -0,0 +1,33 @@
+# Generated by Django 5.2.1 on 2026-10-19 18:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('capsules', '0028_outboxmessage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeadLetterDelivery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('delivery_method', models.CharField(choices=[('email', 'Email'), ('in_app', 'In-App Notification'), ('sms', 'SMS')], default='email', max_length=20)),
+                ('error_message', models.TextField()),
+                ('is_permanent', models.BooleanField(default=False, help_text='The error was classified as permanent (e.g. the mailbox does not exist).')),
+                ('attempts', models.PositiveSmallIntegerField(default=1)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('replayed_at', models.DateTimeField(blank=True, null=True)),
+                ('capsule', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='dead_letters', to='capsules.capsule')),
+                ('recipient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='dead_letters', to='capsules.capsulerecipient')),
+            ],
+            options={
+                'verbose_name': 'Dead Letter Delivery',
+                'verbose_name_plural': 'Dead Letter Deliveries',
+                'indexes': [models.Index(condition=models.Q(('replayed_at__isnull', True)), fields=['id'], name='deadletter_open_idx')],
+            },
+        ),
+    ]
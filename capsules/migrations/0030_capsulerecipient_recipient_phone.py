@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-19 18:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('capsules', '0029_deadletterdelivery'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='capsulerecipient',
+            name='recipient_phone',
+            field=models.CharField(blank=True, help_text='Optional: phone number (E.164) for SMS delivery.', max_length=32, null=True),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.1 on 2026-10-19 19:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('capsules', '0030_capsulerecipient_recipient_phone'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='capsulecontentvariant',
+            index=models.Index(fields=['file'], name='variant_file_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-19 20:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('capsules', '0032_variant_file_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='capsulecontent',
+            name='original_filename',
+            field=models.CharField(blank=True, default='', help_text='Name of the file as uploaded; blob files are stored under their hash.', max_length=255),
+        ),
+    ]
@@ -7,7 +7,10 @@ import datetime # Import datetime
 import uuid # Import UUID for access tokens
 import os # Import os for path joining
 import logging # Import the logging library
-from cloudinary.models import CloudinaryField
+from django_cleanup import cleanup
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchVectorField
+from django.db.models.functions import Upper
 
 
 logger = logging.getLogger(__name__) # Get a logger instance for this module
@@ -32,6 +35,26 @@ class CapsuleContentType(models.TextChoices):
     DOCUMENT = 'document', 'Document'
 
 
+class CapsuleContentVariantKind(models.TextChoices):
+    IMAGE = 'image', 'Resized Image'
+    VIDEO = 'video', 'Transcoded Video'
+    HLS = 'hls', 'HLS Playlist'
+    POSTER = 'poster', 'Poster Frame'
+
+
+class MediaProcessingStatus(models.TextChoices):
+    NOT_REQUIRED = 'not_required', 'Not Required'
+    PENDING = 'pending', 'Pending'
+    PROCESSING = 'processing', 'Processing'
+    READY = 'ready', 'Ready'
+    FAILED = 'failed', 'Failed'
+
+
+class MediaUploadStatus(models.TextChoices):
+    IN_PROGRESS = 'in_progress', 'In Progress'
+    COMPLETE = 'complete', 'Complete'
+
+
 class CapsuleRecipientStatus(models.TextChoices):
     PENDING = 'pending', 'Pending Delivery'
     SENT = 'sent', 'Sent'
@@ -115,11 +138,40 @@ class Capsule(models.Model):
         blank=True, null=True,
         help_text="Email of the designated recipient for transfer on inactivity."
     )
+    transferred_at = models.DateTimeField(
+        blank=True, null=True,
+        help_text="When the capsule was transferred to transfer_recipient_email after the owner's inactivity."
+    )
+    # Maintained by capsules.signals from the title, description and text contents (see capsules.search)
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False,
+        help_text="Full-text search document for the capsule."
+    )
 
     class Meta:
         verbose_name = "Time Capsule"
         verbose_name_plural = "Time Capsules"
         ordering = ['delivery_date'] # Default ordering for querying
+        indexes = [
+            models.Index(fields=['delivery_date'], name='capsule_delivery_date_idx'),
+            # Keyset scans over one delivery day of undelivered capsules (reminder job)
+            models.Index(
+                fields=['delivery_date', 'id'], condition=models.Q(is_delivered=False), name='capsule_undelivered_date_idx'
+            ),
+            # Per-owner date ranges: dashboard upcoming list and delivery calendar
+            models.Index(fields=['owner', 'delivery_date'], name='capsule_owner_delivery_idx'),
+            # Trigram index matching the UPPER(...) LIKE queries Django emits for icontains (admin search)
+            GinIndex(OpClass(Upper('title'), name='gin_trgm_ops'), name='capsule_title_trgm_idx'),
+            # Owner-scoped full-text search in one index scan (owner_id via btree_gin)
+            GinIndex(fields=['owner', 'search_vector'], name='capsule_owner_search_idx'),
+            # Owners with capsules still waiting for an inactivity transfer
+            models.Index(
+                fields=['owner'],
+                condition=models.Q(transfer_on_inactivity=True, transferred_at__isnull=True),
+                name='capsule_pending_transfer_idx'
+            ),
+        ]
 
     def __str__(self):
         return f"Capsule '{self.title}' by {self.owner.email} (ID: {self.id})"
@@ -129,28 +181,58 @@ class Capsule(models.Model):
         return not self.is_delivered and self.delivery_date <= timezone.now()
 
 
-# --- Capsule Content Model (Handles Text, Images, Videos, Documents, Audio) ---
-def user_capsule_content_path(instance, filename):
+# --- Media Blob Model (content-addressed storage shared by CapsuleContent rows) ---
+def media_blob_upload_path(instance, filename):
+    """Content-addressed path: blobs/<sha[:2]>/<sha[2:4]>/<sha><ext>."""
+    extension = os.path.splitext(filename)[1].lower()
+    return f"blobs/{instance.sha256[:2]}/{instance.sha256[2:4]}/{instance.sha256}{extension}"
+
+@cleanup.ignore  # Shared between capsules; deleted by release_blob when the last reference goes
+class MediaBlob(models.Model):
     """
-    Generates a unique path for uploaded capsule content files.
-    Path: capsule_files/<user_email_sanitized>/capsule_<capsule_id>/<filename>
-    
-    Note: Using user email directly in paths can be problematic if emails contain
-    special characters not suitable for all filesystems or S3 key names.
-    Consider sanitizing the email or using user_id instead for robustness.
-    For S3, most characters are fine, but it's a good practice to be mindful.
+    A stored media asset identified by the SHA-256 of its bytes. CapsuleContent rows with identical
+    files point at the same blob instead of uploading another copy; the asset is destroyed only
+    when the last referencing content item is deleted.
     """
-    # Sanitize email to be filesystem/URL friendly
-    user_email_path_segment = instance.capsule.owner.email.replace('@', '_at_').replace('.', '_dot_')
-    # Further sanitize by removing characters not typically allowed in directory names
-    # This is a basic example; a more robust slugify function might be better.
-    user_email_path_segment = "".join(c if c.isalnum() or c in ['_', '-'] else '_' for c in user_email_path_segment)
-    
-    capsule_id_path_segment = f"capsule_{instance.capsule.id}"
-    
-    # Path will be capsule_files/sanitized_email/capsule_id/filename
-    return os.path.join('capsule_files', user_email_path_segment, capsule_id_path_segment, filename)
+    sha256 = models.CharField(
+        max_length=64,
+        unique=True,
+        help_text="Hex SHA-256 digest of the file contents."
+    )
+    file = models.FileField(
+        upload_to=media_blob_upload_path,
+        max_length=255,
+        help_text="The stored asset."
+    )
+    file_size = models.PositiveBigIntegerField(
+        help_text="Size of the file in bytes."
+    )
+    reference_count = models.PositiveIntegerField(
+        default=0,
+        help_text="Number of capsule content items using this asset."
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Media Blob"
+        verbose_name_plural = "Media Blobs"
+        ordering = ['-created_at']
 
+    def __str__(self):
+        return f"Blob {self.sha256[:12]} ({self.reference_count} reference(s))"
+
+    def destroy_file(self):
+        if not self.file:
+            return
+        try:
+            self.file.delete(save=False)
+            logger.info(f"Deleted blob file {self.file.name} from storage.")
+        except Exception as e:
+            logger.error(f"Error deleting blob file {self.file.name} from storage: {e}", exc_info=True)
+
+
+# --- Capsule Content Model (Handles Text, Images, Videos, Documents, Audio) ---
+@cleanup.ignore  # Files may be shared MediaBlob assets; the post_delete signal releases them
 class CapsuleContent(models.Model):
     """
     Stores individual content items for a time capsule.
@@ -171,11 +253,11 @@ class CapsuleContent(models.Model):
         blank=True, null=True,
         help_text="Text content for 'text' type capsules. Null for file-based content."
     )
-    file = CloudinaryField(
-        'file',  # This is the verbose name, often used as a default public_id prefix if not specified
+    file = models.FileField(
+        upload_to='capsule_media/%Y/%m/',
+        max_length=255,
         blank=True,
         null=True,
-        resource_type='auto', # Cloudinary will auto-detect based on file type
         validators=[
             FileExtensionValidator(
                 allowed_extensions=[
@@ -196,20 +278,46 @@ class CapsuleContent(models.Model):
         default=0,
         help_text="Order of content within a capsule (for display purposes)."
     )
+    processing_status = models.CharField(
+        max_length=20,
+        choices=MediaProcessingStatus.choices,
+        default=MediaProcessingStatus.NOT_REQUIRED,
+        help_text="Status of background processing (e.g. video transcoding) for this content."
+    )
+    processing_error = models.TextField(
+        blank=True, null=True,
+        help_text="Error message from the last failed processing attempt."
+    )
+    blob = models.ForeignKey(
+        MediaBlob,
+        on_delete=models.PROTECT,
+        related_name='contents',
+        blank=True, null=True,
+        help_text="Shared stored asset this content's file points at. Null for text and legacy uploads."
+    )
+    original_filename = models.CharField(
+        max_length=255,
+        blank=True,
+        default='',
+        help_text="Name of the file as uploaded; blob files are stored under their hash."
+    )
+
+    @property
+    def download_name(self):
+        """File name shown to users: the uploaded one, or the stored one for older rows."""
+        if self.original_filename:
+            return self.original_filename
+        return os.path.basename(self.file.name) if self.file else ''
 
     def delete(self, *args, **kwargs):
-        file_path = None
-        if self.file:
-            file_path = self.file.name
-            logger.info(f"Attempting to delete file from storage: {file_path} for CapsuleContent ID: {self.id}")
-            try:
-                self.file.delete(save=False)
-                logger.info(f"Successfully deleted file from storage: {file_path}")
-            except Exception as e:
-                logger.error(f"Error deleting file {file_path} from storage: {e}", exc_info=True)
-                # Decide if you want to proceed with DB deletion even if file deletion fails.
-                # For now, we'll log the error and continue to delete the DB record.
-        
+        file_path = self.file.name if self.file else None
+        # The stored file (or this item's reference to a shared blob) is released by the post_delete
+        # signal once the deletion commits, which also covers cascades and queryset deletes
+
+        # Derived variants (resized images etc.) have their own stored files
+        for variant in self.variants.all():
+            variant.delete()
+
         super().delete(*args, **kwargs) # Call the "real" delete() method
         logger.info(f"Successfully deleted CapsuleContent record ID: {self.id} from database (associated file: {file_path or 'N/A'}).")
 
@@ -227,13 +335,142 @@ class CapsuleContent(models.Model):
 
     def __str__(self):
         return f"Content for Capsule '{self.capsule.title}' ({self.content_type})"
-    
+
+
+# --- Capsule Content Variant Model (derivatives generated from an uploaded file) ---
+def hls_storage_prefix(content):
+    """
+    Storage prefix under which all HLS playlists and segments of a content item are uploaded.
+    Items sharing a blob share the prefix, since their variants are copies of one another.
+    """
+    if content.blob_id:
+        return f"capsule_hls/blob_{content.blob_id}/"
+    return f"capsule_hls/content_{content.pk}/"
+
+@cleanup.ignore  # Files may be shared by copied variants; the post_delete signal deletes them with the last row
+class CapsuleContentVariant(models.Model):
+    """
+    A derivative of a CapsuleContent file, e.g. a resized WebP/JPEG copy of an image
+    used to build responsive srcsets.
+    """
+    content = models.ForeignKey(
+        CapsuleContent,
+        on_delete=models.CASCADE,
+        related_name='variants',
+        help_text="The content item this variant was generated from."
+    )
+    kind = models.CharField(
+        max_length=20,
+        choices=CapsuleContentVariantKind.choices,
+        help_text="What kind of derivative this is."
+    )
+    format = models.CharField(
+        max_length=10,
+        help_text="File format of the variant (e.g. 'webp', 'jpeg')."
+    )
+    width = models.PositiveIntegerField(
+        help_text="Width of the variant in pixels."
+    )
+    height = models.PositiveIntegerField(
+        blank=True, null=True,
+        help_text="Height of the variant in pixels."
+    )
+    file = models.FileField(
+        upload_to='capsule_variants/%Y/%m/',
+        max_length=255,
+        help_text="The stored variant file."
+    )
+    file_size = models.PositiveBigIntegerField(
+        blank=True, null=True,
+        help_text="Size of the variant file in bytes."
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        help_text="Date and time when this variant was generated."
+    )
+
+    class Meta:
+        verbose_name = "Capsule Content Variant"
+        verbose_name_plural = "Capsule Content Variants"
+        ordering = ['content', 'kind', 'format', 'width']
+        constraints = [
+            models.UniqueConstraint(fields=['content', 'kind', 'format', 'width'], name='unique_capsule_content_variant')
+        ]
+        indexes = [
+            # "Is this stored file still used by another variant?" checks on delete
+            models.Index(fields=['file'], name='variant_file_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} variant {self.width}w {self.format} of content ID {self.content_id}"
+
+
+# --- Resumable Upload Model ---
+class MediaUpload(models.Model):
+    """
+    A resumable (tus-style) upload of a single media file. Bytes are appended to a file in
+    RESUMABLE_UPLOAD_DIR chunk by chunk; once complete, the upload can be attached to a
+    capsule by id and is then forwarded to storage as a CapsuleContent file.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='media_uploads',
+        help_text="The user uploading the file."
+    )
+    filename = models.CharField(
+        max_length=255,
+        help_text="Original name of the uploaded file."
+    )
+    mime_type = models.CharField(
+        max_length=100,
+        blank=True,
+        help_text="MIME type announced by the client."
+    )
+    upload_length = models.PositiveBigIntegerField(
+        help_text="Total size of the file in bytes."
+    )
+    offset = models.PositiveBigIntegerField(
+        default=0,
+        help_text="Number of bytes received so far."
+    )
+    status = models.CharField(
+        max_length=20,
+        choices=MediaUploadStatus.choices,
+        default=MediaUploadStatus.IN_PROGRESS,
+        help_text="Whether all bytes have been received."
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Media Upload"
+        verbose_name_plural = "Media Uploads"
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['updated_at'], name='mediaupload_updated_idx'),
+        ]
+
+    def __str__(self):
+        return f"Upload {self.id} of '{self.filename}' ({self.offset}/{self.upload_length} bytes)"
+
     @property
-    def file_url(self):
-        if self.file:
-            return self.file.url
-        return None
+    def staging_path(self):
+        return os.path.join(settings.RESUMABLE_UPLOAD_DIR, f"{self.id}.part")
 
+    @property
+    def is_complete(self):
+        return self.status == MediaUploadStatus.COMPLETE
+
+    def delete(self, *args, **kwargs):
+        try:
+            os.remove(self.staging_path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"Error deleting staged upload file {self.staging_path}: {e}", exc_info=True)
+        super().delete(*args, **kwargs)
 
 
 # --- Capsule Recipient Model ---
@@ -251,6 +488,11 @@ class CapsuleRecipient(models.Model):
     recipient_email = models.EmailField(
         help_text="The email address of the person who will receive the capsule."
     )
+    recipient_phone = models.CharField(
+        max_length=32,
+        blank=True, null=True,
+        help_text="Optional: phone number (E.164) for SMS delivery."
+    )
     recipient_user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.SET_NULL,
@@ -287,6 +529,9 @@ class CapsuleRecipient(models.Model):
         verbose_name = "Capsule Recipient"
         verbose_name_plural = "Capsule Recipients"
         unique_together = ('capsule', 'recipient_email') # A recipient email can only be added once per capsule
+        indexes = [
+            GinIndex(OpClass(Upper('recipient_email'), name='gin_trgm_ops'), name='recipient_email_trgm_idx'),
+        ]
 
     def __str__(self):
         return f"Recipient {self.recipient_email} for Capsule '{self.capsule.title}'"
@@ -341,6 +586,11 @@ class DeliveryLog(models.Model):
         verbose_name = "Delivery Log"
         verbose_name_plural = "Delivery Logs"
         ordering = ['-delivery_attempt_time']
+        # On PostgreSQL the table is partitioned by month on delivery_attempt_time (see capsules/delivery_logs.py)
+        indexes = [
+            models.Index(fields=['-delivery_attempt_time'], name='deliverylog_attempt_time_idx'),
+            GinIndex(OpClass(Upper('recipient_email'), name='gin_trgm_ops'), name='deliverylog_email_trgm_idx'),
+        ]
 
     def __str__(self):
         recipient_info = self.recipient_email or (self.recipient_user.email if self.recipient_user else 'Unknown')
@@ -350,7 +600,59 @@ class DeliveryLog(models.Model):
         )
 
 
+class DeliveryLogDailySummary(models.Model):
+    """
+    Compact per-day rollup of DeliveryLog rows, kept after the detailed partitions are dropped.
+    """
+    day = models.DateField(
+        help_text="The UTC day the delivery attempts were made."
+    )
+    delivery_method = models.CharField(
+        max_length=50,
+        choices=CapsuleDeliveryMethod.choices,
+        help_text="The method used for the delivery attempts."
+    )
+    status = models.CharField(
+        max_length=50,
+        choices=DeliveryLogStatus.choices,
+        help_text="The outcome of the delivery attempts."
+    )
+    attempt_count = models.PositiveIntegerField(
+        default=0,
+        help_text="Number of delivery attempts with this day, method and status."
+    )
+
+    class Meta:
+        verbose_name = "Delivery Log Daily Summary"
+        verbose_name_plural = "Delivery Log Daily Summaries"
+        ordering = ['-day']
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'delivery_method', 'status'], name='unique_deliverylog_daily_summary')
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.delivery_method}/{self.status}: {self.attempt_count}"
+
+
 # --- Notification Model ---
+class NotificationQuerySet(models.QuerySet):
+    """
+    Read state is the per-row is_read flag combined with the user's notifications_read_until
+    high-water mark, so "mark all read" never has to touch the notification rows.
+    """
+    def unread_for(self, user):
+        queryset = self.filter(user=user, is_read=False)
+        if user.notifications_read_until:
+            queryset = queryset.filter(created_at__gt=user.notifications_read_until)
+        return queryset
+
+    def read_for(self, user):
+        queryset = self.filter(user=user)
+        if user.notifications_read_until:
+            return queryset.filter(models.Q(is_read=True) | models.Q(created_at__lte=user.notifications_read_until))
+        return queryset.filter(is_read=True)
+
+
 class Notification(models.Model):
     """
     Stores in-app notifications for users.
@@ -389,11 +691,121 @@ class Notification(models.Model):
         help_text="The date and time the notification was read."
     )
 
+    objects = NotificationQuerySet.as_manager()
+
     class Meta:
         verbose_name = "Notification"
         verbose_name_plural = "Notifications"
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', 'created_at'], name='notification_user_created_idx'),
+            models.Index(fields=['created_at'], name='notification_created_idx'), # For the retention job
+            GinIndex(OpClass(Upper('message'), name='gin_trgm_ops'), name='notification_message_trgm_idx'),
+        ]
 
     def __str__(self):
         return f"Notification for {self.user.email}: {self.notification_type}"
 
+    def is_read_for(self, read_until):
+        """Whether this notification counts as read given the owner's notifications_read_until."""
+        return self.is_read or (read_until is not None and self.created_at <= read_until)
+
+
+
+# --- Capsule Reminder Model ---
+class CapsuleReminder(models.Model):
+    """
+    Records that the reminder for one stage (days before delivery) was emitted for a capsule,
+    so reruns of the reminder job never notify twice.
+    """
+    capsule = models.ForeignKey(
+        Capsule,
+        on_delete=models.CASCADE,
+        related_name='reminders',
+        help_text="The capsule the reminder was sent for."
+    )
+    days_before = models.PositiveSmallIntegerField(
+        help_text="The reminder stage, in days before the delivery date."
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Capsule Reminder"
+        verbose_name_plural = "Capsule Reminders"
+        constraints = [
+            models.UniqueConstraint(fields=['capsule', 'days_before'], name='unique_capsule_reminder_stage'),
+        ]
+
+    def __str__(self):
+        return f"{self.days_before}-day reminder for capsule {self.capsule_id}"
+
+
+# --- Outbox Model (tasks published to the broker by capsules.outbox) ---
+class OutboxMessage(models.Model):
+    """
+    A Celery task call written in the same transaction as the data it acts on. The outbox relay
+    publishes it to the broker after commit.
+    """
+    task_name = models.CharField(max_length=255)
+    args = models.JSONField(default=list, blank=True)
+    kwargs = models.JSONField(default=dict, blank=True)
+    eta = models.DateTimeField(
+        blank=True, null=True,
+        help_text="Earliest time the task should run; published right away with this ETA."
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    published_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        verbose_name = "Outbox Message"
+        verbose_name_plural = "Outbox Messages"
+        indexes = [
+            # The relay only ever scans unpublished rows, oldest first
+            models.Index(fields=['id'], condition=models.Q(published_at__isnull=True), name='outbox_unpublished_idx'),
+            models.Index(fields=['published_at'], condition=models.Q(published_at__isnull=False), name='outbox_published_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.task_name}{tuple(self.args)} ({'published' if self.published_at else 'pending'})"
+
+
+# --- Dead Letter Model (deliveries that will not be retried again) ---
+class DeadLetterDelivery(models.Model):
+    """
+    A delivery to one recipient that failed permanently or ran out of retries.
+    Replaying (see capsules.delivery_failures) re-queues it and stamps replayed_at.
+    """
+    capsule = models.ForeignKey(
+        Capsule,
+        on_delete=models.CASCADE,
+        related_name='dead_letters',
+    )
+    recipient = models.ForeignKey(
+        CapsuleRecipient,
+        on_delete=models.CASCADE,
+        related_name='dead_letters',
+    )
+    delivery_method = models.CharField(
+        max_length=20,
+        choices=CapsuleDeliveryMethod.choices,
+        default=CapsuleDeliveryMethod.EMAIL,
+    )
+    error_message = models.TextField()
+    is_permanent = models.BooleanField(
+        default=False,
+        help_text="The error was classified as permanent (e.g. the mailbox does not exist)."
+    )
+    attempts = models.PositiveSmallIntegerField(default=1)
+    created_at = models.DateTimeField(auto_now_add=True)
+    replayed_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        verbose_name = "Dead Letter Delivery"
+        verbose_name_plural = "Dead Letter Deliveries"
+        indexes = [
+            # Replays walk the open dead letters in primary-key order
+            models.Index(fields=['id'], condition=models.Q(replayed_at__isnull=True), name='deadletter_open_idx'),
+        ]
+
+    def __str__(self):
+        return f"Dead letter: capsule {self.capsule_id} to recipient {self.recipient_id}"
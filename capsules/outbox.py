@@ -0,0 +1,93 @@
+# capsules/outbox.py
+"""
+Transactional outbox for Celery tasks.
+
+Code running inside a transaction calls enqueue_task() instead of apply_async(): the task call
+becomes an OutboxMessage row committed (or rolled back) together with the data it refers to, so
+a worker can never see a task before its rows exist and a broker outage cannot fail the request.
+The relay (the relay_outbox management command, with a periodic task as a fallback) publishes
+unpublished rows to the broker in batches and marks them published with one UPDATE per batch.
+
+Delivery is at least once: a relay that dies between publishing and marking publishes those
+rows again, so tasks sent through the outbox must tolerate duplicates.
+"""
+import logging
+import time
+
+from celery import current_app
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import OutboxMessage
+
+logger = logging.getLogger(__name__)
+logger.disabled = settings.DISABLE_LOGGING
+
+
+def enqueue_task(task_name, args=None, kwargs=None, eta=None):
+    """
+    Schedules the Celery task `task_name` to be published once the current transaction commits.
+    """
+    return OutboxMessage.objects.create(task_name=task_name, args=args or [], kwargs=kwargs or {}, eta=eta)
+
+
+def enqueue_tasks(task_name, args_list):
+    """
+    Bulk version of enqueue_task(): schedules `task_name` once per args list in `args_list`
+    with a single INSERT.
+    """
+    return OutboxMessage.objects.bulk_create([OutboxMessage(task_name=task_name, args=args) for args in args_list])
+
+
+def publish_pending_messages(batch_size):
+    """
+    Publishes up to `batch_size` of the oldest unpublished messages. Rows locked by another relay
+    are skipped, so several relays can run side by side. Returns the number published.
+    """
+    published_ids = []
+    publish_error = None
+    with transaction.atomic():
+        messages = list(
+            OutboxMessage.objects
+            .filter(published_at__isnull=True)
+            .select_for_update(skip_locked=True)
+            .order_by('pk')[:batch_size]
+        )
+        for message in messages:
+            try:
+                current_app.send_task(message.task_name, args=message.args, kwargs=message.kwargs, eta=message.eta)
+            except Exception as e:
+                publish_error = e
+                break
+            published_ids.append(message.pk)
+        # Whatever reached the broker is marked and committed, even if a later publish failed
+        if published_ids:
+            OutboxMessage.objects.filter(pk__in=published_ids).update(published_at=timezone.now())
+    if publish_error is not None:
+        raise publish_error
+    return len(published_ids)
+
+
+def drain_outbox(batch_size):
+    """Publishes batches until no unpublished message is left. Returns the number published."""
+    published_count = 0
+    while True:
+        batch_count = publish_pending_messages(batch_size)
+        published_count += batch_count
+        if batch_count < batch_size:
+            return published_count
+
+
+def run_relay(batch_size, poll_interval):
+    """Publishes new messages forever, polling every `poll_interval` seconds when idle."""
+    while True:
+        try:
+            published_count = drain_outbox(batch_size)
+        except Exception as e:
+            # Broker or database unavailable: keep the rows and try again after the interval
+            logger.error(f"Outbox relay could not publish: {e}")
+            published_count = 0
+        if published_count:
+            logger.info(f"Outbox relay published {published_count} messages.")
+        time.sleep(poll_interval)
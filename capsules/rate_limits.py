@@ -0,0 +1,94 @@
+# capsules/rate_limits.py
+"""
+Cluster-wide token buckets shared through Redis.
+
+All delivery workers draw from the same bucket per email provider, so the cluster as a whole
+never sends faster than the provider allows, however many workers run. The bucket hands out
+reservations: a caller always gets a send slot, possibly in the future, and is told how long to
+wait for it. Deferred work therefore lines up in the order it was admitted instead of retrying
+blindly and colliding again.
+"""
+import logging
+
+import redis
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+logger.disabled = settings.DISABLE_LOGGING
+
+# Refills the bucket for the time elapsed since the last call (by the Redis clock, so workers'
+# clocks do not matter), then takes the requested tokens. The balance may go negative: the
+# deficit is the queue of reservations already handed out. Returns the wait in seconds.
+RESERVE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+local max_wait = tonumber(ARGV[4])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+
+local wait = 0
+if tokens < requested then
+    wait = (requested - tokens) / rate
+end
+if wait <= max_wait then
+    tokens = tokens - requested
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil((capacity - tokens) / rate) + 60)
+return tostring(wait)
+"""
+
+_redis_client = None
+_reserve_script = None
+
+
+def _get_reserve_script():
+    global _redis_client, _reserve_script
+    if _reserve_script is None:
+        _redis_client = redis.Redis.from_url(
+            settings.RATE_LIMIT_REDIS_URL,
+            socket_timeout=settings.RATE_LIMIT_REDIS_TIMEOUT_SECONDS,
+            socket_connect_timeout=settings.RATE_LIMIT_REDIS_TIMEOUT_SECONDS,
+        )
+        _reserve_script = _redis_client.register_script(RESERVE_SCRIPT)
+    return _reserve_script
+
+
+class TokenBucket:
+    """
+    A bucket refilled at `rate` tokens per second and holding at most `capacity` tokens.
+    """
+    def __init__(self, name, rate, capacity, max_wait):
+        self.key = f"rate-limit:{name}"
+        self.rate = rate
+        self.capacity = capacity
+        self.max_wait = max_wait
+
+    def reserve(self, tokens=1):
+        """
+        Takes `tokens` and returns the number of seconds to wait before using them (0.0 to go
+        ahead now). When the wait would exceed max_wait nothing is taken; the caller should come
+        back after the returned wait. If Redis is unreachable the caller is let through.
+        """
+        try:
+            wait = _get_reserve_script()(
+                keys=[self.key], args=[self.rate, self.capacity, tokens, self.max_wait]
+            )
+        except redis.RedisError as e:
+            logger.warning(f"Rate limiter {self.key} unavailable, not limiting: {e}")
+            return 0.0
+        return float(wait)
+
+
+def email_send_bucket():
+    """The bucket shared by every worker sending through the configured email provider."""
+    rate, capacity = settings.EMAIL_PROVIDER_RATE_LIMITS.get(
+        settings.EMAIL_HOST, settings.EMAIL_PROVIDER_RATE_LIMITS['default']
+    )
+    return TokenBucket(f"email:{settings.EMAIL_HOST}", rate, capacity, settings.RATE_LIMIT_MAX_DEFERRAL_SECONDS)
@@ -0,0 +1,105 @@
+# capsules/reminders.py
+"""
+Reminder notifications ahead of capsule delivery.
+
+REMINDER_WINDOWS_DAYS lists the stages (e.g. 30, 7 and 1 days before delivery_date). A stage
+covers the delivery dates between the next nearer stage and itself, so a capsule created inside
+a window, or a day the job did not run, still gets one reminder for that stage. CapsuleReminder
+rows record the stages already emitted, which makes reruns no-ops.
+
+Capsules are scanned one delivery day at a time in primary-key batches over the partial
+(delivery_date, id) index of undelivered capsules, so memory stays bounded by the batch size.
+"""
+import datetime
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from .models import Capsule, CapsuleReminder, Notification, NotificationType
+from .signals import invalidate_user_cache_on_commit
+
+logger = logging.getLogger(__name__)
+logger.disabled = settings.DISABLE_LOGGING
+
+LOCK_KEY = 'capsule-reminders-lock'
+
+
+def _reminder_message(capsule, days_left):
+    day_label = 'day' if days_left == 1 else 'days'
+    return (
+        f"Reminder: your time capsule '{capsule['title']}' will be delivered in {days_left} {day_label} "
+        f"({capsule['delivery_date'].isoformat()})."
+    )
+
+
+def _emit_batch(capsules, days_before, today):
+    with transaction.atomic():
+        CapsuleReminder.objects.bulk_create(
+            [CapsuleReminder(capsule_id=capsule['id'], days_before=days_before) for capsule in capsules]
+        )
+        Notification.objects.bulk_create([
+            Notification(
+                user_id=capsule['owner_id'],
+                capsule_id=capsule['id'],
+                message=_reminder_message(capsule, (capsule['delivery_date'] - today).days),
+                notification_type=NotificationType.REMINDER,
+            )
+            for capsule in capsules
+        ])
+        # bulk_create sends no post_save, so the owners' cached unread counts are invalidated here
+        for owner_id in {capsule['owner_id'] for capsule in capsules}:
+            invalidate_user_cache_on_commit(owner_id)
+
+
+def _emit_for_day(delivery_date, days_before, today, batch_size):
+    pending = (
+        Capsule.objects
+        .filter(delivery_date=delivery_date, is_delivered=False)
+        .filter(~Exists(CapsuleReminder.objects.filter(capsule=OuterRef('pk'), days_before=days_before)))
+        .order_by('pk')
+        .values('id', 'owner_id', 'title', 'delivery_date')
+    )
+    emitted_count = 0
+    last_pk = 0
+    while True:
+        capsules = list(pending.filter(pk__gt=last_pk)[:batch_size])
+        if not capsules:
+            break
+        _emit_batch(capsules, days_before, today)
+        emitted_count += len(capsules)
+        last_pk = capsules[-1]['id']
+    return emitted_count
+
+
+def emit_due_reminders(today=None, batch_size=1000):
+    """
+    Creates the reminder notifications that are due as of `today` (default: the local date).
+    Returns the number of reminders emitted.
+    """
+    today = today or timezone.localdate()
+    stages = sorted(set(settings.REMINDER_WINDOWS_DAYS))
+    emitted_count = 0
+    for index, days_before in enumerate(stages):
+        nearer_stage = stages[index - 1] if index else 0
+        for days_left in range(nearer_stage + 1, days_before + 1):
+            emitted_count += _emit_for_day(today + datetime.timedelta(days=days_left), days_before, today, batch_size)
+    return emitted_count
+
+
+def run_reminder_job(batch_size):
+    """
+    Runs emit_due_reminders unless another run holds the lock. Returns the number of reminders
+    emitted, or None if the job was already running.
+    """
+    # The lock expires on its own should a worker die mid-run
+    if not cache.add(LOCK_KEY, timezone.now().isoformat(), settings.REMINDER_LOCK_TIMEOUT_SECONDS):
+        logger.info("Reminder job already running. Skipping.")
+        return None
+    try:
+        return emit_due_reminders(batch_size=batch_size)
+    finally:
+        cache.delete(LOCK_KEY)
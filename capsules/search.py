@@ -0,0 +1,66 @@
+# capsules/search.py
+"""
+PostgreSQL full-text search over capsules.
+
+Each capsule keeps a tsvector in Capsule.search_vector built from its title (weight A),
+description (weight B) and the text of its text contents (weight C). Signals refresh it after
+the relevant rows are committed; searches then only touch the GIN index on (owner, search_vector).
+"""
+from django.conf import settings
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import F, OuterRef, Subquery
+
+
+def build_search_vector(capsule_model):
+    """
+    The tsvector expression for a Capsule queryset. Takes the model so migrations can pass
+    their historical version.
+    """
+    content_model = capsule_model._meta.get_field('contents').related_model
+    text_contents = (
+        content_model.objects
+        .filter(capsule=OuterRef('pk'), text_content__isnull=False)
+        .order_by()
+        .values('capsule')
+        .annotate(text=StringAgg('text_content', delimiter=' '))
+        .values('text')
+    )
+    config = settings.SEARCH_CONFIG
+    return (
+        # SearchVector coalesces NULLs (no description, no text content) to ''
+        SearchVector('title', weight='A', config=config)
+        + SearchVector('description', weight='B', config=config)
+        + SearchVector(Subquery(text_contents), weight='C', config=config)
+    )
+
+
+def refresh_search_vectors(queryset):
+    """
+    Recomputes search_vector for every capsule in `queryset` with a single UPDATE.
+    No-op on databases other than PostgreSQL.
+    """
+    if connection.vendor != 'postgresql':
+        return 0
+    return queryset.update(search_vector=build_search_vector(queryset.model))
+
+
+def refresh_capsule_search_vectors(capsule_ids):
+    from .models import Capsule
+
+    refresh_search_vectors(Capsule.objects.filter(pk__in=capsule_ids))
+
+
+def search_capsules(queryset, query_text):
+    """
+    Filters `queryset` to capsules matching `query_text` (web-search syntax: quoted phrases,
+    OR, -exclusion) and orders them by relevance.
+    """
+    query = SearchQuery(query_text, search_type='websearch', config=settings.SEARCH_CONFIG)
+    return (
+        queryset
+        .filter(search_vector=query)
+        .annotate(rank=SearchRank(F('search_vector'), query))
+        .order_by('-rank', '-creation_date', '-pk')
+    )
@@ -1,23 +1,141 @@
 from rest_framework import serializers
-from .models import Capsule, CapsuleContent, CapsuleRecipient, CapsuleContentType, CapsuleRecipientStatus, Notification
+from .models import Capsule, CapsuleContent, CapsuleRecipient, CapsuleContentType, CapsuleContentVariantKind, CapsuleRecipientStatus, MediaProcessingStatus, MediaUpload, Notification
 from django.utils import timezone
-from .tasks import deliver_capsule_email_task
+from .tasks import deliver_capsule_task, generate_image_variants_task, transcode_video_task
+from .outbox import enqueue_task
+from functools import partial
+from .utils import parse_recipient_csv, registered_user_ids_by_email, validate_phone_number
+from .uploads import discard_uploads, open_completed_upload
+from .blobs import acquire_blob, release_blob
+from .media import copy_blob_variants
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.files import File
 from django.db import transaction
+from django.urls import reverse
 import datetime
 import logging
+import os
 
 logger = logging.getLogger(__name__)
 
 class CapsuleRecipientSerializer(serializers.ModelSerializer):
     class Meta:
         model = CapsuleRecipient
-        fields = ['recipient_email', 'received_status'] # Add other fields if needed for response
+        fields = ['recipient_email', 'recipient_phone', 'received_status'] # Add other fields if needed for response
 
-class CapsuleContentSerializer(serializers.ModelSerializer):
-    file_url = serializers.ReadOnlyField()
+def build_image_srcset(content, variant_format, media_url):
+    """
+    Builds an HTML srcset ("<url> <width>w, ...") from a content item's image variants, with
+    URLs from media_url(content, variant). Uses the prefetched variants when available.
+    Returns None if there are no variants yet.
+    """
+    if content.content_type != CapsuleContentType.IMAGE:
+        return None
+    candidates = sorted(
+        (variant.width, variant.pk, variant)
+        for variant in content.variants.all()
+        if variant.kind == CapsuleContentVariantKind.IMAGE and variant.format == variant_format
+    )
+    if not candidates:
+        return None
+    return ", ".join(f"{media_url(content, variant)} {width}w" for width, _, variant in candidates)
+
+def original_filename(name, max_length=255):
+    """
+    The uploaded file's name without any client-side path, shortened (keeping the extension)
+    to fit CapsuleContent.original_filename.
+    """
+    name = os.path.basename((name or '').replace('\\', '/'))
+    if len(name) > max_length:
+        stem, extension = os.path.splitext(name)
+        name = stem[:max_length - len(extension)] + extension
+    return name[:max_length]
+
+def get_variant(content, kind):
+    """
+    Returns a content item's variant of the given kind, or None.
+    Uses the prefetched variants when available.
+    """
+    for variant in content.variants.all():
+        if variant.kind == kind:
+            return variant
+    return None
+
+
+class MediaUrlFieldsMixin(serializers.Serializer):
+    """
+    URL fields of a content item: the file, image srcsets and, for video, the transcoded
+    faststart MP4 (falling back to the original upload until transcoding finishes), the HLS
+    master playlist and the poster frame. Media is private, so every URL points at an
+    access-checked media endpoint, chosen by the subclass's media_path(); variants are
+    addressed with ?variant=<id>. The endpoint URL is resolved once per serializer and reused
+    for every item, so serializing a large capsule does no per-item reverse().
+    """
+    # Stand-in content id; no real primary key gets this long
+    MEDIA_ID_PLACEHOLDER = '9' * 18
+    file_url = serializers.SerializerMethodField()
+    srcset = serializers.SerializerMethodField()
+    fallback_srcset = serializers.SerializerMethodField()
+    playback_url = serializers.SerializerMethodField()
+    hls_url = serializers.SerializerMethodField()
+    poster_url = serializers.SerializerMethodField()
+
+    def media_path(self, content_id):
+        raise NotImplementedError
+
+    def media_url(self, content, variant=None):
+        template = getattr(self, '_media_url_template', None)
+        if template is None:
+            path = self.media_path(self.MEDIA_ID_PLACEHOLDER)
+            request = self.context.get('request')
+            template = self._media_url_template = request.build_absolute_uri(path) if request else path
+        url = template.replace(self.MEDIA_ID_PLACEHOLDER, str(content.pk))
+        if variant is not None:
+            url += f"?variant={variant.pk}"
+        return url
+
+    def variant_url(self, content, kind):
+        variant = get_variant(content, kind)
+        return self.media_url(content, variant) if variant else None
+
+    def get_file_url(self, obj):
+        return self.media_url(obj) if obj.file else None
+
+    def get_srcset(self, obj):
+        return build_image_srcset(obj, 'webp', self.media_url)
+
+    def get_fallback_srcset(self, obj):
+        return build_image_srcset(obj, 'jpeg', self.media_url)
+
+    def get_playback_url(self, obj):
+        if obj.content_type != CapsuleContentType.VIDEO:
+            return None
+        return self.variant_url(obj, CapsuleContentVariantKind.VIDEO) or self.get_file_url(obj)
+
+    def get_hls_url(self, obj):
+        if obj.content_type != CapsuleContentType.VIDEO:
+            return None
+        return self.variant_url(obj, CapsuleContentVariantKind.HLS)
+
+    def get_poster_url(self, obj):
+        if obj.content_type != CapsuleContentType.VIDEO:
+            return None
+        return self.variant_url(obj, CapsuleContentVariantKind.POSTER)
+
+
+class CapsuleContentSerializer(MediaUrlFieldsMixin, serializers.ModelSerializer):
+    file = serializers.FileField(use_url=False, read_only=True)  # Stored name; file_url carries the URL
     class Meta:
         model = CapsuleContent
-        fields = ['id', 'content_type', 'text_content', 'file', 'upload_date', 'order', "file_url"]
+        fields = [
+            'id', 'content_type', 'text_content', 'file', 'original_filename', 'upload_date', 'order', "file_url", 'srcset', 'fallback_srcset',
+            'processing_status', 'playback_url', 'hls_url', 'poster_url'
+        ]
+        read_only_fields = ['original_filename', 'processing_status']
+
+    def media_path(self, content_id):
+        return reverse('capsule-media', args=[content_id])
 
     def to_representation(self, instance):
         representation = super().to_representation(instance)
@@ -33,8 +151,22 @@ class CapsuleSerializer(serializers.ModelSerializer):
     media_files = serializers.ListField(
         child=serializers.FileField(), write_only=True, required=False
     )
+    # Ids of completed resumable uploads (see MediaUploadCreateView) to attach as media
+    upload_ids = serializers.ListField(
+        child=serializers.UUIDField(), write_only=True, required=False
+    )
     
-    recipient_email = serializers.EmailField(write_only=True, required=True) # Assuming one recipient for now
+    # Recipients can be given as a single address, a list of addresses and/or an uploaded CSV;
+    # at least one address is required when creating a capsule.
+    recipient_email = serializers.EmailField(write_only=True, required=False)
+    recipient_emails = serializers.ListField(
+        child=serializers.EmailField(), write_only=True, required=False
+    )
+    recipients_csv = serializers.FileField(write_only=True, required=False)
+    # Phone numbers for SMS delivery, keyed by recipient email (the CSV can carry a 'phone' column instead)
+    recipient_phones = serializers.DictField(
+        child=serializers.CharField(validators=[validate_phone_number]), write_only=True, required=False
+    )
 
     # To include related objects in the response (read-only)
     contents = CapsuleContentSerializer(many=True, read_only=True)
@@ -48,12 +180,98 @@ class CapsuleSerializer(serializers.ModelSerializer):
             'creation_date', 'is_delivered', 'is_archived',
             'delivery_method', 'privacy_status',
             # Write-only fields for creation
-            'text_content', 'media_files', 'recipient_email',
+            'text_content', 'media_files', 'upload_ids', 'recipient_email', 'recipient_emails', 'recipients_csv', 'recipient_phones',
             # Read-only fields for response
             'contents', 'recipients'
         ]
         read_only_fields = ['owner', 'id', 'creation_date', 'is_delivered', 'is_archived']
 
+    def validate_upload_ids(self, value):
+        uploads = MediaUpload.objects.in_bulk(value)
+        owner = self.context['request'].user
+        missing = [str(upload_id) for upload_id in value if upload_id not in uploads or uploads[upload_id].owner_id != owner.id]
+        if missing:
+            raise serializers.ValidationError(f"Unknown uploads: {', '.join(missing)}")
+        incomplete = [str(upload_id) for upload_id in value if not uploads[upload_id].is_complete]
+        if incomplete:
+            raise serializers.ValidationError(f"Uploads not finished yet: {', '.join(incomplete)}")
+        # Uploaded files bypass the FileField, so its extension validator is applied to the upload's name here
+        file_validators = CapsuleContent._meta.get_field('file').validators
+        unsupported = []
+        for upload_id in value:
+            try:
+                for validator in file_validators:
+                    validator(File(None, name=uploads[upload_id].filename))
+            except DjangoValidationError:
+                unsupported.append(uploads[upload_id].filename)
+        if unsupported:
+            raise serializers.ValidationError(f"Unsupported file types: {', '.join(unsupported)}")
+        return [uploads[upload_id] for upload_id in dict.fromkeys(value)]
+
+    def validate(self, attrs):
+        attrs = super().validate(attrs)
+        if self.instance is not None:
+            return attrs
+
+        max_recipients = settings.MAX_RECIPIENTS_PER_CAPSULE
+        emails = []
+        if attrs.get('recipient_email'):
+            emails.append(attrs.pop('recipient_email'))
+        emails.extend(attrs.pop('recipient_emails', []))
+        phones = {}
+
+        recipients_csv = attrs.pop('recipients_csv', None)
+        if recipients_csv:
+            try:
+                csv_emails, csv_phones, invalid_values = parse_recipient_csv(recipients_csv, max_recipients)
+            except (UnicodeDecodeError, ValueError) as e:
+                raise serializers.ValidationError({'recipients_csv': str(e)})
+            if invalid_values:
+                raise serializers.ValidationError({'recipients_csv': f"Invalid rows: {', '.join(invalid_values)}"})
+            emails.extend(csv_emails)
+            phones.update(csv_phones)
+
+        # De-duplicate case-insensitively, keeping the first spelling of each address
+        unique_emails = {}
+        for email in emails:
+            unique_emails.setdefault(email.strip().lower(), email.strip())
+        if not unique_emails:
+            raise serializers.ValidationError({'recipient_email': "At least one recipient email is required."})
+        if len(unique_emails) > max_recipients:
+            raise serializers.ValidationError({'recipient_emails': f"A capsule can have at most {max_recipients} recipients."})
+
+        phones.update({email.strip().lower(): phone for email, phone in attrs.pop('recipient_phones', {}).items()})
+        unknown = [email for email in phones if email not in unique_emails]
+        if unknown:
+            raise serializers.ValidationError({'recipient_phones': f"Not recipients of this capsule: {', '.join(unknown)}"})
+
+        attrs['recipient_email_list'] = list(unique_emails.values())
+        attrs['recipient_phone_map'] = phones
+        return attrs
+
+    def create_recipients(self, capsule, recipient_emails, recipient_phones=None):
+        """
+        Inserts all recipients with batched INSERTs, linking those who are registered users.
+        `recipient_phones` maps lowercased addresses to phone numbers for SMS delivery.
+        """
+        recipient_phones = recipient_phones or {}
+        batch_size = 1000
+        for start in range(0, len(recipient_emails), batch_size):
+            email_batch = recipient_emails[start:start + batch_size]
+            registered_user_ids = registered_user_ids_by_email(email_batch)
+            CapsuleRecipient.objects.bulk_create(
+                [
+                    CapsuleRecipient(
+                        capsule=capsule,
+                        recipient_email=email,
+                        recipient_phone=recipient_phones.get(email.lower()),
+                        recipient_user_id=registered_user_ids.get(email.lower())
+                    )
+                    for email in email_batch
+                ],
+                ignore_conflicts=True
+            )
+
     def get_file_content_type(self, file):
         # Basic content type detection based on file extension
         # You might want a more robust solution (e.g., using python-magic)
@@ -68,11 +286,66 @@ class CapsuleSerializer(serializers.ModelSerializer):
             return CapsuleContentType.DOCUMENT
         return CapsuleContentType.DOCUMENT # Default or raise error
 
+    def acquire_media_blobs(self, media_files_data, staged_uploads):
+        """
+        Stores each file (or references the stored copy of identical bytes) before the capsule
+        transaction starts, so uploads and blob row locks are not held while the capsule is written.
+        Returns: list -> (content_type, blob, original_filename) per file, in order
+        """
+        media_items = []
+        try:
+            for file_data in media_files_data:
+                media_items.append((
+                    self.get_file_content_type(file_data), acquire_blob(file_data), original_filename(file_data.name)
+                ))
+            # Completed resumable uploads are forwarded to storage from the staging area
+            for upload in staged_uploads:
+                with open_completed_upload(upload) as staged_file:
+                    media_items.append((
+                        self.get_file_content_type(staged_file), acquire_blob(staged_file), original_filename(upload.filename)
+                    ))
+        except Exception:
+            self.release_media_blobs(media_items)
+            raise
+        return media_items
+
+    def release_media_blobs(self, media_items):
+        for _, blob, _ in media_items:
+            try:
+                release_blob(blob.id)
+            except Exception as e:
+                logger.error(f"Error releasing blob ID {blob.id} after failed capsule creation: {e}")
+
+    def create_media_content(self, capsule, content_type, blob, filename, order):
+        content = CapsuleContent.objects.create(
+            capsule=capsule,
+            content_type=content_type,
+            file=blob.file.name,
+            blob=blob,
+            original_filename=filename,
+            order=order,
+            processing_status=(
+                MediaProcessingStatus.PENDING if content_type == CapsuleContentType.VIDEO
+                else MediaProcessingStatus.NOT_REQUIRED
+            )
+        )
+        # Identical bytes processed before already have variants; those are shared instead of regenerated
+        if content_type in (CapsuleContentType.IMAGE, CapsuleContentType.VIDEO) and copy_blob_variants(content):
+            return content
+        if content_type == CapsuleContentType.IMAGE:
+            # Resized variants are generated in the background once the capsule is committed
+            transaction.on_commit(partial(generate_image_variants_task.delay, content.id), robust=True)
+        elif content_type == CapsuleContentType.VIDEO:
+            transaction.on_commit(partial(transcode_video_task.delay, content.id), robust=True)
+        return content
+
     def create(self, validated_data):
         owner = self.context['request'].user
         media_files_data = validated_data.pop('media_files', [])
+        staged_uploads = validated_data.pop('upload_ids', [])
         text_content_data = validated_data.pop('text_content', None)
-        recipient_email_data = validated_data.pop('recipient_email')
+        recipient_emails = validated_data.pop('recipient_email_list')
+        recipient_phones = validated_data.pop('recipient_phone_map')
         delivery_date = validated_data.get('delivery_date')
         delivery_time = validated_data.get('delivery_time')
         eta_datetime_utc = None
@@ -93,7 +366,9 @@ class CapsuleSerializer(serializers.ModelSerializer):
             except Exception as e:
                 logger.error(f"Error creating delivery datetime: {e}")
 
+        media_items = []
         try:
+            media_items = self.acquire_media_blobs(media_files_data, staged_uploads)
             with transaction.atomic():
                 # Create the capsule instance
                 capsule = Capsule.objects.create(owner=owner, **validated_data)
@@ -107,52 +382,35 @@ class CapsuleSerializer(serializers.ModelSerializer):
                         order=0 # Assuming text content is first
                     )
 
-                # Create CapsuleContent for each uploaded media file
+                # Create CapsuleContent for each uploaded media file, then each completed resumable upload
                 file_order_start = 1 if text_content_data else 0
-                for index, file_data in enumerate(media_files_data):
-                    content_type = self.get_file_content_type(file_data)
-                    CapsuleContent.objects.create(
-                        capsule=capsule,
-                        content_type=content_type,
-                        file=file_data,
-                        order=file_order_start + index
-                    )
+                for index, (content_type, blob, filename) in enumerate(media_items):
+                    self.create_media_content(capsule, content_type, blob, filename, file_order_start + index)
+                if staged_uploads:
+                    transaction.on_commit(partial(discard_uploads, [upload.id for upload in staged_uploads]), robust=True)
                 
-                recipient_obj = CapsuleRecipient.objects.create(
-                    capsule=capsule,
-                    recipient_email=recipient_email_data
-                )
+                self.create_recipients(capsule, recipient_emails, recipient_phones)
 
-                # Schedule the Celery task for email delivery
+                # Schedule one Celery task for the whole capsule; it fans out to every pending recipient when due.
+                # Written to the outbox in this transaction and published by the relay after commit.
                 current_time_utc = timezone.now().astimezone(datetime.timezone.utc)
                 
                 if eta_datetime_utc:
                     if eta_datetime_utc > current_time_utc:
-                        try:
-                            deliver_capsule_email_task.apply_async(
-                                args=[capsule.id, recipient_obj.id],
-                                eta=eta_datetime_utc
-                        )
-                            logger.info(f"Capsule ID {capsule.id} delivery scheduled for {eta_datetime_utc} (UTC) to {recipient_obj.recipient_email}")
-                        except Exception as e:
-                            logger.error(f"Error scheduling delivery task: {e}")
-                            raise
+                        enqueue_task(deliver_capsule_task.name, args=[capsule.id], eta=eta_datetime_utc)
+                        logger.info(f"Capsule ID {capsule.id} delivery scheduled for {eta_datetime_utc} (UTC) to {len(recipient_emails)} recipient(s)")
                     else:
-                        try:
-                            deliver_capsule_email_task.apply_async(
-                                args=[capsule.id, recipient_obj.id],
-                                countdown=10 # Execute in 10 seconds for past/current ETAs
-                            )
-                            logger.info(f"Capsule ID {capsule.id} delivery ETA {eta_datetime_utc} (UTC) is past/now. Scheduled for near-immediate delivery to {recipient_obj.recipient_email}")
-                        except Exception as e:
-                            logger.error(f"Error scheduling immediate delivery task: {e}")
-                            raise
+                        # Past/current ETAs are delivered as soon as the relay publishes the task
+                        enqueue_task(deliver_capsule_task.name, args=[capsule.id])
+                        logger.info(f"Capsule ID {capsule.id} delivery ETA {eta_datetime_utc} (UTC) is past/now. Scheduled for near-immediate delivery to {len(recipient_emails)} recipient(s)")
                 else:
                     logger.warning(f"Capsule ID {capsule.id} has no valid delivery date/time for scheduling email.")
 
                 return capsule
         except Exception as e:
             logger.error(f"Error during capsule creation or scheduling, cleaning up: {e}")
+            # The contents were rolled back, so the blob references taken for them are dropped
+            self.release_media_blobs(media_items)
             # Attempt to delete the capsule and related objects if created
             try:
                 if 'capsule' in locals():
@@ -162,14 +420,29 @@ class CapsuleSerializer(serializers.ModelSerializer):
                 logger.error(f"Error during cleanup after failed capsule creation: {cleanup_error}")
             raise serializers.ValidationError("Failed to create capsule or schedule delivery. Please try again.")
 
+class CapsuleSearchResultSerializer(serializers.ModelSerializer):
+    rank = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = Capsule
+        fields = ['id', 'title', 'description', 'delivery_date', 'delivery_time', 'is_delivered', 'is_archived', 'rank']
+        read_only_fields = fields
+
 # --- Serializers for Public Capsule View ---
 
-class PublicCapsuleContentSerializer(serializers.ModelSerializer):
-    file_url = serializers.ReadOnlyField()
+class PublicCapsuleContentSerializer(MediaUrlFieldsMixin, serializers.ModelSerializer):
+    file = serializers.FileField(use_url=False, read_only=True)
     class Meta:
         model = CapsuleContent
-        fields = ['id', 'content_type', 'text_content', 'file', 'order', 'file_url'] # Exclude upload_date for public?
+        fields = [
+            'id', 'content_type', 'text_content', 'file', 'original_filename', 'order', 'file_url', 'srcset', 'fallback_srcset',
+            'processing_status', 'playback_url', 'hls_url', 'poster_url'
+        ] # Exclude upload_date for public?
         read_only_fields = fields
+
+    def media_path(self, content_id):
+        # Recipients reach media through their access token (see PublicCapsuleRetrieveView)
+        return reverse('public-capsule-media', args=[self.context['access_token'], content_id])
     
     def to_representation(self, instance):
         representation = super().to_representation(instance)
@@ -207,6 +480,7 @@ class PublicCapsuleSerializer(serializers.ModelSerializer):
 class NotificationSerializer(serializers.ModelSerializer):
     capsule_title = serializers.CharField(source='capsule.title', read_only=True, allow_null=True)
     created_at_formatted = serializers.DateTimeField(source='created_at', format="%b %d, %Y %I:%M %p", read_only=True)
+    is_read = serializers.SerializerMethodField()
 
     class Meta:
         model = Notification
@@ -222,4 +496,9 @@ class NotificationSerializer(serializers.ModelSerializer):
             'capsule_title'
         ]
         read_only_fields = ['id', 'created_at', 'read_at', 'capsule_title']
-        read_only_fields = ['id', 'created_at', 'read_at', 'capsule_title']
+
+    def get_is_read(self, obj):
+        # Honour the user's "mark all read" high-water mark when the request is available
+        request = self.context.get('request')
+        read_until = getattr(getattr(request, 'user', None), 'notifications_read_until', None)
+        return obj.is_read_for(read_until)
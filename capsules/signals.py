@@ -0,0 +1,88 @@
+# capsules/signals.py
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .blobs import release_blob
+from .caching import bump_user_cache_version
+from .models import Capsule, CapsuleContent, CapsuleContentType, CapsuleContentVariant, CapsuleContentVariantKind, Notification, hls_storage_prefix
+from .search import refresh_capsule_search_vectors
+
+SEARCHABLE_CAPSULE_FIELDS = {'title', 'description'}
+
+
+@receiver(post_delete, sender=CapsuleContent)
+def release_content_file(sender, instance, **kwargs):
+    # Also runs for contents removed by cascade (e.g. when a whole capsule is deleted)
+    if instance.blob_id:
+        release_blob(instance.blob_id)
+    elif instance.file:
+        # Legacy uploads own their file outright; django-cleanup ignores this model, so it goes here
+        transaction.on_commit(partial(instance.file.storage.delete, instance.file.name), robust=True)
+
+
+@receiver(post_delete, sender=CapsuleContentVariant)
+def delete_unshared_variant_files(sender, instance, **kwargs):
+    # Variants copied for deduplicated content share stored files; the last row using them deletes them
+    storage = instance.file.storage
+    if instance.file and not CapsuleContentVariant.objects.filter(file=instance.file.name).exists():
+        transaction.on_commit(partial(storage.delete, instance.file.name), robust=True)
+    if instance.kind != CapsuleContentVariantKind.HLS:
+        return
+    # Runs before a cascade deletes the content row itself, so the content can still be read
+    content = CapsuleContent.objects.filter(pk=instance.content_id).first()
+    if content is None:
+        return
+    remaining_hls = CapsuleContentVariant.objects.filter(kind=CapsuleContentVariantKind.HLS)
+    if content.blob_id:
+        remaining_hls = remaining_hls.filter(content__blob_id=content.blob_id)
+    else:
+        remaining_hls = remaining_hls.filter(content_id=content.pk)
+    if not remaining_hls.exists():
+        # HLS segments and rendition playlists live under a per-content (or per-blob) prefix
+        transaction.on_commit(partial(storage.delete_prefix, hls_storage_prefix(content)), robust=True)
+
+
+def _refresh_search_vector_on_commit(capsule_id):
+    transaction.on_commit(partial(refresh_capsule_search_vectors, [capsule_id]), robust=True)
+
+
+@receiver(post_save, sender=Capsule)
+def update_capsule_search_vector(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not SEARCHABLE_CAPSULE_FIELDS.intersection(update_fields):
+        return
+    _refresh_search_vector_on_commit(instance.pk)
+
+
+@receiver(post_save, sender=CapsuleContent)
+def update_search_vector_for_content(sender, instance, created, update_fields=None, **kwargs):
+    if instance.content_type != CapsuleContentType.TEXT:
+        return
+    if update_fields is not None and 'text_content' not in update_fields:
+        return
+    _refresh_search_vector_on_commit(instance.capsule_id)
+
+
+@receiver(post_delete, sender=CapsuleContent)
+def update_search_vector_after_content_delete(sender, instance, **kwargs):
+    if instance.content_type == CapsuleContentType.TEXT:
+        _refresh_search_vector_on_commit(instance.capsule_id)
+
+
+def invalidate_user_cache_on_commit(user_id):
+    # After commit, so a concurrent read cannot cache pre-commit data under the new version
+    transaction.on_commit(partial(bump_user_cache_version, user_id), robust=True)
+
+
+@receiver(post_save, sender=Capsule)
+@receiver(post_delete, sender=Capsule)
+def invalidate_owner_cache_for_capsule(sender, instance, **kwargs):
+    invalidate_user_cache_on_commit(instance.owner_id)
+
+
+@receiver(post_save, sender=Notification)
+@receiver(post_delete, sender=Notification)
+def invalidate_user_cache_for_notification(sender, instance, **kwargs):
+    invalidate_user_cache_on_commit(instance.user_id)
@@ -0,0 +1,54 @@
+# capsules/sms.py
+"""
+Pluggable SMS sending, modelled on django.core.mail backends. SMS_BACKEND names the class:
+
+- capsules.sms.ConsoleSmsBackend: writes messages to stdout (default when DEBUG).
+- capsules.sms.LocMemSmsBackend: keeps messages in capsules.sms.outbox (tests).
+- capsules.sms.DisabledSmsBackend: refuses to send (default otherwise), so a deployment
+  without a provider never reports SMS as delivered.
+
+A provider integration subclasses BaseSmsBackend and implements send_messages().
+"""
+import sys
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+# Messages "sent" through LocMemSmsBackend
+outbox = []
+_outbox_lock = threading.Lock()
+
+
+class BaseSmsBackend:
+    def send_messages(self, messages):
+        """
+        Sends every (phone_number, text) pair in `messages`. Returns a list of the same length
+        holding None for each message that was sent and an error string for each that failed.
+        """
+        raise NotImplementedError
+
+
+class ConsoleSmsBackend(BaseSmsBackend):
+    def send_messages(self, messages):
+        for phone_number, text in messages:
+            sys.stdout.write(f"SMS to {phone_number}: {text}\n")
+        sys.stdout.flush()
+        return [None] * len(messages)
+
+
+class DisabledSmsBackend(BaseSmsBackend):
+    def send_messages(self, messages):
+        raise ImproperlyConfigured("No SMS provider is configured; set SMS_BACKEND.")
+
+
+class LocMemSmsBackend(BaseSmsBackend):
+    def send_messages(self, messages):
+        with _outbox_lock:
+            outbox.extend(messages)
+        return [None] * len(messages)
+
+
+def get_sms_backend():
+    return import_string(settings.SMS_BACKEND)()
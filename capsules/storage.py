@@ -0,0 +1,180 @@
+# capsules/storage.py
+"""
+Django storage backends for capsule media, selected with MEDIA_STORAGE_BACKEND:
+
+- 'cloudinary': Cloudinary, storing names in the same "<resource_type>/<type>/v<version>/<public_id>.<format>"
+  form CloudinaryField used, so existing rows keep working. New uploads are 'authenticated' assets,
+  reachable only through expiring signed download URLs.
+- 's3': any S3-compatible service (AWS, MinIO, ...). Large files are uploaded as parallel multipart
+  uploads through s3transfer.
+- 'local': the local filesystem under MEDIA_ROOT, for offline development and benchmarks. Files
+  have a real path, so they can be served with sendfile.
+
+Besides the Django Storage API every backend implements MediaStorageMixin. Capsule media is private:
+clients get it through the access-checked media endpoints (see capsules.media_delivery), which
+redirect to a signed_url() valid for a few minutes or hand local files to the web server.
+"""
+import os
+import re
+import shutil
+import tempfile
+import time
+
+import cloudinary
+import cloudinary.api
+import cloudinary.uploader
+import cloudinary.utils
+import requests
+from boto3.s3.transfer import TransferConfig
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage, Storage
+from storages.backends.s3 import S3Storage
+from storages.utils import clean_name
+
+
+class MediaStorageMixin:
+    """
+    Operations the capsule media code needs beyond the Django Storage API. Each backend also
+    implements delete_prefix(prefix), which deletes every stored file whose name starts with it.
+    """
+
+    def signed_url(self, name, expire):
+        """A URL for `name` that is valid for at least `expire` seconds."""
+        return self.url(name)
+
+    def local_path(self, name):
+        """Filesystem path of `name` if the file lives on this machine (sendfile-able), else None."""
+        return None
+
+
+# --- Cloudinary ---
+
+CLOUDINARY_NAME_RE = re.compile(
+    r'^(?:(?P<resource_type>image|raw|video)/(?P<type>upload|private|authenticated)/)?'
+    r'(?:v(?P<version>\d+)/)?(?P<public_id>.*?)(?:\.(?P<format>[^./]+))?$'
+)
+# Stored as opaque files; Cloudinary would otherwise try to treat HLS segments as video
+CLOUDINARY_RAW_EXTENSIONS = {'.m3u8', '.ts', '.json', '.txt'}
+
+
+class CloudinaryMediaStorage(MediaStorageMixin, Storage):
+    """
+    Stores files on Cloudinary as authenticated assets with auto-detected resource types and
+    unique public ids.
+    """
+
+    def _resource(self, name):
+        match = CLOUDINARY_NAME_RE.match(name)
+        resource_type = match.group('resource_type') or 'image'
+        public_id, file_format = match.group('public_id'), match.group('format')
+        if resource_type == 'raw' and file_format:
+            # Raw public ids keep their extension
+            public_id, file_format = f"{public_id}.{file_format}", None
+        return cloudinary.CloudinaryResource(
+            public_id=public_id,
+            format=file_format,
+            version=match.group('version'),
+            type=match.group('type') or 'upload',
+            resource_type=resource_type,
+        )
+
+    def _save(self, name, content):
+        directory = os.path.dirname(name)
+        is_raw = os.path.splitext(name)[1].lower() in CLOUDINARY_RAW_EXTENSIONS
+        content.seek(0)
+        # Cloudinary assigns a random public id inside the folder
+        result = cloudinary.uploader.upload(
+            content,
+            folder=directory or None,
+            resource_type='raw' if is_raw else 'auto',
+            type='authenticated',
+        )
+        stored_name = f"{result['resource_type']}/{result['type']}/v{result['version']}/{result['public_id']}"
+        if result.get('format') and result['resource_type'] != 'raw':
+            stored_name += f".{result['format']}"
+        return stored_name
+
+    def _open(self, name, mode='rb'):
+        temporary_file = tempfile.SpooledTemporaryFile(max_size=10 * 1024 * 1024)
+        with requests.get(self.signed_url(name, expire=5 * 60), stream=True, timeout=30) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(chunk_size=1024 * 1024):
+                temporary_file.write(chunk)
+        temporary_file.seek(0)
+        return File(temporary_file, name=name)
+
+    def delete(self, name):
+        resource = self._resource(name)
+        cloudinary.uploader.destroy(resource.public_id, resource_type=resource.resource_type, type=resource.type)
+
+    def exists(self, name):
+        # Uploads always get a random public id, so a name is never taken
+        return False
+
+    def size(self, name):
+        resource = self._resource(name)
+        return cloudinary.api.resource(resource.public_id, resource_type=resource.resource_type, type=resource.type)['bytes']
+
+    def url(self, name):
+        # Assets are private, so even plain URLs (e.g. admin links) are short-lived signed ones
+        return self.signed_url(name, expire=settings.MEDIA_REDIRECT_URL_TTL_SECONDS)
+
+    def signed_url(self, name, expire):
+        # A download API URL signed with the API secret; Cloudinary rejects it after expires_at
+        resource = self._resource(name)
+        return cloudinary.utils.private_download_url(
+            resource.public_id,
+            resource.format,
+            resource_type=resource.resource_type,
+            type=resource.type,
+            expires_at=int(time.time()) + expire,
+        )
+
+    def delete_prefix(self, prefix):
+        for resource_type in ('raw', 'image', 'video'):
+            cloudinary.api.delete_resources_by_prefix(prefix, resource_type=resource_type)
+
+
+# --- S3-compatible ---
+
+class S3MediaStorage(MediaStorageMixin, S3Storage):
+    """
+    S3 storage whose uploads go through s3transfer: files above MEDIA_S3_MULTIPART_THRESHOLD are
+    split into MEDIA_S3_MULTIPART_CHUNKSIZE parts uploaded by MEDIA_S3_MAX_CONCURRENCY threads.
+    Point AWS_S3_ENDPOINT_URL at MinIO to run against a local stand-in.
+    """
+
+    def __init__(self, **settings_overrides):
+        super().__init__(**settings_overrides)
+        self.transfer_config = TransferConfig(
+            multipart_threshold=settings.MEDIA_S3_MULTIPART_THRESHOLD,
+            multipart_chunksize=settings.MEDIA_S3_MULTIPART_CHUNKSIZE,
+            max_concurrency=settings.MEDIA_S3_MAX_CONCURRENCY,
+            use_threads=True,
+        )
+
+    def signed_url(self, name, expire):
+        key = self._normalize_name(clean_name(name))
+        return self.bucket.meta.client.generate_presigned_url(
+            'get_object', Params={'Bucket': self.bucket.name, 'Key': key}, ExpiresIn=expire
+        )
+
+    def delete_prefix(self, prefix):
+        self.bucket.objects.filter(Prefix=self._normalize_name(clean_name(prefix))).delete()
+
+
+# --- Local filesystem ---
+
+class LocalMediaStorage(MediaStorageMixin, FileSystemStorage):
+    """
+    MEDIA_ROOT on the local disk. Meant for development, tests and benchmarks.
+    """
+
+    def delete_prefix(self, prefix):
+        path = self.path(prefix)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+
+    def local_path(self, name):
+        return self.path(name)
@@ -1,6 +1,8 @@
 from celery import shared_task
+from celery.exceptions import Retry
 from django.utils import timezone
 from django.conf import settings
+from django.db.models import F, Q
 from .models import (
     Capsule, 
     CapsuleContent, 
@@ -12,9 +14,23 @@ from .models import (
     CapsuleContentType, 
     CapsuleContentType,
     Notification,
-    NotificationType
+    NotificationType,
+    MediaProcessingStatus,
+    OutboxMessage
 )
-from .utils import send_capsule_link_email
+from .utils import send_capsule_link_email, delete_in_batches
+from .rate_limits import email_send_bucket
+from .delivery_failures import DeliveryError, backoff_delay, dead_letter_delivery
+from .channels import dispatch_capsule, dispatch_recipients
+from . import delivery_logs
+from .uploads import prune_stale_uploads
+from .reminders import run_reminder_job
+from .transfers import run_inactivity_transfers
+from .outbox import drain_outbox
+from .media import generate_image_variants, transcode_video, VideoProcessingError
+from PIL import Image, UnidentifiedImageError
+import requests
+from django_celery_results.models import TaskResult
 import datetime
 import logging
 import uuid # Import uuid
@@ -25,12 +41,14 @@ logger.disabled = settings.DISABLE_LOGGING  # Use the global setting to control
 @shared_task(
     bind=True, 
     name='capsules.deliver_capsule_email', # Explicit task name
-    max_retries=3, 
-    default_retry_delay=2 * 60
+    ignore_result=True, # Outcome is recorded in DeliveryLog, no need for a result row per attempt
+    max_retries=settings.DELIVERY_MAX_RETRIES # Delays come from backoff_delay (exponential, full jitter)
 )
-def deliver_capsule_email_task(self, capsule_id, recipient_id):
+def deliver_capsule_email_task(self, capsule_id, recipient_id, send_slot_reserved=False):
     """
     Celery task to deliver a capsule email to a specific recipient.
+    Sends are admitted by the cluster-wide email rate limiter; a task over the limit re-queues
+    itself for its reserved send slot (send_slot_reserved=True) instead of failing.
     """
     try:
         logger.info(f"Starting delivery task for capsule ID {capsule_id} to recipient ID {recipient_id}")
@@ -41,6 +59,28 @@ def deliver_capsule_email_task(self, capsule_id, recipient_id):
             logger.info(f"Capsule ID {capsule_id} already delivered to recipient {recipient.recipient_email}. Skipping.")
             return f"Capsule {capsule_id} already delivered to {recipient.recipient_email}."
 
+        if not send_slot_reserved:
+            bucket = email_send_bucket()
+            wait_seconds = bucket.reserve()
+            if wait_seconds > 0:
+                slot_reserved = wait_seconds <= bucket.max_wait
+                # Beyond max_wait no slot was reserved: ask again after max_wait, so no countdown
+                # outlives the broker's visibility timeout however long the backlog is
+                countdown = wait_seconds if slot_reserved else bucket.max_wait
+                # A deferral is not a retry: the copy keeps this attempt's retry count and stays on
+                # its queue (delivery_retries for a retried send) instead of starting over
+                options = {'countdown': countdown, 'retries': self.request.retries}
+                routing_key = (self.request.delivery_info or {}).get('routing_key')
+                if routing_key:
+                    options['queue'] = routing_key
+                deliver_capsule_email_task.apply_async(
+                    args=[capsule_id, recipient_id],
+                    kwargs={'send_slot_reserved': slot_reserved},
+                    **options
+                )
+                logger.info(f"Email rate limit reached; delivery of capsule ID {capsule_id} to recipient ID {recipient_id} deferred by {countdown:.2f}s.")
+                return f"Deferred by {countdown:.2f}s."
+
         logger.info(f"Attempting to deliver capsule ID {capsule_id} to {recipient.recipient_email}")
 
         # Construct owner's name - assuming owner has a 'name' attribute
@@ -69,73 +109,65 @@ def deliver_capsule_email_task(self, capsule_id, recipient_id):
         text_content_for_email = first_text_content_obj.text_content if first_text_content_obj else None
         logger.info(f"Text content for email: {text_content_for_email}")
 
-        # send_capsule_link_email now returns a tuple: (bool_success, message_string)
-        email_sent_successfully, email_status_message = send_capsule_link_email(
-            recipient_email=recipient.recipient_email,
-            capsule_title=capsule.title,
-            capsule_id=capsule.id, # Still useful for internal reference
-            owner_name=owner_name,
-            text_content=text_content_for_email,
-            access_token=recipient.access_token # Pass the access token
-        )
-
-        if email_sent_successfully: # Check the boolean success flag
-            capsule.is_delivered = True # Mark main capsule as delivered
-            capsule.is_unlocked = True  # Mark capsule as unlocked since the link is sent
-            capsule.save(update_fields=['is_delivered', 'is_unlocked'])
-
-            recipient.received_status = CapsuleRecipientStatus.SENT
-            recipient.sent_date = timezone.now()
-            recipient.save(update_fields=['received_status', 'sent_date'])
-
-            DeliveryLog.objects.create(
-                capsule=capsule,
-                delivery_method=CapsuleDeliveryMethod.EMAIL, 
+        try:
+            email_status_message = send_capsule_link_email(
                 recipient_email=recipient.recipient_email,
-                status=DeliveryLogStatus.SUCCESS,
-                details=email_status_message # Store success message
+                capsule_title=capsule.title,
+                capsule_id=capsule.id, # Still useful for internal reference
+                owner_name=owner_name,
+                text_content=text_content_for_email,
+                access_token=recipient.access_token # Pass the access token
             )
-            logger.info(f"Successfully delivered capsule ID {capsule_id} to {recipient.recipient_email}: {email_status_message}")
-
-            # Create "Capsule Delivered" notification for the owner
-            try:
-                Notification.objects.create(
-                    user=capsule.owner,
-                    capsule=capsule,
-                    message=f"Your time capsule '{capsule.title}' has been successfully delivered to {recipient.recipient_email}.",
-                    notification_type=NotificationType.DELIVERY_SUCCESS
-                )
-                logger.info(f"Delivery notification created for capsule ID {capsule.id} to {recipient.recipient_email}")
-            except Exception as e:
-                logger.error(f"Failed to create delivery notification for capsule ID {capsule.id}: {e}")
-            
-            return f"Successfully delivered capsule {capsule_id} to {recipient.recipient_email}."
-        else:
-            # Email sending failed
-            recipient.received_status = CapsuleRecipientStatus.FAILED
-            recipient.save(update_fields=['received_status'])
-            # Create "Capsule Delivery Failed" notification for the owner
-            try:
-                Notification.objects.create(
-                    user=capsule.owner,
-                    capsule=capsule,
-                    message=f"Failed to deliver your time capsule '{capsule.title}' to {recipient.recipient_email}. Reason: {email_status_message}",
-                    notification_type=NotificationType.DELIVERY_FAIL
-                )
-            except Exception as e:
-                logger.error(f"Failed to create delivery failure notification for capsule ID {capsule.id}: {e}")
-
+        except DeliveryError as e:
             DeliveryLog.objects.create(
                 capsule=capsule,
                 delivery_method=CapsuleDeliveryMethod.EMAIL,
                 recipient_email=recipient.recipient_email,
                 status=DeliveryLogStatus.FAILURE,
-                error_message="Email sending failed via Celery task.", # Generic error
-                details=email_status_message # Store specific error from send_capsule_link_email
+                error_message="Email sending failed via Celery task." + (" (permanent)" if e.permanent else ""),
+                details=str(e) # Store specific error from send_capsule_link_email
             )
-            logger.error(f"Email sending failed for capsule ID {capsule_id} to {recipient.recipient_email}. Specific error: {email_status_message}")
-            # Raise an exception with the specific error message to trigger Celery retry
-            raise Exception(f"Email sending failed: {email_status_message}")
+            if e.permanent or self.request.retries >= self.max_retries:
+                # Permanent errors never consume retries; exhausted ones stop here too
+                dead_letter_delivery(
+                    capsule_id, recipient_id, str(e), e.permanent, self.request.retries + 1, CapsuleDeliveryMethod.EMAIL
+                )
+                return f"Delivery of capsule {capsule_id} to {recipient.recipient_email} dead-lettered."
+            countdown = backoff_delay(self.request.retries)
+            logger.warning(f"Email sending failed for capsule ID {capsule_id} to {recipient.recipient_email}; retrying in {countdown:.0f}s. Specific error: {e}")
+            # Retries wait on their own queue so they never delay first attempts, and for a fresh send slot
+            raise self.retry(exc=e, countdown=countdown, queue=settings.DELIVERY_RETRY_QUEUE, kwargs={})
+
+        capsule.is_delivered = True # Mark main capsule as delivered
+        capsule.is_unlocked = True  # Mark capsule as unlocked since the link is sent
+        capsule.save(update_fields=['is_delivered', 'is_unlocked'])
+
+        recipient.received_status = CapsuleRecipientStatus.SENT
+        recipient.sent_date = timezone.now()
+        recipient.save(update_fields=['received_status', 'sent_date'])
+
+        DeliveryLog.objects.create(
+            capsule=capsule,
+            delivery_method=CapsuleDeliveryMethod.EMAIL, 
+            recipient_email=recipient.recipient_email,
+            status=DeliveryLogStatus.SUCCESS,
+            details=email_status_message # Store success message
+        )
+        logger.info(f"Successfully delivered capsule ID {capsule_id} to {recipient.recipient_email}: {email_status_message}")
+
+        # Create "Capsule Delivered" notification for the owner
+        try:
+            Notification.objects.create(
+                user=capsule.owner,
+                capsule=capsule,
+                message=f"Your time capsule '{capsule.title}' has been successfully delivered to {recipient.recipient_email}.",
+                notification_type=NotificationType.DELIVERY_SUCCESS
+            )
+            logger.info(f"Delivery notification created for capsule ID {capsule.id} to {recipient.recipient_email}")
+        except Exception as e:
+            logger.error(f"Failed to create delivery notification for capsule ID {capsule.id}: {e}")
+        
+        return f"Successfully delivered capsule {capsule_id} to {recipient.recipient_email}."
 
     except Capsule.DoesNotExist:
         logger.exception(f"Capsule ID {capsule_id} not found. Cannot deliver.")
@@ -145,8 +177,230 @@ def deliver_capsule_email_task(self, capsule_id, recipient_id):
         logger.exception(f"Recipient ID {recipient_id} for Capsule ID {capsule_id} not found. Cannot deliver.")
         # Do not retry if recipient doesn't exist
         return f"Recipient {recipient_id} for capsule {capsule_id} not found."
+    except Retry:
+        raise
     except Exception as exc:
         logger.exception(f"An error occurred delivering capsule ID {capsule_id} to recipient ID {recipient_id}: {exc}")
-        # Retry the task for other exceptions (like network issues during email sending)
+        if self.request.retries >= self.max_retries:
+            dead_letter_delivery(
+                capsule_id, recipient_id, str(exc), False, self.request.retries + 1, CapsuleDeliveryMethod.EMAIL
+            )
+            return f"Delivery of capsule {capsule_id} to recipient {recipient_id} dead-lettered."
+        # Retry the task for other exceptions (e.g. the database or broker being unavailable)
+        raise self.retry(
+            exc=exc, countdown=backoff_delay(self.request.retries), queue=settings.DELIVERY_RETRY_QUEUE, kwargs={}
+        )
+
+
+@shared_task(name='capsules.deliver_capsule', ignore_result=True)
+def deliver_capsule_task(capsule_id):
+    """
+    Celery task scheduled once per capsule at its delivery time.
+    Streams the pending recipients in chunks through the capsule's delivery channel (see capsules.channels).
+    """
+    try:
+        capsule = Capsule.objects.select_related('owner').get(pk=capsule_id)
+    except Capsule.DoesNotExist:
+        logger.warning(f"Capsule ID {capsule_id} not found. Skipping delivery.")
+        return
+
+    dispatched_count = dispatch_capsule(capsule, batch_size=settings.DELIVERY_DISPATCH_BATCH_SIZE)
+    logger.info(f"Dispatched delivery of capsule ID {capsule_id} ({capsule.delivery_method}) to {dispatched_count} pending recipient(s).")
+
+
+@shared_task(name='capsules.deliver_capsule_recipients', ignore_result=True)
+def deliver_capsule_recipients_task(capsule_id, recipient_ids, attempt=0):
+    """
+    Celery task that delivers a capsule to some of its pending recipients: SMS retries and
+    replayed dead letters of channels other than email.
+    """
+    try:
+        capsule = Capsule.objects.select_related('owner').get(pk=capsule_id)
+    except Capsule.DoesNotExist:
+        logger.warning(f"Capsule ID {capsule_id} not found. Skipping delivery.")
+        return
+
+    dispatched_count = dispatch_recipients(
+        capsule, recipient_ids, attempt=attempt, batch_size=settings.DELIVERY_DISPATCH_BATCH_SIZE
+    )
+    logger.info(f"Dispatched delivery of capsule ID {capsule_id} ({capsule.delivery_method}) to {dispatched_count} recipient(s), attempt {attempt + 1}.")
+
+
+@shared_task(
+    bind=True,
+    name='capsules.generate_image_variants',
+    ignore_result=True,
+    max_retries=3,
+    default_retry_delay=60
+)
+def generate_image_variants_task(self, content_id):
+    """
+    Celery task that creates the resized WebP/JPEG variants of an uploaded image.
+    """
+    try:
+        content = CapsuleContent.objects.select_related('capsule').get(pk=content_id, content_type=CapsuleContentType.IMAGE)
+    except CapsuleContent.DoesNotExist:
+        logger.warning(f"Image CapsuleContent ID {content_id} not found. Skipping variant generation.")
+        return
+    if not content.file:
+        return
+
+    try:
+        generate_image_variants(content)
+    except requests.RequestException as exc:
+        logger.warning(f"Could not download CapsuleContent ID {content_id} for variant generation: {exc}")
         raise self.retry(exc=exc)
+    except (UnidentifiedImageError, Image.DecompressionBombError) as e:
+        # Not retryable: the stored file is not an image Pillow can safely decode
+        logger.error(f"Cannot generate variants for CapsuleContent ID {content_id}: {e}")
 
+
+@shared_task(
+    bind=True,
+    name='capsules.transcode_video',
+    ignore_result=True,
+    max_retries=3,
+    default_retry_delay=5*60
+)
+def transcode_video_task(self, content_id):
+    """
+    Celery task that transcodes an uploaded video to faststart MP4 (plus poster and optional HLS)
+    and records the outcome on CapsuleContent.processing_status.
+    """
+    try:
+        content = CapsuleContent.objects.get(pk=content_id, content_type=CapsuleContentType.VIDEO)
+    except CapsuleContent.DoesNotExist:
+        logger.warning(f"Video CapsuleContent ID {content_id} not found. Skipping transcoding.")
+        return
+    if not content.file:
+        return
+
+    CapsuleContent.objects.filter(pk=content_id).update(
+        processing_status=MediaProcessingStatus.PROCESSING, processing_error=None
+    )
+    try:
+        transcode_video(content)
+    except requests.RequestException as exc:
+        logger.warning(f"Could not download CapsuleContent ID {content_id} for transcoding: {exc}")
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=exc)
+        error_message = str(exc)
+    except VideoProcessingError as e:
+        # Not retryable: ffmpeg rejected the source file
+        logger.error(f"Transcoding failed for CapsuleContent ID {content_id}: {e}")
+        error_message = str(e)
+    except Exception as e:
+        # Anything unexpected (storage, database) must not leave the item PROCESSING forever
+        logger.exception(f"Unexpected error transcoding CapsuleContent ID {content_id}: {e}")
+        CapsuleContent.objects.filter(pk=content_id).update(
+            processing_status=MediaProcessingStatus.FAILED, processing_error=str(e)
+        )
+        raise
+    else:
+        CapsuleContent.objects.filter(pk=content_id).update(processing_status=MediaProcessingStatus.READY)
+        return
+
+    CapsuleContent.objects.filter(pk=content_id).update(
+        processing_status=MediaProcessingStatus.FAILED, processing_error=error_message
+    )
+
+
+@shared_task(name='capsules.prune_task_results', ignore_result=True)
+def prune_task_results_task():
+    """
+    Periodic task that trims historical django_celery_results rows in small batches.
+    """
+    cutoff = timezone.now() - datetime.timedelta(days=settings.TASK_RESULT_RETENTION_DAYS)
+    deleted_count = delete_in_batches(
+        TaskResult.objects.filter(date_done__lt=cutoff),
+        batch_size=settings.TASK_RESULT_PRUNE_BATCH_SIZE
+    )
+    logger.info(f"Pruned {deleted_count} task result rows older than {cutoff}.")
+    return deleted_count
+
+
+@shared_task(name='capsules.maintain_delivery_log_partitions', ignore_result=True)
+def maintain_delivery_log_partitions_task():
+    """
+    Periodic task that keeps future DeliveryLog partitions ready and drops expired ones.
+    """
+    created = delivery_logs.ensure_partitions(settings.DELIVERY_LOG_PARTITIONS_AHEAD)
+    dropped = delivery_logs.drop_expired_partitions(settings.DELIVERY_LOG_RETENTION_MONTHS)
+    logger.info(f"Delivery log partitions maintained: created {created}, dropped {dropped}.")
+
+
+@shared_task(name='capsules.rollup_delivery_logs', ignore_result=True)
+def rollup_delivery_logs_task():
+    """
+    Periodic task that refreshes the daily delivery summaries for the last few UTC days.
+    """
+    today_utc = timezone.now().astimezone(datetime.timezone.utc).date()
+    start_date = today_utc - datetime.timedelta(days=settings.DELIVERY_LOG_ROLLUP_DAYS)
+    delivery_logs.rollup_delivery_logs(start_date, today_utc + datetime.timedelta(days=1))
+
+
+@shared_task(name='capsules.prune_read_notifications', ignore_result=True)
+def prune_read_notifications_task():
+    """
+    Periodic task that deletes read notifications older than NOTIFICATION_RETENTION_DAYS in small batches.
+    A notification is read if its own flag is set or it predates the user's notifications_read_until.
+    """
+    cutoff = timezone.now() - datetime.timedelta(days=settings.NOTIFICATION_RETENTION_DAYS)
+    expired_notifications = Notification.objects.filter(created_at__lt=cutoff).filter(
+        Q(is_read=True) | Q(created_at__lte=F('user__notifications_read_until'))
+    )
+    deleted_count = delete_in_batches(expired_notifications, batch_size=settings.NOTIFICATION_RETENTION_BATCH_SIZE)
+    logger.info(f"Deleted {deleted_count} read notifications created before {cutoff}.")
+    return deleted_count
+
+
+@shared_task(name='capsules.prune_stale_uploads', ignore_result=True)
+def prune_stale_uploads_task():
+    """
+    Periodic task that deletes resumable uploads nobody finished or attached to a capsule.
+    """
+    prune_stale_uploads(settings.RESUMABLE_UPLOAD_EXPIRY_HOURS)
+
+
+@shared_task(name='capsules.send_capsule_reminders', ignore_result=True)
+def send_capsule_reminders_task():
+    """
+    Periodic task that notifies owners of capsules entering one of the REMINDER_WINDOWS_DAYS stages.
+    """
+    emitted_count = run_reminder_job(batch_size=settings.REMINDER_BATCH_SIZE)
+    if emitted_count is not None:
+        logger.info(f"Emitted {emitted_count} capsule reminder notifications.")
+
+
+@shared_task(name='capsules.transfer_inactive_owner_capsules', ignore_result=True)
+def transfer_inactive_owner_capsules_task():
+    """
+    Periodic task that transfers opted-in capsules of owners inactive for INACTIVITY_TRANSFER_DAYS
+    to their transfer recipients.
+    """
+    transferred_count = run_inactivity_transfers(
+        settings.INACTIVITY_TRANSFER_DAYS, batch_size=settings.INACTIVITY_TRANSFER_BATCH_SIZE
+    )
+    logger.info(f"Transferred {transferred_count} capsules of inactive owners.")
+
+
+@shared_task(name='capsules.relay_outbox', ignore_result=True)
+def relay_outbox_task():
+    """
+    Periodic fallback for the relay_outbox command: publishes whatever is left in the outbox.
+    """
+    published_count = drain_outbox(settings.OUTBOX_RELAY_BATCH_SIZE)
+    if published_count:
+        logger.info(f"Published {published_count} outbox messages from the periodic relay.")
+
+
+@shared_task(name='capsules.prune_outbox', ignore_result=True)
+def prune_outbox_task():
+    """
+    Periodic task that deletes published outbox messages older than OUTBOX_RETENTION_HOURS in small batches.
+    """
+    cutoff = timezone.now() - datetime.timedelta(hours=settings.OUTBOX_RETENTION_HOURS)
+    deleted_count = delete_in_batches(
+        OutboxMessage.objects.filter(published_at__lt=cutoff), batch_size=settings.OUTBOX_PRUNE_BATCH_SIZE
+    )
+    logger.info(f"Pruned {deleted_count} published outbox messages older than {cutoff}.")
@@ -1,3 +1,1925 @@
-from django.test import TestCase
+import base64
+import datetime
+import fcntl
+import io
+import json
+import os
+import shutil
+import smtplib
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+import uuid
+import zipfile
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
 
-# Create your tests here.
+import cloudinary
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import DatabaseError, connection, transaction
+from django.http import Http404
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django_celery_results.models import TaskResult
+from PIL import Image
+from rest_framework.test import APIClient
+from time_capsule_backend.celery import app as celery_app
+
+from . import admin_performance, blobs, caching, delivery_logs, sms
+from .admin_performance import EstimatedCountPaginator
+from .archives import iter_capsule_zip
+from .blobs import acquire_blob, release_blob
+from .channels import dispatch_capsule, dispatch_recipients
+from .dashboard import get_dashboard_summary, get_delivery_calendar
+from .delivery_failures import backoff_delay, is_permanent_email_error, replay_dead_letters
+from .exports import iter_user_export
+from .media import copy_blob_variants, generate_image_variants
+from .media_delivery import parse_range_header, serve_hls_playlist, serve_media_file
+from .models import (
+    Capsule,
+    CapsuleContent,
+    CapsuleContentType,
+    CapsuleContentVariant,
+    CapsuleContentVariantKind,
+    CapsuleDeliveryMethod,
+    CapsuleRecipient,
+    CapsuleRecipientStatus,
+    DeadLetterDelivery,
+    DeliveryLog,
+    DeliveryLogDailySummary,
+    DeliveryLogStatus,
+    MediaBlob,
+    MediaProcessingStatus,
+    MediaUpload,
+    MediaUploadStatus,
+    Notification,
+    NotificationType,
+    OutboxMessage,
+)
+from .outbox import drain_outbox, enqueue_task, enqueue_tasks, publish_pending_messages
+from .reminders import emit_due_reminders
+from .serializers import (
+    CapsuleContentSerializer,
+    PublicCapsuleContentSerializer,
+    build_image_srcset,
+    original_filename,
+)
+from .storage import CloudinaryMediaStorage, LocalMediaStorage, S3MediaStorage
+from .tasks import (
+    deliver_capsule_email_task,
+    deliver_capsule_recipients_task,
+    deliver_capsule_task,
+    prune_read_notifications_task,
+    prune_task_results_task,
+    transcode_video_task,
+)
+from .transfers import run_inactivity_transfers
+from .uploads import append_chunk
+from .utils import parse_recipient_csv, registered_user_ids_by_email
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+class LocalMediaStorageTests(SimpleTestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.storage = LocalMediaStorage(location=self.media_root, base_url='/media/')
+
+    def test_saved_file_has_a_local_path_for_sendfile(self):
+        name = self.storage.save('capsule_media/2026/10/photo.jpg', ContentFile(b'jpeg bytes'))
+        path = self.storage.local_path(name)
+        self.assertTrue(path.startswith(self.media_root))
+        with open(path, 'rb') as stored:
+            self.assertEqual(stored.read(), b'jpeg bytes')
+
+    def test_signed_url_is_the_plain_url(self):
+        name = self.storage.save('capsule_media/photo.jpg', ContentFile(b'x'))
+        self.assertEqual(self.storage.signed_url(name, expire=60), self.storage.url(name))
+
+    def test_delete_prefix_removes_only_that_prefix(self):
+        segment = self.storage.save('capsule_hls/blob_1/720p/segment_000.ts', ContentFile(b'ts'))
+        playlist = self.storage.save('capsule_hls/blob_1/720p.m3u8', ContentFile(b'm3u8'))
+        other = self.storage.save('capsule_hls/blob_2/720p.m3u8', ContentFile(b'm3u8'))
+
+        self.storage.delete_prefix('capsule_hls/blob_1/')
+
+        self.assertFalse(self.storage.exists(segment))
+        self.assertFalse(self.storage.exists(playlist))
+        self.assertTrue(self.storage.exists(other))
+
+    def test_delete_prefix_of_missing_directory_is_a_no_op(self):
+        self.storage.delete_prefix('capsule_hls/blob_404/')
+
+
+class _StoredFile:
+    def __init__(self, storage, name):
+        self.storage = storage
+        self.name = name
+
+
+class _SigningStorage(LocalMediaStorage):
+    def signed_url(self, name, expire):
+        return f"https://cdn.example.com/{name}?expires={expire}"
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class HlsPlaylistTests(SimpleTestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        self.storage = _SigningStorage(location=media_root, base_url='/media/')
+        prefix = f"capsule_hls/blob_{uuid.uuid4().hex}/"
+        rendition = self.storage.save(f"{prefix}720p.m3u8", ContentFile(
+            f"#EXTM3U\n#EXTINF:6.0,\n{prefix}720p/segment_000.ts\n#EXT-X-ENDLIST\n".encode()
+        ))
+        self.segment = f"{prefix}720p/segment_000.ts"
+        master = self.storage.save(f"{prefix}master.m3u8", ContentFile(
+            f"#EXTM3U\n#EXT-X-STREAM-INF:BANDWIDTH=2800000\n{rendition}\n".encode()
+        ))
+        self.master = _StoredFile(self.storage, master)
+        self.factory = RequestFactory()
+
+    def test_master_links_renditions_back_to_the_endpoint(self):
+        response = serve_hls_playlist(self.factory.get('/media/1/', {'variant': '7'}), self.master)
+        lines = response.content.decode().splitlines()
+        self.assertEqual(lines[-1], '?variant=7&rendition=0')
+        self.assertEqual(response['Content-Type'], 'application/vnd.apple.mpegurl')
+
+    def _rendition(self, now):
+        request = self.factory.get('/media/1/', {'variant': '7', 'rendition': '0'})
+        with self.settings(MEDIA_HLS_URL_TTL_SECONDS=3600), mock.patch('capsules.media_delivery.time.time', return_value=now):
+            return serve_hls_playlist(request, self.master, '0').content.decode().splitlines()
+
+    def test_rendition_segments_are_signed_past_the_end_of_their_time_bucket(self):
+        # Signed 10 minutes into the bucket [7200, 10800): valid until an hour after it ends
+        self.assertIn(f"https://cdn.example.com/{self.segment}?expires=6600", self._rendition(7800))
+
+    def test_signed_segment_urls_are_reused_within_a_time_bucket(self):
+        first = self._rendition(7800)
+        with mock.patch.object(self.storage, 'signed_url') as signed_url:
+            self.assertEqual(self._rendition(10799), first)
+        signed_url.assert_not_called()
+        self.assertIn(f"https://cdn.example.com/{self.segment}?expires=7200", self._rendition(10800))
+
+    def test_unknown_rendition_is_not_found(self):
+        with self.assertRaises(Http404):
+            serve_hls_playlist(self.factory.get('/media/1/'), self.master, '3')
+
+
+
+class CloudinaryMediaStorageTests(SimpleTestCase):
+    def setUp(self):
+        previous = cloudinary.config()
+        saved = (previous.cloud_name, previous.api_key, previous.api_secret)
+        cloudinary.config(cloud_name='demo', api_key='test-key', api_secret='test-secret')
+        self.addCleanup(lambda: cloudinary.config(cloud_name=saved[0], api_key=saved[1], api_secret=saved[2]))
+
+    def test_signed_url_expires(self):
+        before = int(time.time())
+        url = CloudinaryMediaStorage().signed_url('video/authenticated/v1700000000/capsule_media/clip.mp4', expire=300)
+        query = parse_qs(urlparse(url).query)
+        self.assertIn('/video/download', urlparse(url).path)
+        self.assertEqual(query['type'], ['authenticated'])
+        self.assertEqual(query['public_id'], ['capsule_media/clip'])
+        self.assertTrue(before + 300 <= int(query['expires_at'][0]) <= int(time.time()) + 300)
+        self.assertIn('signature', query)
+
+    def test_raw_assets_keep_their_extension_in_the_public_id(self):
+        url = CloudinaryMediaStorage().signed_url('raw/authenticated/v1700000000/capsule_hls/blob_1/720p.m3u8', expire=60)
+        query = parse_qs(urlparse(url).query)
+        self.assertEqual(query['public_id'], ['capsule_hls/blob_1/720p.m3u8'])
+        self.assertNotIn('format', query)
+
+
+def _s3_test_storage(**overrides):
+    return S3MediaStorage(
+        access_key='test-access-key',
+        secret_key='test-secret-key',
+        bucket_name='time-capsule-test',
+        endpoint_url='http://127.0.0.1:9000',
+        region_name='us-east-1',
+        signature_version='s3v4',
+        **overrides
+    )
+
+
+class S3MediaStorageTests(SimpleTestCase):
+    def test_signed_url_is_presigned_for_the_requested_lifetime(self):
+        url = _s3_test_storage().signed_url('capsule_media/photo.jpg', expire=120)
+        parsed = urlparse(url)
+        self.assertEqual(parsed.path, '/time-capsule-test/capsule_media/photo.jpg')
+        self.assertEqual(parse_qs(parsed.query)['X-Amz-Expires'], ['120'])
+
+    def test_transfer_config_uses_the_multipart_settings(self):
+        with self.settings(MEDIA_S3_MULTIPART_THRESHOLD=5 * 1024 * 1024, MEDIA_S3_MAX_CONCURRENCY=3):
+            storage = _s3_test_storage()
+        self.assertEqual(storage.transfer_config.multipart_threshold, 5 * 1024 * 1024)
+        self.assertEqual(storage.transfer_config.max_concurrency, 3)
+
+
+@unittest.skipUnless(os.environ.get('MINIO_ENDPOINT_URL'), "Set MINIO_ENDPOINT_URL (and MINIO_ACCESS_KEY/MINIO_SECRET_KEY) to run against MinIO.")
+class MinioMediaStorageTests(SimpleTestCase):
+    """
+    Round trip through S3MediaStorage against a local MinIO, e.g.
+    `docker run -p 9000:9000 minio/minio server /data`.
+    """
+    def setUp(self):
+        self.storage = S3MediaStorage(
+            access_key=os.environ.get('MINIO_ACCESS_KEY', 'minioadmin'),
+            secret_key=os.environ.get('MINIO_SECRET_KEY', 'minioadmin'),
+            bucket_name=f"time-capsule-test-{uuid.uuid4().hex[:12]}",
+            endpoint_url=os.environ['MINIO_ENDPOINT_URL'],
+            region_name='us-east-1',
+        )
+        self.storage.bucket.create()
+        self.addCleanup(self.storage.bucket.delete)
+        self.addCleanup(self.storage.delete_prefix, '')
+
+    def test_multipart_upload_round_trip(self):
+        data = os.urandom(6 * 1024 * 1024)
+        with self.settings(MEDIA_S3_MULTIPART_THRESHOLD=5 * 1024 * 1024, MEDIA_S3_MULTIPART_CHUNKSIZE=5 * 1024 * 1024):
+            storage = S3MediaStorage(
+                access_key=self.storage.access_key,
+                secret_key=self.storage.secret_key,
+                bucket_name=self.storage.bucket_name,
+                endpoint_url=self.storage.endpoint_url,
+                region_name='us-east-1',
+            )
+        name = storage.save('capsule_media/video.mp4', ContentFile(data))
+        with storage.open(name) as stored:
+            self.assertEqual(stored.read(), data)
+
+    def test_delete_prefix(self):
+        segment = self.storage.save('capsule_hls/blob_1/720p/segment_000.ts', ContentFile(b'ts'))
+        other = self.storage.save('capsule_hls/blob_2/720p.m3u8', ContentFile(b'm3u8'))
+
+        self.storage.delete_prefix('capsule_hls/blob_1/')
+
+        self.assertFalse(self.storage.exists(segment))
+        self.assertTrue(self.storage.exists(other))
+
+
+class ParseRecipientCsvPhoneTests(SimpleTestCase):
+    def test_email_and_phone_columns_from_the_header(self):
+        csv_file = io.BytesIO(b"name,email,phone\nAda,ada@example.com,+14155550123\nBob,bob@example.com,\n")
+        emails, phones, invalid_values = parse_recipient_csv(csv_file, 10)
+        self.assertEqual(emails, ['ada@example.com', 'bob@example.com'])
+        self.assertEqual(phones, {'ada@example.com': '+14155550123'})
+        self.assertEqual(invalid_values, [])
+
+    def test_invalid_phone_rejects_the_row(self):
+        csv_file = io.BytesIO(b"email,phone\nada@example.com,555-0123\n")
+        emails, phones, invalid_values = parse_recipient_csv(csv_file, 10)
+        self.assertEqual(emails, [])
+        self.assertEqual(invalid_values, ['ada@example.com,555-0123'])
+
+
+class _FailingSmsBackend(sms.BaseSmsBackend):
+    def send_messages(self, messages):
+        return ["Provider unavailable"] * len(messages)
+
+
+def _create_user(email, **extra_fields):
+    return get_user_model().objects.create_user(email=email, name=email.split('@')[0], password='secret', **extra_fields)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, SMS_BACKEND='capsules.sms.LocMemSmsBackend')
+class DispatchCapsuleTests(TestCase):
+    def setUp(self):
+        self.owner = _create_user('owner@example.com')
+        sms.outbox.clear()
+        self.addCleanup(sms.outbox.clear)
+        patcher = mock.patch.object(deliver_capsule_email_task, 'apply_async')
+        self.email_apply_async = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _capsule(self, delivery_method):
+        return Capsule.objects.create(
+            owner=self.owner, title="Letters", delivery_date=timezone.localdate(), delivery_method=delivery_method
+        )
+
+    def test_sms_goes_through_the_backend_and_falls_back_to_email(self):
+        capsule = self._capsule(CapsuleDeliveryMethod.SMS)
+        texted = CapsuleRecipient.objects.create(capsule=capsule, recipient_email='ada@example.com', recipient_phone='+14155550123')
+        emailed = CapsuleRecipient.objects.create(capsule=capsule, recipient_email='bob@example.com')
+
+        self.assertEqual(dispatch_capsule(capsule), 2)
+
+        self.assertEqual([phone for phone, _ in sms.outbox], ['+14155550123'])
+        texted.refresh_from_db()
+        self.assertEqual(texted.received_status, CapsuleRecipientStatus.SENT)
+        self.assertIn(str(texted.access_token), sms.outbox[0][1])
+        self.email_apply_async.assert_called_once_with(args=[capsule.pk, emailed.pk])
+
+    @override_settings(SMS_BACKEND='capsules.sms.DisabledSmsBackend')
+    def test_unconfigured_sms_falls_back_to_email(self):
+        capsule = self._capsule(CapsuleDeliveryMethod.SMS)
+        recipient = CapsuleRecipient.objects.create(capsule=capsule, recipient_email='ada@example.com', recipient_phone='+14155550123')
+
+        dispatch_capsule(capsule)
+
+        self.email_apply_async.assert_called_once_with(args=[capsule.pk, recipient.pk])
+        recipient.refresh_from_db()
+        self.assertEqual(recipient.received_status, CapsuleRecipientStatus.PENDING)
+
+    @override_settings(SMS_BACKEND='capsules.tests._FailingSmsBackend', DELIVERY_MAX_RETRIES=2)
+    def test_failed_sms_is_retried_then_dead_lettered(self):
+        capsule = self._capsule(CapsuleDeliveryMethod.SMS)
+        recipient = CapsuleRecipient.objects.create(capsule=capsule, recipient_email='ada@example.com', recipient_phone='+14155550123')
+
+        with mock.patch.object(deliver_capsule_recipients_task, 'apply_async') as retry:
+            dispatch_capsule(capsule)
+        self.assertEqual(retry.call_args.kwargs['args'], [capsule.pk, [recipient.pk]])
+        self.assertEqual(retry.call_args.kwargs['kwargs'], {'attempt': 1})
+        recipient.refresh_from_db()
+        self.assertEqual(recipient.received_status, CapsuleRecipientStatus.PENDING)
+
+        with mock.patch.object(deliver_capsule_recipients_task, 'apply_async') as retry:
+            dispatch_recipients(capsule, [recipient.pk], attempt=2)
+        retry.assert_not_called()
+        recipient.refresh_from_db()
+        self.assertEqual(recipient.received_status, CapsuleRecipientStatus.FAILED)
+        self.assertEqual(DeadLetterDelivery.objects.get(recipient=recipient).attempts, 3)
+
+    def test_in_app_notifies_registered_recipients_in_bulk(self):
+        capsule = self._capsule(CapsuleDeliveryMethod.IN_APP)
+        users = [_create_user(f"user{index}@example.com") for index in range(3)]
+        registered = [
+            CapsuleRecipient.objects.create(capsule=capsule, recipient_email=user.email, recipient_user=user) for user in users
+        ]
+        unregistered = CapsuleRecipient.objects.create(capsule=capsule, recipient_email='guest@example.com')
+
+        self.assertEqual(dispatch_capsule(capsule, batch_size=2), 4)
+
+        self.assertEqual(
+            Notification.objects.filter(notification_type=NotificationType.NEW_SHARED_CAPSULE, user__in=users).count(), 3
+        )
+        self.assertEqual(
+            CapsuleRecipient.objects.filter(pk__in=[r.pk for r in registered], received_status=CapsuleRecipientStatus.SENT).count(), 3
+        )
+        self.email_apply_async.assert_called_once_with(args=[capsule.pk, unregistered.pk])
+        capsule.refresh_from_db()
+        self.assertTrue(capsule.is_delivered)
+
+    def test_dispatch_skips_recipients_already_sent_to(self):
+        capsule = self._capsule(CapsuleDeliveryMethod.EMAIL)
+        CapsuleRecipient.objects.create(capsule=capsule, recipient_email='ada@example.com', received_status=CapsuleRecipientStatus.SENT)
+        self.assertEqual(dispatch_capsule(capsule), 0)
+        self.email_apply_async.assert_not_called()
+
+
+class TaskResultSettingsTests(SimpleTestCase):
+    def test_results_are_opt_in_and_expire(self):
+        self.assertTrue(celery_app.conf.task_ignore_result)
+        self.assertFalse(celery_app.conf.result_extended)
+        self.assertEqual(celery_app.conf.result_expires, datetime.timedelta(hours=6))
+
+    def test_project_tasks_store_no_results(self):
+        import accounts.tasks  # noqa: F401 (registers the accounts tasks)
+
+        project_tasks = [task for name, task in celery_app.tasks.items() if name.startswith(('capsules.', 'accounts.'))]
+        self.assertTrue(project_tasks)
+        for task in project_tasks:
+            with self.subTest(task=task.name):
+                self.assertTrue(task.ignore_result)
+
+
+class PruneTaskResultsTests(TestCase):
+    @override_settings(TASK_RESULT_RETENTION_DAYS=7, TASK_RESULT_PRUNE_BATCH_SIZE=2)
+    def test_prunes_old_rows_in_batches(self):
+        old_ids = [f"old-{index}" for index in range(5)]
+        for task_id in old_ids + ['recent']:
+            TaskResult.objects.create(task_id=task_id, status='SUCCESS')
+        # date_done is auto_now, so the old rows are backdated with an UPDATE
+        TaskResult.objects.filter(task_id__in=old_ids).update(date_done=timezone.now() - datetime.timedelta(days=8))
+
+        self.assertEqual(prune_task_results_task(), 5)
+        self.assertEqual(list(TaskResult.objects.values_list('task_id', flat=True)), ['recent'])
+
+
+class DeliveryLogPartitionTests(TestCase):
+    def setUp(self):
+        owner = _create_user('owner@example.com')
+        self.capsule = Capsule.objects.create(owner=owner, title="Logs", delivery_date=timezone.localdate())
+        self.current_month = delivery_logs.month_start(timezone.now().astimezone(datetime.timezone.utc).date())
+
+    def _log(self, attempt_time, status=DeliveryLogStatus.SUCCESS, delivery_method=CapsuleDeliveryMethod.EMAIL):
+        log = DeliveryLog.objects.create(
+            capsule=self.capsule, recipient_email='ada@example.com', status=status, delivery_method=delivery_method
+        )
+        # delivery_attempt_time is auto_now_add; moving the row also moves it to its month's partition
+        DeliveryLog.objects.filter(pk=log.pk).update(delivery_attempt_time=attempt_time)
+
+    def test_ensure_partitions_creates_only_missing_months(self):
+        months_ahead = settings.DELIVERY_LOG_PARTITIONS_AHEAD + 2
+        created = delivery_logs.ensure_partitions(months_ahead)
+
+        existing = delivery_logs.existing_partition_months()
+        for offset in range(months_ahead + 1):
+            self.assertIn(delivery_logs.add_months(self.current_month, offset), existing)
+        self.assertIn(delivery_logs.partition_name(delivery_logs.add_months(self.current_month, months_ahead)), created)
+        self.assertEqual(delivery_logs.ensure_partitions(months_ahead), [])
+
+    def test_drop_expired_partitions_rolls_up_before_dropping(self):
+        old_month = delivery_logs.add_months(self.current_month, -14)
+        delivery_logs.create_partition(old_month)
+        old_day = datetime.datetime.combine(old_month, datetime.time(12), tzinfo=datetime.timezone.utc)
+        self._log(old_day)
+        self._log(old_day, status=DeliveryLogStatus.FAILURE)
+        self._log(timezone.now())
+
+        dropped = delivery_logs.drop_expired_partitions(12)
+
+        self.assertEqual(dropped, [delivery_logs.partition_name(old_month)])
+        self.assertNotIn(old_month, delivery_logs.existing_partition_months())
+        self.assertEqual(DeliveryLog.objects.count(), 1)
+        self.assertEqual(
+            sorted(DeliveryLogDailySummary.objects.filter(day=old_month).values_list('status', 'attempt_count')),
+            sorted([(DeliveryLogStatus.SUCCESS, 1), (DeliveryLogStatus.FAILURE, 1)])
+        )
+
+    def test_rollup_counts_per_day_method_and_status_and_overwrites(self):
+        today = timezone.now().astimezone(datetime.timezone.utc).replace(hour=12, minute=0, second=0, microsecond=0)
+        yesterday = today - datetime.timedelta(days=1)
+        delivery_logs.ensure_partitions(1, start_month=delivery_logs.month_start(yesterday.date()))
+        self._log(today)
+        self._log(today)
+        self._log(today, delivery_method=CapsuleDeliveryMethod.SMS)
+        self._log(yesterday, status=DeliveryLogStatus.FAILURE)
+
+        self.assertEqual(delivery_logs.rollup_delivery_logs(yesterday.date(), today.date() + datetime.timedelta(days=1)), 3)
+        summary = {
+            (row.day, row.delivery_method, row.status): row.attempt_count
+            for row in DeliveryLogDailySummary.objects.all()
+        }
+        self.assertEqual(summary, {
+            (today.date(), CapsuleDeliveryMethod.EMAIL, DeliveryLogStatus.SUCCESS): 2,
+            (today.date(), CapsuleDeliveryMethod.SMS, DeliveryLogStatus.SUCCESS): 1,
+            (yesterday.date(), CapsuleDeliveryMethod.EMAIL, DeliveryLogStatus.FAILURE): 1,
+        })
+
+        self._log(today)
+        delivery_logs.rollup_delivery_logs(today.date(), today.date() + datetime.timedelta(days=1))
+        self.assertEqual(
+            DeliveryLogDailySummary.objects.get(
+                day=today.date(), delivery_method=CapsuleDeliveryMethod.EMAIL, status=DeliveryLogStatus.SUCCESS
+            ).attempt_count,
+            3
+        )
+
+
+def _notify(user, message="Hello", days_ago=0, **fields):
+    notification = Notification.objects.create(
+        user=user, message=message, notification_type=NotificationType.SYSTEM_ALERT, **fields
+    )
+    if days_ago:
+        # created_at is auto_now_add
+        Notification.objects.filter(pk=notification.pk).update(created_at=timezone.now() - datetime.timedelta(days=days_ago))
+        notification.refresh_from_db()
+    return notification
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class NotificationReadStateTests(TestCase):
+    def setUp(self):
+        self.user = _create_user('ada@example.com')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _unread_count(self):
+        return self.client.get(reverse('notification-unread-count')).json()['unread_count']
+
+    def test_mark_all_read_moves_the_high_water_mark_only(self):
+        older = [_notify(self.user, days_ago=1) for _ in range(3)]
+        self.assertEqual(self._unread_count(), 3)
+
+        response = self.client.post(reverse('notification-mark-all-read'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._unread_count(), 0)
+        # The rows themselves are untouched
+        self.assertFalse(Notification.objects.filter(pk__in=[n.pk for n in older], is_read=True).exists())
+
+        newer = _notify(self.user, message="After")
+        self.assertEqual(self._unread_count(), 1)
+        unread = self.client.get(reverse('notification-list'), {'is_read': 'false'}).json()
+        self.assertEqual([item['id'] for item in unread], [newer.pk])
+        read = self.client.get(reverse('notification-list'), {'is_read': 'true'}).json()
+        self.assertEqual(sorted(item['id'] for item in read), sorted(n.pk for n in older))
+        self.assertTrue(all(item['is_read'] for item in read))
+
+    def test_marking_one_notification_read(self):
+        notification = _notify(self.user)
+        response = self.client.post(reverse('notification-mark-read', args=[notification.pk]))
+        self.assertTrue(response.json()['is_read'])
+        self.assertEqual(self._unread_count(), 0)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, NOTIFICATION_RETENTION_DAYS=90, NOTIFICATION_RETENTION_BATCH_SIZE=2)
+class PruneReadNotificationsTests(TestCase):
+    def test_deletes_only_old_read_notifications(self):
+        user = _create_user('ada@example.com')
+        old_read = [_notify(user, days_ago=100, is_read=True) for _ in range(3)]
+        old_before_mark = _notify(user, days_ago=120)
+        old_unread = _notify(user, days_ago=95)
+        recent_read = _notify(user, days_ago=10, is_read=True)
+        get_user_model().objects.filter(pk=user.pk).update(
+            notifications_read_until=timezone.now() - datetime.timedelta(days=110)
+        )
+
+        self.assertEqual(prune_read_notifications_task(), 4)
+
+        remaining = set(Notification.objects.values_list('pk', flat=True))
+        self.assertEqual(remaining, {old_unread.pk, recent_read.pk})
+        self.assertFalse({n.pk for n in old_read} & remaining)
+        self.assertNotIn(old_before_mark.pk, remaining)
+
+
+class EstimatedCountPaginatorTests(TestCase):
+    def setUp(self):
+        owner = _create_user('owner@example.com')
+        for index in range(3):
+            Capsule.objects.create(owner=owner, title=f"Capsule {index}", delivery_date=timezone.localdate())
+
+    def test_small_tables_get_an_exact_count(self):
+        self.assertEqual(EstimatedCountPaginator(Capsule.objects.all(), 10).count, 3)
+
+    @mock.patch.object(admin_performance, 'ESTIMATED_COUNT_THRESHOLD', 0)
+    def test_large_unfiltered_table_uses_the_catalog_estimate(self):
+        with mock.patch.object(EstimatedCountPaginator, '_table_estimate', return_value=2_500_000), self.assertNumQueries(0):
+            paginator = EstimatedCountPaginator(Capsule.objects.all(), 100)
+            self.assertEqual(paginator.count, 2_500_000)
+            self.assertEqual(paginator.num_pages, 25_000)
+
+    @mock.patch.object(admin_performance, 'ESTIMATED_COUNT_THRESHOLD', 0)
+    def test_filtered_queryset_uses_the_planner_estimate(self):
+        with CaptureQueriesContext(connection) as queries:
+            count = EstimatedCountPaginator(Capsule.objects.filter(title__startswith="Capsule"), 10).count
+        self.assertIsInstance(count, int)
+        self.assertEqual(len(queries), 1)
+        self.assertTrue(queries[0]['sql'].startswith('EXPLAIN'))
+
+    @mock.patch.object(admin_performance, 'ESTIMATED_COUNT_THRESHOLD', 0)
+    def test_failed_estimate_falls_back_to_count(self):
+        with mock.patch.object(EstimatedCountPaginator, '_table_estimate', side_effect=DatabaseError("no catalog")):
+            self.assertEqual(EstimatedCountPaginator(Capsule.objects.all(), 10).count, 3)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class LargeTableAdminTests(TestCase):
+    def setUp(self):
+        self.admin_user = get_user_model().objects.create_superuser('admin@example.com', 'secret')
+        self.client.force_login(self.admin_user)
+        self.owner = _create_user('owner@example.com')
+
+    def _changelist_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        for url_name, create in (
+            ('admin:capsules_capsule_changelist', lambda index: Capsule.objects.create(
+                owner=self.owner, title=f"Capsule {index}", delivery_date=timezone.localdate()
+            )),
+            ('admin:capsules_notification_changelist', lambda index: _notify(self.owner, message=f"Note {index}")),
+        ):
+            with self.subTest(changelist=url_name):
+                url = reverse(url_name)
+                for index in range(2):
+                    create(index)
+                few_rows = self._changelist_queries(url)
+                for index in range(2, 8):
+                    create(index)
+                self.assertEqual(self._changelist_queries(url), few_rows)
+
+    def test_changelist_skips_the_full_result_count(self):
+        response = self.client.get(reverse('admin:capsules_capsule_changelist'), {'q': 'nothing'})
+        self.assertFalse(response.context['cl'].show_full_result_count)
+
+
+class ParseRecipientCsvTests(SimpleTestCase):
+    def test_first_column_without_header_and_case_insensitive_duplicates(self):
+        csv_file = io.BytesIO(b"Ada@Example.com\nada@example.com\nnot-an-email\n\nbob@example.com\n")
+        emails, phones, invalid_values = parse_recipient_csv(csv_file, 10)
+        self.assertEqual(emails, ['Ada@Example.com', 'bob@example.com'])
+        self.assertEqual(phones, {})
+        self.assertEqual(invalid_values, ['not-an-email'])
+
+    def test_email_column_from_the_header(self):
+        csv_file = io.BytesIO(b"\xef\xbb\xbfname,Email\nAda,ada@example.com\nBob,bob@example.com\n")
+        emails, _, _ = parse_recipient_csv(csv_file, 10)
+        self.assertEqual(emails, ['ada@example.com', 'bob@example.com'])
+
+    def test_duplicates_do_not_count_towards_the_cap(self):
+        csv_file = io.BytesIO(b"a@example.com\nA@example.com\nb@example.com\n")
+        emails, _, _ = parse_recipient_csv(csv_file, 2)
+        self.assertEqual(emails, ['a@example.com', 'b@example.com'])
+
+    def test_too_many_distinct_addresses(self):
+        csv_file = io.BytesIO(b"a@example.com\nb@example.com\nA@example.com\nc@example.com\n")
+        with self.assertRaises(ValueError):
+            parse_recipient_csv(csv_file, 2)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CapsuleRecipientIngestionTests(TestCase):
+    def setUp(self):
+        self.owner = _create_user('owner@example.com')
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def _create(self, **data):
+        payload = {
+            'title': "Class of 2026",
+            'delivery_date': (timezone.localdate() + datetime.timedelta(days=30)).isoformat(),
+            'delivery_time': '09:00',
+            **data,
+        }
+        return self.client.post(reverse('create_capsule'), payload, format='multipart')
+
+    def test_list_and_csv_recipients_share_one_scheduled_delivery(self):
+        registered = _create_user('ada@example.com')
+        csv_file = SimpleUploadedFile('recipients.csv', b"email\nada@example.com\ncy@example.com\n", content_type='text/csv')
+
+        response = self._create(recipient_emails=['Ada@Example.com', 'bob@example.com'], recipients_csv=csv_file)
+
+        self.assertEqual(response.status_code, 201, response.content)
+        capsule = Capsule.objects.get(pk=response.json()['id'])
+        recipients = dict(capsule.recipients.values_list('recipient_email', 'recipient_user_id'))
+        self.assertEqual(recipients, {'Ada@Example.com': registered.pk, 'bob@example.com': None, 'cy@example.com': None})
+        self.assertEqual(
+            list(OutboxMessage.objects.values_list('task_name', 'args')), [(deliver_capsule_task.name, [capsule.pk])]
+        )
+
+    @override_settings(MAX_RECIPIENTS_PER_CAPSULE=2)
+    def test_recipient_cap(self):
+        response = self._create(recipient_emails=['a@example.com', 'b@example.com', 'c@example.com'])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Capsule.objects.exists())
+
+    def test_a_recipient_is_required(self):
+        self.assertEqual(self._create().status_code, 400)
+
+    def test_invalid_csv_rows_are_reported(self):
+        csv_file = SimpleUploadedFile('recipients.csv', b"ada@example.com\nnope\n", content_type='text/csv')
+        response = self._create(recipients_csv=csv_file)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('nope', response.content.decode())
+
+    def test_registered_users_are_matched_ignoring_case(self):
+        user = _create_user('Ada@Example.com')
+        self.assertEqual(registered_user_ids_by_email(['ADA@example.COM', 'bob@example.com']), {'ada@example.com': user.pk})
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CapsuleExportTests(TestCase):
+    def test_streams_only_the_users_records_as_ndjson(self):
+        user = _create_user('ada@example.com')
+        capsule = Capsule.objects.create(owner=user, title="Mine", delivery_date=timezone.localdate())
+        CapsuleContent.objects.create(capsule=capsule, content_type=CapsuleContentType.TEXT, text_content="Dear future me")
+        recipient = CapsuleRecipient.objects.create(capsule=capsule, recipient_email='bob@example.com')
+        DeliveryLog.objects.create(
+            capsule=capsule, recipient_email=recipient.recipient_email, delivery_method=CapsuleDeliveryMethod.EMAIL,
+            status=DeliveryLogStatus.SUCCESS
+        )
+        other = _create_user('eve@example.com')
+        Capsule.objects.create(owner=other, title="Not mine", delivery_date=timezone.localdate())
+        client = APIClient()
+        client.force_authenticate(user)
+
+        response = client.get(reverse('capsule_export'))
+
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertIn('attachment;', response['Content-Disposition'])
+        records = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([record['type'] for record in records], ['capsule', 'content', 'recipient', 'delivery_log'])
+        self.assertEqual(records[0]['title'], "Mine")
+        self.assertEqual(records[1]['text_content'], "Dear future me")
+        self.assertEqual(records[2]['recipient_email'], 'bob@example.com')
+        self.assertEqual(records[3]['status'], DeliveryLogStatus.SUCCESS)
+
+    def test_export_is_a_lazy_generator(self):
+        user = _create_user('ada@example.com')
+        for index in range(3):
+            Capsule.objects.create(owner=user, title=f"Capsule {index}", delivery_date=timezone.localdate())
+        lines = iter_user_export(user, chunk_size=2)
+        self.assertEqual(json.loads(next(lines))['title'], "Capsule 0")
+        self.assertEqual(len(list(lines)), 2)
+
+
+class _ContentStream:
+    def __init__(self, data):
+        self.data = data
+        self.closed = False
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.data), chunk_size):
+            yield self.data[start:start + chunk_size]
+
+    def close(self):
+        self.closed = True
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CapsuleZipArchiveTests(TestCase):
+    def setUp(self):
+        self.capsule = Capsule.objects.create(
+            owner=_create_user('ada@example.com'), title="Archive", delivery_date=timezone.localdate()
+        )
+
+    def _archive(self, streams):
+        with mock.patch('capsules.archives.open_content_stream', side_effect=streams):
+            chunks = list(iter_capsule_zip(self.capsule, chunk_size=4))
+        return zipfile.ZipFile(io.BytesIO(b''.join(chunks)))
+
+    def test_streams_text_and_files_in_capsule_order(self):
+        CapsuleContent.objects.create(
+            capsule=self.capsule, content_type=CapsuleContentType.IMAGE, file='capsule_media/2026/10/photo.jpg', order=2
+        )
+        note = CapsuleContent.objects.create(
+            capsule=self.capsule, content_type=CapsuleContentType.TEXT, text_content="Dear future me", order=1
+        )
+        CapsuleContent.objects.create(
+            capsule=self.capsule, content_type=CapsuleContentType.DOCUMENT, file='capsule_media/2026/10/notes.pdf', order=3
+        )
+        streams = [_ContentStream(b'jpeg-bytes'), _ContentStream(b'pdf-bytes' * 10)]
+
+        archive = self._archive(streams)
+
+        self.assertEqual(
+            archive.namelist(), [f"001_message_{note.id}.txt", '002_photo.jpg', '003_notes.pdf']
+        )
+        self.assertEqual(archive.read(f"001_message_{note.id}.txt"), b"Dear future me")
+        self.assertEqual(archive.read('002_photo.jpg'), b'jpeg-bytes')
+        self.assertEqual(archive.read('003_notes.pdf'), b'pdf-bytes' * 10)
+        self.assertEqual(archive.getinfo('002_photo.jpg').compress_type, zipfile.ZIP_STORED)
+        self.assertEqual(archive.getinfo('003_notes.pdf').compress_type, zipfile.ZIP_DEFLATED)
+        self.assertTrue(all(stream.closed for stream in streams))
+
+    def test_skips_files_the_media_host_cannot_serve(self):
+        CapsuleContent.objects.create(
+            capsule=self.capsule, content_type=CapsuleContentType.IMAGE, file='capsule_media/2026/10/missing.jpg'
+        )
+        CapsuleContent.objects.create(
+            capsule=self.capsule, content_type=CapsuleContentType.IMAGE, file='capsule_media/2026/10/kept.jpg'
+        )
+
+        archive = self._archive([OSError("gone"), _ContentStream(b'kept')])
+
+        self.assertEqual(archive.namelist(), ['002_kept.jpg'])
+        self.assertIsNone(archive.testzip())
+
+
+def _use_local_media(test_case):
+    """Points default storage at a throw-away MEDIA_ROOT for the duration of the test."""
+    media_root = tempfile.mkdtemp()
+    test_case.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+    storages = {
+        **settings.STORAGES,
+        'default': {'BACKEND': 'capsules.storage.LocalMediaStorage', 'OPTIONS': {'location': media_root}},
+    }
+    override = override_settings(STORAGES=storages, MEDIA_ROOT=media_root)
+    override.enable()
+    test_case.addCleanup(override.disable)
+    return media_root
+
+
+def _image_bytes(width, height, image_format='PNG'):
+    output = io.BytesIO()
+    Image.new('RGB', (width, height), color=(200, 40, 40)).save(output, image_format)
+    return output.getvalue()
+
+
+@override_settings(CACHES=LOCMEM_CACHES, IMAGE_VARIANT_WIDTHS=(320, 640, 1280), IMAGE_VARIANT_FORMATS=('webp', 'jpeg'))
+class ImageVariantTests(TestCase):
+    def setUp(self):
+        _use_local_media(self)
+        self.capsule = Capsule.objects.create(
+            owner=_create_user('ada@example.com'), title="Photos", delivery_date=timezone.localdate()
+        )
+
+    def _image_content(self, width, height):
+        return CapsuleContent.objects.create(
+            capsule=self.capsule, content_type=CapsuleContentType.IMAGE,
+            file=SimpleUploadedFile('photo.png', _image_bytes(width, height), content_type='image/png'),
+        )
+
+    def test_generates_every_smaller_width_in_each_format(self):
+        content = self._image_content(1000, 500)
+
+        self.assertEqual(generate_image_variants(content), 4)
+
+        variants = content.variants.order_by('format', 'width')
+        self.assertEqual(
+            [(variant.format, variant.width, variant.height) for variant in variants],
+            [('jpeg', 320, 160), ('jpeg', 640, 320), ('webp', 320, 160), ('webp', 640, 320)],
+        )
+        with variants[0].file.open('rb') as stored, Image.open(stored) as image:
+            self.assertEqual((image.format, image.size), ('JPEG', (320, 160)))
+        self.assertTrue(variants[0].file.name.endswith('_320w.jpg'))
+
+    def test_rerun_skips_existing_widths(self):
+        content = self._image_content(1000, 500)
+        generate_image_variants(content)
+
+        self.assertEqual(generate_image_variants(content), 0)
+        self.assertEqual(content.variants.count(), 4)
+
+    def test_narrow_images_are_never_upscaled(self):
+        content = self._image_content(200, 100)
+
+        generate_image_variants(content)
+
+        self.assertEqual(set(content.variants.values_list('width', flat=True)), {200})
+
+    def test_srcset_lists_variants_of_one_format_by_width(self):
+        content = self._image_content(1000, 500)
+        generate_image_variants(content)
+        content = CapsuleContent.objects.prefetch_related('variants').get(pk=content.pk)
+
+        with self.assertNumQueries(0):
+            srcset = build_image_srcset(content, 'webp', lambda item, variant: f"/m/{variant.width}.{variant.format}")
+
+        self.assertEqual(srcset, "/m/320.webp 320w, /m/640.webp 640w")
+        self.assertIsNone(build_image_srcset(self._image_content(10, 10), 'webp', str))
+
+
+class _FakeFfmpeg:
+    """Stands in for subprocess.run: ffprobe reports a fixed size, ffmpeg writes its output files."""
+    def __init__(self, width=640, height=360, fail_when=None):
+        self.width = width
+        self.height = height
+        self.fail_when = fail_when
+        self.commands = []
+
+    def __call__(self, command, **kwargs):
+        self.commands.append(command)
+        if command[0] == settings.FFPROBE_BINARY:
+            stdout = json.dumps({'streams': [{'width': self.width, 'height': self.height}]}).encode()
+            return subprocess.CompletedProcess(command, 0, stdout=stdout)
+        if self.fail_when and self.fail_when(command):
+            raise subprocess.CalledProcessError(1, command, stderr=b"Invalid data found when processing input")
+        if '-hls_segment_filename' in command:
+            segment_path = command[command.index('-hls_segment_filename') + 1] % 0
+            with open(segment_path, 'wb') as segment:
+                segment.write(b'ts-bytes')
+            with open(command[-1], 'w') as playlist:
+                playlist.write("#EXTM3U\n#EXTINF:6.0,\nsegment_0000.ts\n#EXT-X-ENDLIST\n")
+        else:
+            with open(command[-1], 'wb') as output:
+                output.write(b'media-bytes')
+        return subprocess.CompletedProcess(command, 0)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, VIDEO_HLS_ENABLED=False)
+class VideoTranscodingTests(TestCase):
+    def setUp(self):
+        _use_local_media(self)
+        capsule = Capsule.objects.create(
+            owner=_create_user('ada@example.com'), title="Clips", delivery_date=timezone.localdate()
+        )
+        self.content = CapsuleContent.objects.create(
+            capsule=capsule, content_type=CapsuleContentType.VIDEO,
+            file=SimpleUploadedFile('clip.mov', b'mov-bytes', content_type='video/quicktime'),
+        )
+
+    def _transcode(self, ffmpeg):
+        with mock.patch('capsules.media.subprocess.run', side_effect=ffmpeg):
+            transcode_video_task.apply(args=[self.content.id])
+        self.content.refresh_from_db()
+
+    def test_stores_a_faststart_mp4_and_a_poster(self):
+        ffmpeg = _FakeFfmpeg()
+
+        self._transcode(ffmpeg)
+
+        self.assertEqual(self.content.processing_status, MediaProcessingStatus.READY)
+        variants = {variant.kind: variant for variant in self.content.variants.all()}
+        self.assertEqual(set(variants), {CapsuleContentVariantKind.VIDEO, CapsuleContentVariantKind.POSTER})
+        video = variants[CapsuleContentVariantKind.VIDEO]
+        self.assertEqual((video.format, video.width, video.height), ('mp4', 640, 360))
+        self.assertEqual(video.file.read(), b'media-bytes')
+        self.assertIn('+faststart', ffmpeg.commands[0])
+
+    def test_short_clips_fall_back_to_the_first_frame_for_the_poster(self):
+        ffmpeg = _FakeFfmpeg(fail_when=lambda command: '-ss' in command)
+
+        self._transcode(ffmpeg)
+
+        self.assertEqual(self.content.processing_status, MediaProcessingStatus.READY)
+        self.assertTrue(self.content.variants.filter(kind=CapsuleContentVariantKind.POSTER).exists())
+
+    @override_settings(VIDEO_HLS_ENABLED=True, VIDEO_HLS_RENDITIONS=((360, '800k'), (720, '2800k')))
+    def test_hls_renditions_never_exceed_the_source_height(self):
+        self._transcode(_FakeFfmpeg(width=640, height=360))
+
+        master = self.content.variants.get(kind=CapsuleContentVariantKind.HLS)
+        lines = master.file.read().decode().splitlines()
+        self.assertEqual(lines[2], '#EXT-X-STREAM-INF:BANDWIDTH=928000,RESOLUTION=640x360')
+        self.assertEqual(lines[3:], [f"capsule_hls/content_{self.content.id}/360p.m3u8"])
+        rendition = default_storage.open(lines[3]).read().decode()
+        self.assertIn(f"capsule_hls/content_{self.content.id}/360p/segment_0000.ts", rendition)
+
+    def test_rejected_sources_are_marked_failed_without_retrying(self):
+        self._transcode(_FakeFfmpeg(fail_when=lambda command: '+faststart' in command))
+
+        self.assertEqual(self.content.processing_status, MediaProcessingStatus.FAILED)
+        self.assertIn("Invalid data found", self.content.processing_error)
+        self.assertFalse(self.content.variants.exists())
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CapsuleSearchTests(TestCase):
+    def setUp(self):
+        self.user = _create_user('ada@example.com')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _capsule(self, title, description='', owner=None, text=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            capsule = Capsule.objects.create(
+                owner=owner or self.user, title=title, description=description, delivery_date=timezone.localdate()
+            )
+            if text is not None:
+                CapsuleContent.objects.create(capsule=capsule, content_type=CapsuleContentType.TEXT, text_content=text)
+        return capsule
+
+    def _search(self, query):
+        response = self.client.get(reverse('capsule_search'), {'q': query})
+        self.assertEqual(response.status_code, 200)
+        return [result['id'] for result in response.data['results']]
+
+    def test_title_matches_outrank_description_and_content_matches(self):
+        in_content = self._capsule("Letters", text="Our holiday in Lisbon was wonderful")
+        in_title = self._capsule("Lisbon holiday")
+        in_description = self._capsule("Summer", description="Photos from Lisbon")
+
+        self.assertEqual(self._search("lisbon"), [in_title.id, in_description.id, in_content.id])
+
+    def test_only_the_users_own_capsules_are_searched(self):
+        mine = self._capsule("Wedding day")
+        self._capsule("Wedding day", owner=_create_user('eve@example.com'))
+
+        self.assertEqual(self._search("wedding"), [mine.id])
+
+    def test_web_search_syntax_and_empty_queries(self):
+        self._capsule("Paris trip", description="rainy")
+        sunny = self._capsule("Paris trip", description="sunny")
+
+        self.assertEqual(self._search('paris -rainy'), [sunny.id])
+        self.assertEqual(self._search('   '), [])
+
+    def test_editing_text_content_refreshes_the_vector(self):
+        capsule = self._capsule("Letters", text="Nothing to see")
+        content = capsule.contents.get()
+        self.assertEqual(self._search("graduation"), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            content.text_content = "Graduation speech"
+            content.save(update_fields=['text_content'])
+
+        self.assertEqual(self._search("graduation"), [capsule.id])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class UserCacheVersionTests(SimpleTestCase):
+    def setUp(self):
+        caching.cache.clear()
+
+    def test_cached_value_is_reused_until_the_version_is_bumped(self):
+        compute = mock.Mock(side_effect=[1, 2])
+
+        self.assertEqual(caching.get_or_set_for_user(7, 'summary', compute, 60), 1)
+        self.assertEqual(caching.get_or_set_for_user(7, 'summary', compute, 60), 1)
+        caching.bump_user_cache_version(7)
+        self.assertEqual(caching.get_or_set_for_user(7, 'summary', compute, 60), 2)
+        self.assertEqual(compute.call_count, 2)
+
+    def test_bump_only_affects_that_user(self):
+        caching.get_or_set_for_user(7, 'summary', lambda: 'seven', 60)
+        caching.get_or_set_for_user(8, 'summary', lambda: 'eight', 60)
+
+        caching.bump_user_cache_version(7)
+
+        self.assertEqual(caching.get_or_set_for_user(8, 'summary', lambda: 'recomputed', 60), 'eight')
+        self.assertEqual(caching.get_or_set_for_user(7, 'summary', lambda: 'recomputed', 60), 'recomputed')
+
+    def test_bump_after_the_version_key_was_evicted_starts_a_new_version(self):
+        old_key = caching.user_cache_key(7, 'summary')
+        caching.cache.delete(caching.VERSION_KEY.format(user_id=7))
+
+        caching.bump_user_cache_version(7)
+
+        self.assertNotEqual(caching.user_cache_key(7, 'summary'), old_key)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, DASHBOARD_UPCOMING_LIMIT=2)
+class DashboardSummaryTests(TestCase):
+    def setUp(self):
+        caching.cache.clear()
+        self.user = _create_user('ada@example.com')
+        self.today = timezone.localdate()
+
+    def _capsule(self, days_ahead, **fields):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Capsule.objects.create(
+                owner=self.user, title=f"In {days_ahead} days",
+                delivery_date=self.today + datetime.timedelta(days=days_ahead), **fields
+            )
+
+    def test_counts_upcoming_and_unread_in_one_payload(self):
+        self._capsule(1)
+        self._capsule(3)
+        self._capsule(30)
+        self._capsule(-5, is_delivered=True, is_archived=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            _notify(self.user)
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        response = client.get(reverse('dashboard-summary'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.data['counts'],
+            {'total': 4, 'delivered': 1, 'pending': 3, 'archived': 1, 'upcoming_this_week': 2},
+        )
+        self.assertEqual([capsule['title'] for capsule in response.data['upcoming']], ["In 1 days", "In 3 days"])
+        self.assertEqual(response.data['unread_notifications'], 1)
+
+    def test_summary_is_cached_until_a_capsule_or_notification_changes(self):
+        self._capsule(1)
+        self.assertEqual(get_dashboard_summary(self.user)['counts']['total'], 1)
+
+        with self.assertNumQueries(0):
+            get_dashboard_summary(self.user)
+
+        self._capsule(2)
+        self.assertEqual(get_dashboard_summary(self.user)['counts']['total'], 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            _notify(self.user)
+        self.assertEqual(get_dashboard_summary(self.user)['unread_notifications'], 1)
+
+    def test_cache_is_not_bumped_before_commit(self):
+        get_dashboard_summary(self.user)
+
+        with self.captureOnCommitCallbacks(execute=False):
+            Capsule.objects.create(owner=self.user, title="Draft", delivery_date=self.today)
+
+        # Still inside the transaction: the new row must not be cached under a fresh version
+        self.assertEqual(get_dashboard_summary(self.user)['counts']['total'], 0)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class DeliveryCalendarTests(TestCase):
+    def setUp(self):
+        caching.cache.clear()
+        self.user = _create_user('ada@example.com')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _capsule(self, delivery_date, owner=None, **fields):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Capsule.objects.create(
+                owner=owner or self.user, title="Scheduled", delivery_date=delivery_date, **fields
+            )
+
+    def _calendar(self, **params):
+        return self.client.get(reverse('delivery-calendar'), params)
+
+    def test_counts_per_month(self):
+        self._capsule(datetime.date(2026, 1, 5))
+        self._capsule(datetime.date(2026, 1, 20), is_delivered=True)
+        self._capsule(datetime.date(2026, 3, 1))
+        self._capsule(datetime.date(2026, 5, 1))
+        self._capsule(datetime.date(2026, 1, 9), owner=_create_user('eve@example.com'))
+
+        response = self._calendar(start='2026-01-01', end='2026-04-30')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['granularity'], 'month')
+        self.assertEqual(response.data['periods'], [
+            {'period': datetime.date(2026, 1, 1), 'scheduled': 1, 'delivered': 1},
+            {'period': datetime.date(2026, 3, 1), 'scheduled': 1, 'delivered': 0},
+        ])
+
+    def test_counts_per_day(self):
+        self._capsule(datetime.date(2026, 2, 3))
+        self._capsule(datetime.date(2026, 2, 3))
+
+        response = self._calendar(start='2026-02-01', end='2026-02-28', granularity='day')
+
+        self.assertEqual(response.data['periods'], [{'period': datetime.date(2026, 2, 3), 'scheduled': 2, 'delivered': 0}])
+
+    def test_rejects_invalid_ranges(self):
+        self.assertEqual(self._calendar(start='2026-02-01', end='2026-02-28', granularity='week').status_code, 400)
+        self.assertEqual(self._calendar(start='February', end='2026-02-28').status_code, 400)
+        self.assertEqual(self._calendar(start='2026-03-01', end='2026-02-28').status_code, 400)
+        self.assertEqual(self._calendar(start='2020-01-01', end='2026-02-28', granularity='day').status_code, 400)
+
+    def test_cached_per_range_until_a_capsule_changes(self):
+        start, end = datetime.date(2026, 1, 1), datetime.date(2026, 12, 31)
+        capsule = self._capsule(datetime.date(2026, 6, 1))
+        get_delivery_calendar(self.user, start, end, 'month')
+
+        with self.assertNumQueries(0):
+            get_delivery_calendar(self.user, start, end, 'month')
+        self.assertEqual(get_delivery_calendar(self.user, start, end, 'day')[0]['period'], datetime.date(2026, 6, 1))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            capsule.is_delivered = True
+            capsule.save()
+
+        self.assertEqual(
+            get_delivery_calendar(self.user, start, end, 'month'),
+            [{'period': datetime.date(2026, 6, 1), 'scheduled': 0, 'delivered': 1}],
+        )
+
+
+class TaskRoutingTests(SimpleTestCase):
+    def setUp(self):
+        celery_app.loader.import_default_modules()
+
+    def _route(self, name):
+        route = celery_app.amqp.router.route({}, name)
+        return route['queue'].name, route.get('priority')
+
+    def test_every_project_task_has_an_explicit_queue(self):
+        project_tasks = {name for name in celery_app.tasks if name.startswith(('capsules.', 'accounts.'))}
+
+        self.assertEqual(project_tasks - set(settings.CELERY_TASK_ROUTES), set())
+
+    def test_deliveries_are_kept_apart_from_media_and_housekeeping(self):
+        self.assertEqual(self._route(deliver_capsule_task.name), ('deliveries', 0))
+        self.assertEqual(self._route(deliver_capsule_email_task.name), ('deliveries', 1))
+        self.assertEqual(self._route(transcode_video_task.name), ('media', 6))
+        self.assertEqual(self._route(prune_task_results_task.name), ('housekeeping', 8))
+        self.assertNotEqual(settings.DELIVERY_RETRY_QUEUE, 'deliveries')
+
+    def test_unrouted_tasks_fall_back_to_the_default_queue(self):
+        self.assertEqual(self._route('thirdparty.some_task'), ('default', None))
+
+    def test_workers_prefetch_one_task_at_a_time(self):
+        self.assertEqual(celery_app.conf.worker_prefetch_multiplier, 1)
+        self.assertEqual(celery_app.conf.broker_transport_options['queue_order_strategy'], 'priority')
+
+
+class ParseRangeHeaderTests(SimpleTestCase):
+    def test_closed_open_and_suffix_ranges(self):
+        self.assertEqual(parse_range_header('bytes=0-99', 1000), (0, 99))
+        self.assertEqual(parse_range_header('bytes=500-', 1000), (500, 999))
+        self.assertEqual(parse_range_header('bytes=-100', 1000), (900, 999))
+
+    def test_end_is_clamped_to_the_file(self):
+        self.assertEqual(parse_range_header('bytes=900-5000', 1000), (900, 999))
+        self.assertEqual(parse_range_header('bytes=-5000', 1000), (0, 999))
+
+    def test_absent_malformed_or_multiple_ranges_serve_the_whole_file(self):
+        self.assertIsNone(parse_range_header(None, 1000))
+        self.assertIsNone(parse_range_header('items=0-10', 1000))
+        self.assertIsNone(parse_range_header('bytes=0-10,20-30', 1000))
+        self.assertIsNone(parse_range_header('bytes=-', 1000))
+
+    def test_unsatisfiable_ranges_raise(self):
+        for header in ('bytes=1000-', 'bytes=50-10', 'bytes=-0'):
+            with self.subTest(header=header), self.assertRaises(ValueError):
+                parse_range_header(header, 1000)
+
+    def test_no_range_of_an_empty_file_is_satisfiable(self):
+        for header in ('bytes=0-', 'bytes=0-0', 'bytes=-1'):
+            with self.subTest(header=header), self.assertRaises(ValueError):
+                parse_range_header(header, 0)
+        self.assertIsNone(parse_range_header(None, 0))
+
+
+@override_settings(MEDIA_SENDFILE_BACKEND='')
+class MediaFileRangeTests(SimpleTestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        self.storage = LocalMediaStorage(location=media_root)
+        self.name = self.storage.save('clip.mp4', ContentFile(bytes(range(100))))
+        self.factory = RequestFactory()
+
+    def _get(self, **headers):
+        response = serve_media_file(self.factory.get('/media/1/', headers=headers), _StoredFile(self.storage, self.name))
+        self.addCleanup(response.close)
+        return response
+
+    def test_range_requests_get_a_partial_response(self):
+        response = self._get(range='bytes=10-19')
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/100')
+        self.assertEqual(b''.join(response.streaming_content), bytes(range(10, 20)))
+        self.assertEqual(response['Cache-Control'], 'private, max-age=300')
+
+    def test_unsatisfiable_ranges_get_416(self):
+        response = self._get(range='bytes=100-')
+
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */100')
+
+    def test_range_of_an_empty_file_gets_416(self):
+        self.name = self.storage.save('empty.mp4', ContentFile(b''))
+
+        self.assertEqual(self._get(range='bytes=-1').status_code, 416)
+        self.assertEqual(self._get().status_code, 200)
+
+    def test_if_range_matching_the_etag_or_date_keeps_the_range(self):
+        full = self._get()
+
+        for validator in (full['ETag'], full['Last-Modified']):
+            with self.subTest(validator=validator):
+                self.assertEqual(self._get(range='bytes=0-9', if_range=validator).status_code, 206)
+
+    def test_stale_if_range_gets_the_whole_file(self):
+        full = self._get()
+        os.utime(self.storage.path(self.name), (0, 0))
+
+        for validator in (full['ETag'], full['Last-Modified'], f"W/{full['ETag']}"):
+            with self.subTest(validator=validator):
+                response = self._get(range='bytes=0-9', if_range=validator)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(b''.join(response.streaming_content), bytes(range(100)))
+
+
+class DeliveryFailureClassificationTests(SimpleTestCase):
+    def test_permanent_errors(self):
+        self.assertTrue(is_permanent_email_error(smtplib.SMTPRecipientsRefused({'a@example.com': (550, b'No such user')})))
+        self.assertTrue(is_permanent_email_error(smtplib.SMTPDataError(554, b'Rejected')))
+        self.assertTrue(is_permanent_email_error(ValueError("Invalid address")))
+
+    def test_transient_errors(self):
+        self.assertFalse(is_permanent_email_error(smtplib.SMTPRecipientsRefused({
+            'a@example.com': (550, b'No such user'), 'b@example.com': (451, b'Try later'),
+        })))
+        self.assertFalse(is_permanent_email_error(smtplib.SMTPDataError(421, b'Busy')))
+        self.assertFalse(is_permanent_email_error(smtplib.SMTPAuthenticationError(535, b'Bad credentials')))
+        self.assertFalse(is_permanent_email_error(smtplib.SMTPServerDisconnected()))
+        self.assertFalse(is_permanent_email_error(ConnectionRefusedError()))
+
+    @override_settings(DELIVERY_RETRY_BASE_SECONDS=10, DELIVERY_RETRY_MAX_SECONDS=100)
+    def test_backoff_delay_grows_to_the_cap(self):
+        for retries, ceiling in ((0, 10), (2, 40), (10, 100)):
+            for _ in range(20):
+                self.assertTrue(0 <= backoff_delay(retries) <= ceiling)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ReplayDeadLettersTests(TestCase):
+    def test_replay_requeues_each_recipient_through_its_channel_once(self):
+        owner = _create_user('owner@example.com')
+        email_capsule = Capsule.objects.create(owner=owner, title="Email", delivery_date=timezone.localdate())
+        sms_capsule = Capsule.objects.create(
+            owner=owner, title="SMS", delivery_date=timezone.localdate(), delivery_method=CapsuleDeliveryMethod.SMS
+        )
+        email_recipient = CapsuleRecipient.objects.create(
+            capsule=email_capsule, recipient_email='ada@example.com', received_status=CapsuleRecipientStatus.FAILED
+        )
+        sms_recipients = [
+            CapsuleRecipient.objects.create(
+                capsule=sms_capsule, recipient_email=email, recipient_phone=phone, received_status=CapsuleRecipientStatus.FAILED
+            )
+            for email, phone in (('bob@example.com', '+14155550123'), ('cy@example.com', '+14155550124'))
+        ]
+        delivered = CapsuleRecipient.objects.create(
+            capsule=sms_capsule, recipient_email='dee@example.com', received_status=CapsuleRecipientStatus.SENT
+        )
+        for recipient in [email_recipient] + sms_recipients:
+            DeadLetterDelivery.objects.create(
+                capsule=recipient.capsule, recipient=recipient, delivery_method=recipient.capsule.delivery_method,
+                error_message="Provider unavailable"
+            )
+
+        self.assertEqual(replay_dead_letters(DeadLetterDelivery.objects.all(), batch_size=2), 3)
+
+        messages = sorted(OutboxMessage.objects.values_list('task_name', 'args'))
+        self.assertEqual(messages, sorted([
+            (deliver_capsule_email_task.name, [email_capsule.pk, email_recipient.pk]),
+            (deliver_capsule_recipients_task.name, [sms_capsule.pk, [sms_recipients[0].pk]]),
+            (deliver_capsule_recipients_task.name, [sms_capsule.pk, [sms_recipients[1].pk]]),
+        ]))
+        self.assertFalse(CapsuleRecipient.objects.filter(
+            pk__in=[email_recipient.pk] + [r.pk for r in sms_recipients]
+        ).exclude(received_status=CapsuleRecipientStatus.PENDING).exists())
+        delivered.refresh_from_db()
+        self.assertEqual(delivered.received_status, CapsuleRecipientStatus.SENT)
+
+        self.assertEqual(replay_dead_letters(DeadLetterDelivery.objects.all()), 0)
+        self.assertEqual(OutboxMessage.objects.count(), 3)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, REMINDER_WINDOWS_DAYS=(30, 7, 1))
+class ReminderIdempotencyTests(TestCase):
+    def test_each_stage_is_emitted_once(self):
+        owner = _create_user('owner@example.com')
+        today = datetime.date(2026, 10, 19)
+        Capsule.objects.create(owner=owner, title="Soon", delivery_date=today + datetime.timedelta(days=5))
+
+        self.assertEqual(emit_due_reminders(today=today), 1)
+        self.assertEqual(emit_due_reminders(today=today), 0)
+        self.assertEqual(emit_due_reminders(today=today + datetime.timedelta(days=4)), 1)
+        self.assertEqual(Notification.objects.filter(user=owner, notification_type=NotificationType.REMINDER).count(), 2)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TransferIdempotencyTests(TestCase):
+    def setUp(self):
+        self.long_ago = timezone.now() - datetime.timedelta(days=800)
+        self.owner = _create_user('owner@example.com')
+        get_user_model().objects.filter(pk=self.owner.pk).update(created_at=self.long_ago, last_activity_at=self.long_ago)
+        self.capsule = Capsule.objects.create(
+            owner=self.owner, title="Legacy", delivery_date=timezone.localdate() + datetime.timedelta(days=3650),
+            transfer_on_inactivity=True, transfer_recipient_email='Heir@Example.com'
+        )
+
+    def test_transfer_runs_once(self):
+        heir = _create_user('heir@example.com')
+
+        self.assertEqual(run_inactivity_transfers(365, 100), 1)
+        self.assertEqual(run_inactivity_transfers(365, 100), 0)
+
+        recipient = CapsuleRecipient.objects.get(capsule=self.capsule)
+        self.assertEqual(recipient.recipient_user, heir)
+        self.assertEqual(
+            list(OutboxMessage.objects.values_list('task_name', 'args')),
+            [(deliver_capsule_email_task.name, [self.capsule.pk, recipient.pk])]
+        )
+        self.assertEqual(Notification.objects.filter(notification_type=NotificationType.TRANSFER_NOTIFICATION).count(), 2)
+
+    def test_recently_active_owner_is_skipped(self):
+        get_user_model().objects.filter(pk=self.owner.pk).update(last_activity_at=timezone.now())
+        self.assertEqual(run_inactivity_transfers(365, 100), 0)
+
+    def test_owner_without_recorded_activity_waits_for_a_full_period(self):
+        get_user_model().objects.filter(pk=self.owner.pk).update(last_activity_at=None)
+        with self.settings(ACTIVITY_TRACKING_STARTED_AT=timezone.now() - datetime.timedelta(days=30)):
+            self.assertEqual(run_inactivity_transfers(365, 100), 0)
+        with self.settings(ACTIVITY_TRACKING_STARTED_AT=None):
+            self.assertEqual(run_inactivity_transfers(365, 100), 0)
+        with self.settings(ACTIVITY_TRACKING_STARTED_AT=self.long_ago):
+            self.assertEqual(run_inactivity_transfers(365, 100), 1)
+
+    def test_existing_recipient_in_another_case_is_not_added_again(self):
+        existing = CapsuleRecipient.objects.create(
+            capsule=self.capsule, recipient_email='heir@example.com', received_status=CapsuleRecipientStatus.SENT
+        )
+
+        self.assertEqual(run_inactivity_transfers(365, 100), 1)
+
+        self.assertEqual(list(CapsuleRecipient.objects.filter(capsule=self.capsule)), [existing])
+        self.assertFalse(OutboxMessage.objects.exists())
+        self.capsule.refresh_from_db()
+        self.assertIsNotNone(self.capsule.transferred_at)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class EmailRateLimitDeferralTests(TestCase):
+    def setUp(self):
+        capsule = Capsule.objects.create(
+            owner=_create_user('owner@example.com'), title="Deferred", delivery_date=timezone.localdate()
+        )
+        self.recipient = CapsuleRecipient.objects.create(capsule=capsule, recipient_email='ada@example.com')
+        bucket = mock.Mock(max_wait=30)
+        bucket.reserve.return_value = 12.5
+        patcher = mock.patch('capsules.tasks.email_send_bucket', return_value=bucket)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.bucket = bucket
+
+    def _deliver(self, **options):
+        with mock.patch.object(deliver_capsule_email_task, 'apply_async') as apply_async:
+            deliver_capsule_email_task.apply(args=[self.recipient.capsule_id, self.recipient.pk], **options)
+        apply_async.assert_called_once()
+        return apply_async.call_args.kwargs
+
+    def test_deferred_retry_keeps_its_retry_count_and_queue(self):
+        deferred = self._deliver(retries=2, routing_key=settings.DELIVERY_RETRY_QUEUE)
+
+        self.assertEqual(deferred['kwargs'], {'send_slot_reserved': True})
+        self.assertEqual(deferred['countdown'], 12.5)
+        self.assertEqual(deferred['retries'], 2)
+        self.assertEqual(deferred['queue'], settings.DELIVERY_RETRY_QUEUE)
+
+    def test_first_attempt_past_the_deferral_cap_asks_again_later(self):
+        self.bucket.reserve.return_value = 90
+
+        deferred = self._deliver()
+
+        self.assertEqual(deferred['kwargs'], {'send_slot_reserved': False})
+        self.assertEqual(deferred['countdown'], 30)
+        self.assertEqual(deferred['retries'], 0)
+        self.assertNotIn('queue', deferred)
+        self.recipient.refresh_from_db()
+        self.assertEqual(self.recipient.received_status, CapsuleRecipientStatus.PENDING)
+
+
+class OutboxRelayTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch('capsules.outbox.current_app')
+        self.send_task = patcher.start().send_task
+        self.addCleanup(patcher.stop)
+
+    def test_rows_of_a_rolled_back_transaction_are_never_published(self):
+        with self.assertRaises(DatabaseError), transaction.atomic():
+            enqueue_task(deliver_capsule_task.name, [1])
+            raise DatabaseError("Capsule insert failed")
+
+        self.assertEqual(drain_outbox(10), 0)
+        self.send_task.assert_not_called()
+
+    def test_relay_publishes_oldest_first_and_marks_rows(self):
+        eta = timezone.now() + datetime.timedelta(hours=1)
+        enqueue_task(deliver_capsule_task.name, [1], eta=eta)
+        enqueue_tasks(deliver_capsule_email_task.name, [[1, 10], [1, 11]])
+
+        self.assertEqual(drain_outbox(2), 3)
+
+        self.assertEqual(self.send_task.call_args_list, [
+            mock.call(deliver_capsule_task.name, args=[1], kwargs={}, eta=eta),
+            mock.call(deliver_capsule_email_task.name, args=[1, 10], kwargs={}, eta=None),
+            mock.call(deliver_capsule_email_task.name, args=[1, 11], kwargs={}, eta=None),
+        ])
+        self.assertFalse(OutboxMessage.objects.filter(published_at__isnull=True).exists())
+        self.assertEqual(publish_pending_messages(10), 0)
+
+    def test_messages_published_before_a_broker_error_stay_published(self):
+        _, second, third = enqueue_tasks(deliver_capsule_email_task.name, [[1, 10], [1, 11], [1, 12]])
+        self.send_task.side_effect = [mock.Mock(), ConnectionError("Broker unavailable")]
+
+        with self.assertRaises(ConnectionError):
+            publish_pending_messages(10)
+
+        unpublished = OutboxMessage.objects.filter(published_at__isnull=True).order_by('pk')
+        self.assertEqual(list(unpublished.values_list('pk', flat=True)), [second.pk, third.pk])
+
+
+class OutboxConcurrentRelayTests(TransactionTestCase):
+    def test_rows_locked_by_another_relay_are_skipped(self):
+        locked, free = enqueue_tasks(deliver_capsule_email_task.name, [[1, 10], [1, 11]])
+        row_locked = threading.Event()
+        release = threading.Event()
+
+        def other_relay():
+            try:
+                with transaction.atomic():
+                    OutboxMessage.objects.select_for_update().get(pk=locked.pk)
+                    row_locked.set()
+                    release.wait(10)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=other_relay)
+        thread.start()
+        try:
+            self.assertTrue(row_locked.wait(10))
+            with mock.patch('capsules.outbox.current_app') as app:
+                self.assertEqual(publish_pending_messages(10), 1)
+            app.send_task.assert_called_once_with(deliver_capsule_email_task.name, args=[1, 11], kwargs={}, eta=None)
+        finally:
+            release.set()
+            thread.join()
+
+        self.assertEqual(
+            list(OutboxMessage.objects.filter(published_at__isnull=True).values_list('pk', flat=True)), [locked.pk]
+        )
+        self.assertIsNotNone(OutboxMessage.objects.get(pk=free.pk).published_at)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class LegacyContentFileCleanupTests(TestCase):
+    def setUp(self):
+        _use_local_media(self)
+        self.capsule = Capsule.objects.create(
+            owner=_create_user('ada@example.com'), title="Legacy", delivery_date=timezone.localdate()
+        )
+        # Uploaded before blobs existed: the row owns its file
+        self.content = CapsuleContent.objects.create(
+            capsule=self.capsule, content_type=CapsuleContentType.DOCUMENT,
+            file=SimpleUploadedFile('notes.pdf', b'%PDF-1.4'),
+        )
+        self.path = self.content.file.path
+
+    def test_file_is_deleted_after_a_cascade_commits(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.capsule.delete()
+            self.assertTrue(os.path.exists(self.path))
+
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_file_survives_a_rolled_back_delete(self):
+        with self.captureOnCommitCallbacks(execute=True), self.assertRaises(DatabaseError), transaction.atomic():
+            CapsuleContent.objects.filter(pk=self.content.pk).delete()
+            raise DatabaseError("Rolled back")
+
+        self.assertTrue(CapsuleContent.objects.filter(pk=self.content.pk).exists())
+        self.assertTrue(os.path.exists(self.path))
+
+
+class _RemoteSigningStorage(_SigningStorage):
+    def local_path(self, name):
+        return None
+
+
+@override_settings(CACHES=LOCMEM_CACHES, MEDIA_REDIRECT_URL_TTL_SECONDS=300)
+class SignedRedirectTests(SimpleTestCase):
+    def setUp(self):
+        self.storage = _RemoteSigningStorage(location=tempfile.gettempdir())
+        self.factory = RequestFactory()
+
+    def _redirect(self, name, now):
+        with mock.patch('capsules.media_delivery.time.time', return_value=now):
+            return serve_media_file(self.factory.get('/media/1/'), _StoredFile(self.storage, name))
+
+    def test_redirect_urls_are_signed_once_per_time_bucket(self):
+        with mock.patch.object(self.storage, 'signed_url', wraps=self.storage.signed_url) as signed_url:
+            first = self._redirect('capsule_media/a.jpg', 1000)
+            second = self._redirect('capsule_media/a.jpg', 1199)
+            other = self._redirect('capsule_media/b.jpg', 1199)
+            next_bucket = self._redirect('capsule_media/a.jpg', 1200)
+
+        self.assertEqual(first.status_code, 302)
+        # Bucket [900, 1200): valid until 300s after it ends
+        self.assertEqual(first['Location'], "https://cdn.example.com/capsule_media/a.jpg?expires=500")
+        self.assertEqual(second['Location'], first['Location'])
+        self.assertEqual(other['Location'], "https://cdn.example.com/capsule_media/b.jpg?expires=301")
+        self.assertEqual(next_bucket['Location'], "https://cdn.example.com/capsule_media/a.jpg?expires=600")
+        self.assertEqual(signed_url.call_count, 3)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class MediaUrlFieldsTests(TestCase):
+    def setUp(self):
+        self.capsule = Capsule.objects.create(
+            owner=_create_user('ada@example.com'), title="Album", delivery_date=timezone.localdate()
+        )
+        self.contents = [
+            CapsuleContent.objects.create(
+                capsule=self.capsule, content_type=CapsuleContentType.IMAGE, file=f'capsule_media/2026/10/{index}.jpg'
+            )
+            for index in range(3)
+        ]
+        self.variant = CapsuleContentVariant.objects.create(
+            content=self.contents[0], kind=CapsuleContentVariantKind.IMAGE, format='webp', width=320, height=240,
+            file='capsule_media/2026/10/0_320w.webp', file_size=10
+        )
+        self.request = RequestFactory().get('/api/capsules/', HTTP_HOST='testserver')
+
+    def _serialize(self, serializer_class, **context):
+        contents = CapsuleContent.objects.filter(capsule=self.capsule).prefetch_related('variants').order_by('pk')
+        with mock.patch('capsules.serializers.reverse', wraps=reverse) as reverse_spy:
+            data = serializer_class(contents, many=True, context={'request': self.request, **context}).data
+        self.assertEqual(reverse_spy.call_count, 1)
+        return data
+
+    def test_owner_urls_are_built_from_one_resolved_endpoint(self):
+        data = self._serialize(CapsuleContentSerializer)
+
+        self.assertEqual(
+            [item['file_url'] for item in data],
+            [f"http://testserver{reverse('capsule-media', args=[content.pk])}" for content in self.contents],
+        )
+        self.assertEqual(
+            data[0]['srcset'],
+            f"http://testserver{reverse('capsule-media', args=[self.contents[0].pk])}?variant={self.variant.pk} 320w",
+        )
+
+    def test_public_urls_carry_the_access_token(self):
+        access_token = uuid.uuid4()
+
+        data = self._serialize(PublicCapsuleContentSerializer, access_token=access_token)
+
+        self.assertEqual(
+            data[2]['file_url'],
+            f"http://testserver{reverse('public-capsule-media', args=[access_token, self.contents[2].pk])}",
+        )
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class MediaBlobReferenceTests(TestCase):
+    def setUp(self):
+        self.media_root = _use_local_media(self)
+
+    def _stored_files(self):
+        return sorted(
+            os.path.relpath(os.path.join(directory, name), self.media_root)
+            for directory, _, names in os.walk(self.media_root) for name in names
+        )
+
+    def test_identical_bytes_share_one_stored_blob(self):
+        first = acquire_blob(SimpleUploadedFile('a.pdf', b'%PDF-same'))
+        second = acquire_blob(SimpleUploadedFile('b.pdf', b'%PDF-same'))
+        other = acquire_blob(SimpleUploadedFile('c.pdf', b'%PDF-other'))
+
+        self.assertEqual(first.pk, second.pk)
+        self.assertNotEqual(first.pk, other.pk)
+        self.assertEqual(MediaBlob.objects.get(pk=first.pk).reference_count, 2)
+        self.assertEqual(self._stored_files(), sorted([first.file.name, other.file.name]))
+
+    def test_file_is_destroyed_with_the_last_reference_after_commit(self):
+        blob = acquire_blob(SimpleUploadedFile('a.pdf', b'%PDF-same'))
+        acquire_blob(SimpleUploadedFile('b.pdf', b'%PDF-same'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            release_blob(blob.pk)
+        self.assertEqual(MediaBlob.objects.get(pk=blob.pk).reference_count, 1)
+        self.assertEqual(self._stored_files(), [blob.file.name])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            release_blob(blob.pk)
+            self.assertEqual(self._stored_files(), [blob.file.name])
+        self.assertFalse(MediaBlob.objects.filter(pk=blob.pk).exists())
+        self.assertEqual(self._stored_files(), [])
+
+    def test_losing_the_insert_race_shares_the_winners_blob(self):
+        winner = acquire_blob(SimpleUploadedFile('a.pdf', b'%PDF-same'))
+        real_lookup = blobs._reference_existing_blob
+        lookups = []
+
+        def lookup(sha256):
+            # The first lookup misses, as if the winner committed just after it
+            lookups.append(sha256)
+            return None if len(lookups) == 1 else real_lookup(sha256)
+
+        with mock.patch('capsules.blobs._reference_existing_blob', side_effect=lookup):
+            loser = acquire_blob(SimpleUploadedFile('b.pdf', b'%PDF-same'))
+
+        self.assertEqual(len(lookups), 2)
+        self.assertEqual(loser.pk, winner.pk)
+        self.assertEqual(MediaBlob.objects.get(pk=winner.pk).reference_count, 2)
+        self.assertEqual(self._stored_files(), [winner.file.name])
+
+
+@override_settings(CACHES=LOCMEM_CACHES, MEDIA_SENDFILE_BACKEND='')
+class DeduplicatedContentTests(TestCase):
+    def setUp(self):
+        _use_local_media(self)
+        self.owner = _create_user('ada@example.com')
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def _create_capsule(self, *files):
+        response = self.client.post(reverse('create_capsule'), {
+            'title': "Papers",
+            'delivery_date': (timezone.localdate() + datetime.timedelta(days=30)).isoformat(),
+            'delivery_time': '12:00',
+            'recipient_email': 'bob@example.com',
+            'media_files': list(files),
+        }, format='multipart')
+        self.assertEqual(response.status_code, 201, response.data)
+        return Capsule.objects.get(pk=response.data['id'])
+
+    def test_original_filenames_survive_content_addressed_storage(self):
+        capsule = self._create_capsule(
+            SimpleUploadedFile('Tax return 2026.pdf', b'%PDF-same'), SimpleUploadedFile('copy.pdf', b'%PDF-same')
+        )
+        first, second = capsule.contents.order_by('order')
+
+        self.assertEqual(first.blob_id, second.blob_id)
+        self.assertEqual(first.blob.reference_count, 2)
+        self.assertTrue(first.file.name.startswith('blobs/'))
+        self.assertEqual([first.original_filename, second.original_filename], ['Tax return 2026.pdf', 'copy.pdf'])
+
+        response = self.client.get(reverse('capsule-media', args=[first.pk]))
+        self.assertEqual(response['Content-Disposition'], "inline; filename*=UTF-8''Tax%20return%202026.pdf")
+        self.assertEqual(b''.join(response.streaming_content), b'%PDF-same')
+
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(iter_capsule_zip(capsule))))
+        self.assertEqual(archive.namelist(), ['001_Tax return 2026.pdf', '002_copy.pdf'])
+
+    def test_second_upload_of_processed_bytes_copies_the_variants(self):
+        source = self._create_capsule(SimpleUploadedFile('photo.jpg', b'jpeg-bytes')).contents.get()
+        CapsuleContentVariant.objects.create(
+            content=source, kind=CapsuleContentVariantKind.IMAGE, format='webp', width=320, height=200,
+            file='capsule_media/variants/photo_320w.webp', file_size=10
+        )
+
+        copy = self._create_capsule(SimpleUploadedFile('again.jpg', b'jpeg-bytes')).contents.get()
+
+        self.assertEqual(copy.blob_id, source.blob_id)
+        self.assertEqual(
+            list(copy.variants.values_list('file', 'width')), [('capsule_media/variants/photo_320w.webp', 320)]
+        )
+        # Legacy uploads have no blob to share variants through
+        self.assertEqual(copy_blob_variants(CapsuleContent(capsule=source.capsule, content_type=CapsuleContentType.IMAGE)), 0)
+
+    def test_client_paths_are_stripped_and_long_names_keep_their_extension(self):
+        self.assertEqual(original_filename('C:\\Users\\ada\\notes.pdf'), 'notes.pdf')
+        self.assertEqual(original_filename('../../etc/passwd'), 'passwd')
+        long_name = original_filename('x' * 300 + '.pdf')
+        self.assertEqual((len(long_name), long_name[-4:]), (255, '.pdf'))
+
+
+class _InterruptedStream:
+    """A request body whose connection drops after the first `size` bytes."""
+
+    def __init__(self, data, size):
+        self.data = io.BytesIO(data)
+        self.size = size
+
+    def read(self, size=-1):
+        if self.data.tell() >= self.size:
+            raise OSError("Connection reset")
+        return self.data.read(min(size, self.size - self.data.tell()))
+
+
+@override_settings(RESUMABLE_UPLOAD_READ_SIZE=4)
+class ResumableUploadViewTests(TestCase):
+    def setUp(self):
+        staging_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, staging_dir, ignore_errors=True)
+        settings_override = override_settings(RESUMABLE_UPLOAD_DIR=staging_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.owner = _create_user('ada@example.com')
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def _create(self, length, filename='clip.mp4'):
+        metadata = f"filename {base64.b64encode(filename.encode()).decode()},filetype {base64.b64encode(b'video/mp4').decode()}"
+        return self.client.post(
+            reverse('media-upload-create'), HTTP_UPLOAD_LENGTH=str(length), HTTP_UPLOAD_METADATA=metadata
+        )
+
+    def _patch(self, upload, data, offset, **extra):
+        return self.client.patch(
+            reverse('media-upload-detail', args=[upload.pk]), data,
+            content_type='application/offset+octet-stream', HTTP_UPLOAD_OFFSET=str(offset), **extra
+        )
+
+    def _read_staged(self, upload):
+        with open(upload.staging_path, 'rb') as staging_file:
+            return staging_file.read()
+
+    def test_create_then_patch_in_chunks_completes_the_upload(self):
+        response = self._create(10)
+
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual((response['Upload-Offset'], response['Tus-Resumable']), ('0', '1.0.0'))
+        upload = MediaUpload.objects.get()
+        self.assertTrue(response['Location'].endswith(reverse('media-upload-detail', args=[upload.pk])))
+        self.assertEqual((upload.filename, upload.mime_type, upload.status), ('clip.mp4', 'video/mp4', MediaUploadStatus.IN_PROGRESS))
+
+        response = self._patch(upload, b'01234', 0)
+        self.assertEqual((response.status_code, response['Upload-Offset']), (204, '5'))
+        upload.refresh_from_db()
+        self.assertEqual(upload.status, MediaUploadStatus.IN_PROGRESS)
+
+        response = self._patch(upload, b'56789', 5)
+        self.assertEqual((response.status_code, response['Upload-Offset']), (204, '10'))
+        upload.refresh_from_db()
+        self.assertEqual((upload.offset, upload.status), (10, MediaUploadStatus.COMPLETE))
+        self.assertEqual(self._read_staged(upload), b'0123456789')
+
+        # A finished upload takes no more bytes
+        response = self._patch(upload, b'x', 10)
+        self.assertEqual((response.status_code, response['Upload-Offset']), (409, '10'))
+
+    def test_create_rejects_missing_length_and_filename(self):
+        response = self.client.post(reverse('media-upload-create'), HTTP_UPLOAD_METADATA='filename Y2xpcC5tcDQ=')
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.post(reverse('media-upload-create'), HTTP_UPLOAD_LENGTH='10')
+        self.assertEqual(response.status_code, 400)
+
+        with override_settings(RESUMABLE_UPLOAD_MAX_SIZE=5):
+            self.assertEqual(self._create(10).status_code, 413)
+        self.assertFalse(MediaUpload.objects.exists())
+
+    def test_empty_upload_is_complete_on_creation(self):
+        self.assertEqual(self._create(0).status_code, 201)
+
+        self.assertEqual(MediaUpload.objects.get().status, MediaUploadStatus.COMPLETE)
+
+    def test_head_reports_the_committed_offset(self):
+        self._create(10)
+        upload = MediaUpload.objects.get()
+        self._patch(upload, b'0123', 0)
+
+        response = self.client.head(reverse('media-upload-detail', args=[upload.pk]))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response['Upload-Offset'], response['Upload-Length']), ('4', '10'))
+        self.assertEqual(response['Cache-Control'], 'no-store')
+
+    def test_uploads_of_other_users_are_not_found(self):
+        self._create(10)
+        upload = MediaUpload.objects.get()
+        self.client.force_authenticate(_create_user('bob@example.com'))
+
+        self.assertEqual(self.client.head(reverse('media-upload-detail', args=[upload.pk])).status_code, 404)
+        self.assertEqual(self._patch(upload, b'0123', 0).status_code, 404)
+        self.assertEqual(self.client.delete(reverse('media-upload-detail', args=[upload.pk])).status_code, 404)
+
+    def test_patch_at_a_stale_offset_is_rejected_with_the_current_one(self):
+        self._create(10)
+        upload = MediaUpload.objects.get()
+        self._patch(upload, b'0123', 0)
+
+        response = self._patch(upload, b'0123', 0)
+
+        self.assertEqual((response.status_code, response['Upload-Offset']), (409, '4'))
+        self.assertEqual(self._read_staged(upload), b'0123')
+
+    def test_patch_requires_the_offset_content_type_and_header(self):
+        self._create(10)
+        upload = MediaUpload.objects.get()
+        url = reverse('media-upload-detail', args=[upload.pk])
+
+        response = self.client.patch(url, b'0123', content_type='application/octet-stream', HTTP_UPLOAD_OFFSET='0')
+        self.assertEqual(response.status_code, 415)
+        response = self.client.patch(url, b'0123', content_type='application/offset+octet-stream')
+        self.assertEqual(response.status_code, 400)
+
+    def test_bodiless_patch(self):
+        self._create(10)
+        upload = MediaUpload.objects.get()
+
+        # An empty body is a no-op that still reports the offset
+        response = self._patch(upload, b'', 0, CONTENT_LENGTH='0')
+        self.assertEqual((response.status_code, response['Upload-Offset']), (204, '0'))
+        response = self._patch(upload, b'', 3, CONTENT_LENGTH='0')
+        self.assertEqual((response.status_code, response['Upload-Offset']), (409, '0'))
+        # A chunked body without a length cannot be read
+        self.assertEqual(self._patch(upload, b'', 0).status_code, 400)
+
+    def test_concurrent_patch_is_locked_out(self):
+        self._create(10)
+        upload = MediaUpload.objects.get()
+
+        with open(upload.staging_path, 'r+b') as staging_file:
+            fcntl.flock(staging_file, fcntl.LOCK_EX)
+            response = self._patch(upload, b'0123', 0)
+
+        self.assertEqual(response.status_code, 423)
+        upload.refresh_from_db()
+        self.assertEqual(upload.offset, 0)
+        self.assertEqual(self._patch(upload, b'0123', 0).status_code, 204)
+
+    def test_bytes_received_before_a_dropped_connection_are_kept(self):
+        self._create(10)
+        upload = MediaUpload.objects.get()
+
+        with self.assertRaises(OSError):
+            append_chunk(upload, _InterruptedStream(b'0123456789', 6), 0)
+
+        upload.refresh_from_db()
+        self.assertEqual((upload.offset, upload.status), (6, MediaUploadStatus.IN_PROGRESS))
+        response = self._patch(upload, b'6789', 6)
+        self.assertEqual((response.status_code, response['Upload-Offset']), (204, '10'))
+        self.assertEqual(self._read_staged(upload), b'0123456789')
+
+    def test_unrecorded_bytes_from_a_crashed_request_are_truncated(self):
+        self._create(10)
+        upload = MediaUpload.objects.get()
+        self._patch(upload, b'0123', 0)
+        # The worker died after writing but before the offset was saved
+        with open(upload.staging_path, 'ab') as staging_file:
+            staging_file.write(b'garbage')
+
+        response = self._patch(upload, b'456789', 4)
+
+        self.assertEqual((response.status_code, response['Upload-Offset']), (204, '10'))
+        self.assertEqual(self._read_staged(upload), b'0123456789')
+
+    def test_delete_removes_the_upload_and_its_staging_file(self):
+        self._create(10)
+        upload = MediaUpload.objects.get()
+        self._patch(upload, b'0123', 0)
+
+        response = self.client.delete(reverse('media-upload-detail', args=[upload.pk]))
+
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(MediaUpload.objects.exists())
+        self.assertFalse(os.path.exists(upload.staging_path))
+
+    def test_capsules_only_accept_finished_uploads(self):
+        self._create(10)
+        upload = MediaUpload.objects.get()
+        self._patch(upload, b'0123', 0)
+        payload = {
+            'title': "Holiday",
+            'delivery_date': (timezone.localdate() + datetime.timedelta(days=30)).isoformat(),
+            'delivery_time': '09:00',
+            'recipient_email': 'bob@example.com',
+            'upload_ids': [str(upload.pk)],
+        }
+
+        response = self.client.post(reverse('create_capsule'), payload, format='multipart')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('upload_ids', response.json())
@@ -0,0 +1,188 @@
+# capsules/transfers.py
+"""
+Legacy transfer of capsules whose owner has been inactive.
+
+Owners whose last recorded activity (User.last_activity_at, which logins also update) is older
+than INACTIVITY_TRANSFER_DAYS are found with keyset scans over the (last_activity_at, id) index;
+the EXISTS check on opted-in capsules uses the partial index of capsules still waiting for a
+transfer. An owner with no recorded activity is unknown rather than inactive, and is only taken
+as inactive once activity has been recorded for a full period (ACTIVITY_TRACKING_STARTED_AT).
+Their capsules are then handled in primary-key batches: transfer_recipient_email becomes a
+recipient unless it already is one (compared case-insensitively), the capsule is stamped with
+transferred_at (which also unlocks it for that recipient's access link), TRANSFER_NOTIFICATION
+notifications are bulk-inserted and the emails are queued through the outbox (see capsules.outbox).
+"""
+import datetime
+import logging
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.db.models.functions import Lower
+from django.utils import timezone
+
+from .models import Capsule, CapsuleRecipient, CapsuleRecipientStatus, Notification, NotificationType
+from .outbox import enqueue_tasks
+from .signals import invalidate_user_cache_on_commit
+from .utils import registered_user_ids_by_email
+
+logger = logging.getLogger(__name__)
+logger.disabled = settings.DISABLE_LOGGING
+
+
+def _pending_transfer_capsules():
+    return (
+        Capsule.objects
+        .filter(transfer_on_inactivity=True, transferred_at__isnull=True, transfer_recipient_email__isnull=False)
+        .exclude(transfer_recipient_email='')
+    )
+
+
+def iter_inactive_owner_batches(cutoff, batch_size):
+    """
+    Yields lists of IDs of users inactive since before `cutoff` who own capsules awaiting transfer.
+    """
+    User = get_user_model()
+    owners = User.objects.filter(Exists(_pending_transfer_capsules().filter(owner=OuterRef('pk'))))
+
+    tracking_started_at = settings.ACTIVITY_TRACKING_STARTED_AT
+    if tracking_started_at is not None and cutoff >= tracking_started_at:
+        # Activity has been recorded for the whole period, so none at all means inactive
+        never_active = (
+            owners
+            .filter(last_activity_at__isnull=True, created_at__lt=cutoff)
+            .order_by('pk')
+            .values_list('pk', flat=True)
+        )
+        last_pk = 0
+        while True:
+            owner_ids = list(never_active.filter(pk__gt=last_pk)[:batch_size])
+            if not owner_ids:
+                break
+            yield owner_ids
+            last_pk = owner_ids[-1]
+
+    inactive_owners = (
+        owners
+        .filter(last_activity_at__lt=cutoff)
+        .order_by('last_activity_at', 'pk')
+        .values_list('last_activity_at', 'pk')
+    )
+    last_seen = None
+    while True:
+        queryset = inactive_owners
+        if last_seen:
+            last_activity_at, last_pk = last_seen
+            queryset = queryset.filter(
+                Q(last_activity_at__gt=last_activity_at) | Q(last_activity_at=last_activity_at, pk__gt=last_pk)
+            )
+        rows = list(queryset[:batch_size])
+        if not rows:
+            break
+        yield [pk for _, pk in rows]
+        last_seen = rows[-1]
+
+
+def _transfer_batch(capsules, owner_names):
+    from .tasks import deliver_capsule_email_task
+
+    capsule_ids = [capsule['id'] for capsule in capsules]
+    registered_user_ids = registered_user_ids_by_email({capsule['transfer_recipient_email'] for capsule in capsules})
+
+    with transaction.atomic():
+        # The unique (capsule, recipient_email) constraint is case-sensitive, so an existing
+        # regular recipient spelled differently would not conflict and would get a second row
+        existing_recipients = set(
+            CapsuleRecipient.objects
+            .filter(capsule_id__in=capsule_ids)
+            .annotate(email_lower=Lower('recipient_email'))
+            .filter(email_lower__in={capsule['transfer_recipient_email'].lower() for capsule in capsules})
+            .values_list('capsule_id', 'email_lower')
+        )
+        CapsuleRecipient.objects.bulk_create(
+            [
+                CapsuleRecipient(
+                    capsule_id=capsule['id'],
+                    recipient_email=capsule['transfer_recipient_email'],
+                    recipient_user_id=registered_user_ids.get(capsule['transfer_recipient_email'].lower())
+                )
+                for capsule in capsules
+                if (capsule['id'], capsule['transfer_recipient_email'].lower()) not in existing_recipients
+            ],
+            ignore_conflicts=True # Added as a regular recipient concurrently
+        )
+        Capsule.objects.filter(pk__in=capsule_ids).update(transferred_at=timezone.now())
+
+        # Recipients that still need the email (a regular recipient may have received it already)
+        transfer_email_by_capsule = {capsule['id']: capsule['transfer_recipient_email'] for capsule in capsules}
+        deliveries = [
+            (capsule_id, recipient_id)
+            for recipient_id, capsule_id, email in CapsuleRecipient.objects.filter(
+                capsule_id__in=capsule_ids, received_status=CapsuleRecipientStatus.PENDING
+            ).values_list('id', 'capsule_id', 'recipient_email')
+            if transfer_email_by_capsule[capsule_id].lower() == email.lower()
+        ]
+
+        notifications = []
+        for capsule in capsules:
+            email = capsule['transfer_recipient_email']
+            notifications.append(Notification(
+                user_id=capsule['owner_id'],
+                capsule_id=capsule['id'],
+                message=f"Your time capsule '{capsule['title']}' was transferred to {email} after a period of account inactivity.",
+                notification_type=NotificationType.TRANSFER_NOTIFICATION,
+            ))
+            if registered_user_ids.get(email.lower()):
+                notifications.append(Notification(
+                    user_id=registered_user_ids[email.lower()],
+                    capsule_id=capsule['id'],
+                    message=f"The time capsule '{capsule['title']}' from {owner_names[capsule['owner_id']]} has been transferred to you.",
+                    notification_type=NotificationType.TRANSFER_NOTIFICATION,
+                ))
+        Notification.objects.bulk_create(notifications)
+        # bulk_create sends no post_save, so cached unread counts are invalidated here
+        for user_id in {notification.user_id for notification in notifications}:
+            invalidate_user_cache_on_commit(user_id)
+
+        # Published by the outbox relay once this batch has committed
+        enqueue_tasks(deliver_capsule_email_task.name, [[capsule_id, recipient_id] for capsule_id, recipient_id in deliveries])
+
+
+def transfer_capsules_of_owners(owner_ids, batch_size):
+    """
+    Transfers every capsule of `owner_ids` that is waiting for an inactivity transfer.
+    Returns the number of capsules transferred.
+    """
+    User = get_user_model()
+    owner_names = {
+        pk: name or email for pk, name, email in User.objects.filter(pk__in=owner_ids).values_list('pk', 'name', 'email')
+    }
+    pending = (
+        _pending_transfer_capsules()
+        .filter(owner_id__in=owner_ids)
+        .order_by('pk')
+        .values('id', 'owner_id', 'title', 'transfer_recipient_email')
+    )
+    transferred_count = 0
+    last_pk = 0
+    while True:
+        capsules = list(pending.filter(pk__gt=last_pk)[:batch_size])
+        if not capsules:
+            break
+        _transfer_batch(capsules, owner_names)
+        transferred_count += len(capsules)
+        last_pk = capsules[-1]['id']
+    return transferred_count
+
+
+def run_inactivity_transfers(inactive_days, batch_size):
+    """
+    Transfers the opted-in capsules of every owner inactive for more than `inactive_days`.
+    Returns the number of capsules transferred.
+    """
+    cutoff = timezone.now() - datetime.timedelta(days=inactive_days)
+    transferred_count = 0
+    for owner_ids in iter_inactive_owner_batches(cutoff, batch_size):
+        transferred_count += transfer_capsules_of_owners(owner_ids, batch_size)
+    return transferred_count
@@ -0,0 +1,149 @@
+# capsules/uploads.py
+"""
+Storage side of resumable (tus-style) media uploads.
+
+A client creates a MediaUpload announcing the total size, then PATCHes chunks at the
+offset the server reports. Bytes are appended to a staging file in RESUMABLE_UPLOAD_DIR as
+they arrive and the offset is persisted even when the connection drops mid-chunk, so a
+retry only re-sends what the server has not seen. The staging directory must be shared by
+every web process that serves upload requests.
+"""
+import base64
+import binascii
+import datetime
+import fcntl
+import logging
+import os
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.utils import timezone
+
+from .models import MediaUpload, MediaUploadStatus
+
+logger = logging.getLogger(__name__)
+
+TUS_VERSION = '1.0.0'
+
+
+class UploadOffsetMismatch(Exception):
+    """The client sent a chunk for an offset other than the one the server has."""
+
+
+class UploadLocked(Exception):
+    """Another request is currently writing to the same upload."""
+
+
+def parse_upload_metadata(header_value):
+    """
+    Parses a tus Upload-Metadata header ("key base64value,key2 base64value2") into a dict.
+    Raises ValueError for values that are not valid base64.
+    """
+    metadata = {}
+    for pair in (header_value or '').split(','):
+        pair = pair.strip()
+        if not pair:
+            continue
+        key, _, encoded = pair.partition(' ')
+        try:
+            metadata[key] = base64.b64decode(encoded, validate=True).decode('utf-8') if encoded else ''
+        except (binascii.Error, UnicodeDecodeError) as e:
+            raise ValueError(f"Invalid Upload-Metadata value for '{key}'") from e
+    return metadata
+
+
+def create_upload(owner, filename, upload_length, mime_type=''):
+    os.makedirs(settings.RESUMABLE_UPLOAD_DIR, exist_ok=True)
+    upload = MediaUpload.objects.create(
+        owner=owner,
+        filename=os.path.basename(filename)[:255],
+        mime_type=mime_type[:100],
+        upload_length=upload_length,
+        status=MediaUploadStatus.COMPLETE if upload_length == 0 else MediaUploadStatus.IN_PROGRESS,
+    )
+    # Pre-create the staging file so PATCH can always open it for update
+    open(upload.staging_path, 'wb').close()
+    return upload
+
+
+def append_chunk(upload, stream, client_offset):
+    """
+    Appends bytes read from `stream` to the upload's staging file, starting at `client_offset`.
+    Whatever was received is recorded even if reading the stream fails part-way; the error is
+    re-raised afterwards. Returns the new offset.
+    """
+    read_size = settings.RESUMABLE_UPLOAD_READ_SIZE
+    with open(upload.staging_path, 'r+b') as staging_file:
+        try:
+            # One writer per upload; a second concurrent PATCH is rejected instead of interleaving bytes
+            fcntl.flock(staging_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError as e:
+            raise UploadLocked() from e
+
+        upload.refresh_from_db(fields=['offset', 'status'])
+        if client_offset != upload.offset:
+            raise UploadOffsetMismatch()
+
+        # Drop bytes past the committed offset left by a request that died before recording them
+        staging_file.truncate(upload.offset)
+        staging_file.seek(upload.offset)
+        remaining = upload.upload_length - upload.offset
+        received = 0
+        try:
+            while remaining > 0:
+                chunk = stream.read(min(read_size, remaining))
+                if not chunk:
+                    break
+                staging_file.write(chunk)
+                received += len(chunk)
+                remaining -= len(chunk)
+        finally:
+            staging_file.flush()
+            os.fsync(staging_file.fileno())
+            new_offset = upload.offset + received
+            is_complete = new_offset == upload.upload_length
+            MediaUpload.objects.filter(pk=upload.pk).update(
+                offset=new_offset,
+                status=MediaUploadStatus.COMPLETE if is_complete else MediaUploadStatus.IN_PROGRESS,
+                updated_at=timezone.now(),
+            )
+            upload.offset = new_offset
+            if is_complete:
+                upload.status = MediaUploadStatus.COMPLETE
+    return upload.offset
+
+
+def open_completed_upload(upload):
+    """
+    Returns the staged bytes of a completed upload as an UploadedFile, which CapsuleContent's
+    file field forwards to storage on save. The caller closes the file.
+    """
+    return UploadedFile(
+        file=open(upload.staging_path, 'rb'),
+        name=upload.filename,
+        content_type=upload.mime_type or None,
+        size=upload.upload_length,
+    )
+
+
+def discard_uploads(upload_ids):
+    """
+    Deletes uploads that have been attached to a capsule, along with their staging files.
+    """
+    for upload in MediaUpload.objects.filter(pk__in=upload_ids):
+        upload.delete()
+
+
+def prune_stale_uploads(max_age_hours):
+    """
+    Deletes uploads (and their staging files) that have not received bytes for `max_age_hours`.
+    Returns the number of uploads removed.
+    """
+    cutoff = timezone.now() - datetime.timedelta(hours=max_age_hours)
+    removed = 0
+    for upload in MediaUpload.objects.filter(updated_at__lt=cutoff).iterator(chunk_size=500):
+        upload.delete()
+        removed += 1
+    if removed:
+        logger.info(f"Removed {removed} stale resumable upload(s).")
+    return removed
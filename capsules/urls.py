@@ -6,7 +6,16 @@ from .views import (
     CapsuleListView, 
     CapsuleViewSet, 
     PublicCapsuleRetrieveView,
+    PublicCapsuleDownloadView,
+    PublicCapsuleContentMediaView,
+    CapsuleContentMediaView,
     CapsuleDeleteView,
+    CapsuleExportView,
+    CapsuleSearchView,
+    DashboardSummaryView,
+    DeliveryCalendarView,
+    MediaUploadCreateView,
+    MediaUploadDetailView,
     NotificationListView, # Add this
     NotificationMarkReadView, # Add this
     NotificationMarkAllReadView, # Add this
@@ -23,7 +32,18 @@ urlpatterns = [
     path('', CapsuleListView.as_view(), name='capsule_list'),  # List all capsules for the authenticated user
     path('', include(router.urls)),
     path('public/capsules/<uuid:access_token>/', PublicCapsuleRetrieveView.as_view(), name='public-capsule-detail'),
+    path('public/capsules/<uuid:access_token>/download/', PublicCapsuleDownloadView.as_view(), name='public-capsule-download'),
+    path('public/capsules/<uuid:access_token>/media/<int:content_id>/', PublicCapsuleContentMediaView.as_view(), name='public-capsule-media'),
+    path('media/<int:content_id>/', CapsuleContentMediaView.as_view(), name='capsule-media'),
     path('<int:pk>/delete/', CapsuleDeleteView.as_view(), name='capsule_delete'),  # Add delete URL
+    path('export/', CapsuleExportView.as_view(), name='capsule_export'),  # Streaming NDJSON export
+    path('search/', CapsuleSearchView.as_view(), name='capsule_search'),  # Ranked full-text search
+    path('dashboard/summary/', DashboardSummaryView.as_view(), name='dashboard-summary'),
+    path('calendar/', DeliveryCalendarView.as_view(), name='delivery-calendar'),
+
+    # Resumable (tus-style) media uploads
+    path('uploads/', MediaUploadCreateView.as_view(), name='media-upload-create'),
+    path('uploads/<uuid:upload_id>/', MediaUploadDetailView.as_view(), name='media-upload-detail'),
 
     # Notification URLs
     path('notifications/', NotificationListView.as_view(), name='notification-list'),
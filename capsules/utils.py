@@ -1,19 +1,33 @@
 from django.core.mail import send_mail
 from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.validators import RegexValidator, validate_email
+from django.contrib.auth import get_user_model
+from django.db.models.functions import Lower
+import codecs
+import csv
 import logging # Import logging
+import requests
 from django.utils.html import escape # For escaping text to be safely included in HTML
 from django.utils.safestring import mark_safe # To mark a string as safe for HTML output
+from .delivery_failures import DeliveryError, is_permanent_email_error
 
 logger = logging.getLogger(__name__) # Get a logger instance
 # Assuming settings.DISABLE_LOGGING is False for logging to be active
 if hasattr(settings, 'DISABLE_LOGGING'):
     logger.disabled = settings.DISABLE_LOGGING
 
+# E.164 as SMS providers expect it: a plus sign and up to 15 digits
+validate_phone_number = RegexValidator(
+    r'^\+[1-9]\d{1,14}$', "Enter a phone number in international format, e.g. +14155550123."
+)
+
 def send_capsule_link_email(recipient_email, capsule_title, capsule_id, owner_name, access_token, text_content=None):
     """
     Sends an email to the recipient with a unique link to view the capsule.
     Optionally includes text_content in the email body, styled with HTML.
-    Returns: (bool, str_or_None) -> (success_status, message_or_error_string)
+    Returns: str -> the success message
+    Raises DeliveryError (flagged permanent when retrying cannot help) if sending fails.
     """
     frontend_base_url = getattr(settings, 'FRONTEND_BASE_URL', 'http://localhost:5173')
     # Use the access_token for the public viewing link
@@ -91,9 +105,125 @@ def send_capsule_link_email(recipient_email, capsule_title, capsule_id, owner_na
             html_message=html_message_body # HTML version
         )
         logger.info(f"Capsule link email successfully sent to {recipient_email} for capsule ID {capsule_id}")
-        return True, "Email sent successfully."
+        return "Email sent successfully."
     except Exception as e:
         error_message = f"Error sending email for capsule ID {capsule_id} to {recipient_email} from {from_email}: {e}"
         logger.error(error_message)
-        return False, error_message
+        raise DeliveryError(error_message, permanent=is_permanent_email_error(e)) from e
+
+
+def delete_in_batches(queryset, batch_size=1000):
+    """
+    Deletes the rows matching `queryset` in primary-key batches so that each DELETE
+    statement stays short and never holds locks on a large part of the table.
+    Returns the number of rows deleted.
+    """
+    model = queryset.model
+    total_deleted = 0
+    while True:
+        batch_pks = list(queryset.order_by().values_list('pk', flat=True)[:batch_size])
+        if not batch_pks:
+            break
+        model._default_manager.filter(pk__in=batch_pks).delete()
+        total_deleted += len(batch_pks)
+    return total_deleted
+
+
+def registered_user_ids_by_email(emails):
+    """
+    Looks up the registered users among `emails`, ignoring case (served by user_email_lower_idx).
+    Returns: dict -> lower-cased email to user ID
+    """
+    User = get_user_model()
+    return dict(
+        User.objects
+        .annotate(email_lower=Lower('email'))
+        .filter(email_lower__in={email.lower() for email in emails})
+        .values_list('email_lower', 'id')
+    )
+
+
+def parse_recipient_csv(uploaded_file, max_rows):
+    """
+    Reads recipient email addresses from an uploaded CSV file without loading it all into memory.
+    Uses the 'email' column when the file has a header row, otherwise the first column; a 'phone'
+    column in the header row gives the recipients' phone numbers for SMS delivery.
+    Returns: (emails, phones, invalid_values) -> distinct addresses (ignoring case) in file order,
+    {lowercased address: phone number}, and up to 10 rejected values
+    Raises ValueError if the file has more than `max_rows` distinct addresses.
+    """
+    reader = csv.reader(codecs.iterdecode(uploaded_file, 'utf-8-sig'))
+    email_column = 0
+    phone_column = None
+    emails = []
+    phones = {}
+    seen_emails = set()
+    invalid_values = []
+    for row_number, row in enumerate(reader):
+        if not row:
+            continue
+        if row_number == 0:
+            header = [cell.strip().lower() for cell in row]
+            if 'email' in header:
+                email_column = header.index('email')
+                if 'phone' in header:
+                    phone_column = header.index('phone')
+                continue
+        value = row[email_column].strip() if len(row) > email_column else ''
+        if not value:
+            continue
+        phone = row[phone_column].strip() if phone_column is not None and len(row) > phone_column else ''
+        try:
+            validate_email(value)
+            if phone:
+                validate_phone_number(phone)
+        except ValidationError:
+            if len(invalid_values) < 10:
+                invalid_values.append(f"{value},{phone}" if phone else value)
+            continue
+        if value.lower() in seen_emails:
+            continue
+        seen_emails.add(value.lower())
+        emails.append(value)
+        if phone:
+            phones[value.lower()] = phone
+        if len(emails) > max_rows:
+            raise ValueError(f"A capsule can have at most {max_rows} recipients.")
+    return emails, phones, invalid_values
+
+
+class LocalFileStream:
+    """
+    Read side of a file on local storage with the same iter_content()/close() interface as a
+    streaming requests.Response, so callers do not care where the file lives.
+    """
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+
+    def iter_content(self, chunk_size=64 * 1024):
+        return iter(lambda: self._file.read(chunk_size), b'')
 
+    def close(self):
+        self._file.close()
+
+
+def open_content_stream(content, timeout=30):
+    """
+    Opens a streaming read of a CapsuleContent file: straight from disk on local storage,
+    otherwise an HTTP download from the media host.
+    The caller iterates response.iter_content(...) and must close the response.
+    Raises requests.RequestException (or OSError for local files) if the file cannot be read.
+    """
+    local_path = content.file.storage.local_path(content.file.name)
+    if local_path:
+        return LocalFileStream(local_path)
+
+    # Media is private; a short-lived signed URL is enough to start the download
+    signed_url = content.file.storage.signed_url(content.file.name, expire=settings.MEDIA_REDIRECT_URL_TTL_SECONDS)
+    response = requests.get(signed_url, stream=True, timeout=timeout)
+    try:
+        response.raise_for_status()
+    except requests.RequestException:
+        response.close()
+        raise
+    return response
@@ -3,16 +3,38 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, viewsets, generics
 from rest_framework.permissions import IsAuthenticated, AllowAny
-from .serializers import CapsuleSerializer, PublicCapsuleSerializer, NotificationSerializer, NotificationSerializer
+from .serializers import CapsuleSerializer, CapsuleSearchResultSerializer, PublicCapsuleSerializer, NotificationSerializer, NotificationSerializer
 from .models import (
     Capsule, 
     CapsuleContent, 
     CapsuleRecipient, 
     CapsuleRecipientStatus, 
     Notification, 
-    NotificationType)
+    NotificationType,
+    MediaUpload,
+    CapsuleContentVariant,
+    CapsuleContentVariantKind)
 from django.utils import timezone
-from django.http import Http404
+from django.http import Http404, StreamingHttpResponse
+from .exports import iter_user_export
+from .archives import iter_capsule_zip
+from .media_delivery import serve_hls_playlist, serve_media_file
+from .search import search_capsules
+from .dashboard import get_dashboard_summary, get_delivery_calendar
+from .signals import invalidate_user_cache_on_commit
+from rest_framework.pagination import PageNumberPagination
+from .uploads import (
+    TUS_VERSION,
+    UploadLocked,
+    UploadOffsetMismatch,
+    append_chunk,
+    create_upload,
+    parse_upload_metadata,
+)
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils.text import slugify
+from django.db.models import prefetch_related_objects
 from .renderer import CapsuleRenderer
 from rest_framework.parsers import MultiPartParser, FormParser # For file uploads
 import uuid
@@ -65,7 +87,11 @@ class CapsuleListView(APIView):
     def get(self, request, *args, **kwargs):
         # Retrieve all capsules owned by the currently authenticated user
         # and that are not archived.
-        capsules = Capsule.objects.filter(owner=request.user, is_archived=False).order_by('-creation_date')
+        capsules = (
+            Capsule.objects.filter(owner=request.user, is_archived=False)
+            .prefetch_related('contents__variants', 'recipients')
+            .order_by('-creation_date')
+        )
         
         # If you want to paginate, you would integrate Django REST Framework's pagination here.
         # For now, returning all non-archived capsules.
@@ -79,7 +105,7 @@ class CapsuleDetailView(APIView): # Example: A view to get details of a single c
 
     def get(self, request, pk, *args, **kwargs): # pk would be the capsule's ID
         try:
-            capsule = Capsule.objects.get(pk=pk, owner=request.user) # Ensure owner can access
+            capsule = Capsule.objects.prefetch_related('contents__variants', 'recipients').get(pk=pk, owner=request.user) # Ensure owner can access
         except Capsule.DoesNotExist:
             return Response({"error": "Capsule not found or access denied."}, status=status.HTTP_404_NOT_FOUND)
         
@@ -134,6 +160,181 @@ class CapsuleDeleteView(APIView):
         return Response({"message": f"Capsule '{capsule_title}' successfully deleted."}, status=status.HTTP_204_NO_CONTENT)
 
 
+class CapsuleExportView(APIView):
+    """
+    Streams all of the user's capsules, contents, recipients and delivery logs as NDJSON.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        response = StreamingHttpResponse(iter_user_export(request.user), content_type='application/x-ndjson')
+        response['Content-Disposition'] = f'attachment; filename="time-capsules-{request.user.id}.ndjson"'
+        return response
+
+
+def _tus_response(status_code, headers=None, data=None):
+    response = Response(data, status=status_code, headers=headers)
+    response['Tus-Resumable'] = TUS_VERSION
+    response['Cache-Control'] = 'no-store'
+    return response
+
+
+def _parse_non_negative_int_header(request, header_name):
+    value = request.headers.get(header_name, '')
+    if not value.isdigit():
+        return None
+    return int(value)
+
+
+class MediaUploadCreateView(APIView):
+    """
+    Creates a resumable upload (tus creation extension). The client sends Upload-Length and an
+    Upload-Metadata header carrying at least the base64 'filename', then PATCHes the bytes to
+    the returned Location. Completed upload ids are passed to capsule creation as `upload_ids`.
+    """
+    permission_classes = [IsAuthenticated]
+    parser_classes = []
+
+    def options(self, request, *args, **kwargs):
+        return _tus_response(status.HTTP_204_NO_CONTENT, {
+            'Tus-Version': TUS_VERSION,
+            'Tus-Extension': 'creation,termination',
+            'Tus-Max-Size': str(settings.RESUMABLE_UPLOAD_MAX_SIZE),
+        })
+
+    def post(self, request, *args, **kwargs):
+        upload_length = _parse_non_negative_int_header(request, 'Upload-Length')
+        if upload_length is None:
+            return _tus_response(status.HTTP_400_BAD_REQUEST, data={"error": "A valid Upload-Length header is required."})
+        if upload_length > settings.RESUMABLE_UPLOAD_MAX_SIZE:
+            return _tus_response(status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, data={"error": "Upload is too large."})
+
+        try:
+            metadata = parse_upload_metadata(request.headers.get('Upload-Metadata'))
+        except ValueError as e:
+            return _tus_response(status.HTTP_400_BAD_REQUEST, data={"error": str(e)})
+        filename = metadata.get('filename') or metadata.get('name')
+        if not filename:
+            return _tus_response(status.HTTP_400_BAD_REQUEST, data={"error": "Upload-Metadata must include a filename."})
+
+        upload = create_upload(
+            request.user, filename, upload_length, mime_type=metadata.get('filetype') or metadata.get('type') or ''
+        )
+        logger.info(f"Created resumable upload {upload.id} ({upload_length} bytes) for user {request.user.email}")
+        location = request.build_absolute_uri(reverse('media-upload-detail', args=[upload.id]))
+        return _tus_response(status.HTTP_201_CREATED, {'Location': location, 'Upload-Offset': str(upload.offset)})
+
+
+class MediaUploadDetailView(APIView):
+    """
+    HEAD reports how many bytes of an upload the server has, PATCH appends a chunk at that
+    offset and DELETE abandons the upload.
+    """
+    permission_classes = [IsAuthenticated]
+    parser_classes = []
+
+    def get_upload(self, request, upload_id):
+        return get_object_or_404(MediaUpload, pk=upload_id, owner=request.user)
+
+    def head(self, request, upload_id, *args, **kwargs):
+        upload = self.get_upload(request, upload_id)
+        return _tus_response(status.HTTP_200_OK, {
+            'Upload-Offset': str(upload.offset),
+            'Upload-Length': str(upload.upload_length),
+        })
+
+    def patch(self, request, upload_id, *args, **kwargs):
+        upload = self.get_upload(request, upload_id)
+        if request.content_type != 'application/offset+octet-stream':
+            return _tus_response(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+        client_offset = _parse_non_negative_int_header(request, 'Upload-Offset')
+        if client_offset is None:
+            return _tus_response(status.HTTP_400_BAD_REQUEST, data={"error": "A valid Upload-Offset header is required."})
+        if upload.is_complete:
+            return _tus_response(status.HTTP_409_CONFLICT, {'Upload-Offset': str(upload.offset)})
+        if request.stream is None:
+            # No readable body: an empty PATCH is a no-op, a chunked one cannot be read without a length
+            if not request.META.get('CONTENT_LENGTH'):
+                return _tus_response(status.HTTP_400_BAD_REQUEST, data={"error": "A Content-Length header is required."})
+            if client_offset != upload.offset:
+                return _tus_response(status.HTTP_409_CONFLICT, {'Upload-Offset': str(upload.offset)})
+            return _tus_response(status.HTTP_204_NO_CONTENT, {'Upload-Offset': str(upload.offset)})
+
+        try:
+            new_offset = append_chunk(upload, request.stream, client_offset)
+        except UploadLocked:
+            return _tus_response(status.HTTP_423_LOCKED)
+        except UploadOffsetMismatch:
+            return _tus_response(status.HTTP_409_CONFLICT, {'Upload-Offset': str(upload.offset)})
+
+        return _tus_response(status.HTTP_204_NO_CONTENT, {'Upload-Offset': str(new_offset)})
+
+    def delete(self, request, upload_id, *args, **kwargs):
+        self.get_upload(request, upload_id).delete()
+        return _tus_response(status.HTTP_204_NO_CONTENT)
+
+
+class DashboardSummaryView(APIView):
+    """
+    Everything the dashboard needs in one payload: capsule counters, the next upcoming
+    deliveries and the unread notification count.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        return Response(get_dashboard_summary(request.user), status=status.HTTP_200_OK)
+
+
+class DeliveryCalendarView(APIView):
+    """
+    Counts of the user's scheduled and delivered capsules per day or month.
+    Query: ?start=YYYY-MM-DD&end=YYYY-MM-DD&granularity=day|month (default: month)
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        granularity = request.query_params.get('granularity', 'month')
+        if granularity not in settings.CALENDAR_MAX_RANGE_DAYS:
+            return Response({"error": "granularity must be 'day' or 'month'."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            start_date = datetime.date.fromisoformat(request.query_params.get('start', ''))
+            end_date = datetime.date.fromisoformat(request.query_params.get('end', ''))
+        except ValueError:
+            return Response({"error": "start and end must be dates in YYYY-MM-DD format."}, status=status.HTTP_400_BAD_REQUEST)
+        if end_date < start_date:
+            return Response({"error": "end must not be before start."}, status=status.HTTP_400_BAD_REQUEST)
+        if (end_date - start_date).days > settings.CALENDAR_MAX_RANGE_DAYS[granularity]:
+            return Response({"error": "Date range is too large for this granularity."}, status=status.HTTP_400_BAD_REQUEST)
+
+        periods = get_delivery_calendar(request.user, start_date, end_date, granularity)
+        return Response(
+            {"granularity": granularity, "start": start_date, "end": end_date, "periods": periods},
+            status=status.HTTP_200_OK
+        )
+
+
+class CapsuleSearchPagination(PageNumberPagination):
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class CapsuleSearchView(generics.ListAPIView):
+    """
+    Full-text search over the user's capsules (title, description and text contents), best match first.
+    Query: ?q=<web-search syntax>&page=<n>
+    """
+    serializer_class = CapsuleSearchResultSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = CapsuleSearchPagination
+
+    def get_queryset(self):
+        query_text = self.request.query_params.get('q', '').strip()
+        if not query_text:
+            return Capsule.objects.none()
+        return search_capsules(Capsule.objects.filter(owner=self.request.user), query_text)
+
+
 class CapsuleViewSet(viewsets.ModelViewSet):
     # Assuming you will define this viewset for other capsule-related actions
     queryset = Capsule.objects.all()
@@ -141,6 +342,51 @@ class CapsuleViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
     renderer_classes = [CapsuleRenderer]
 
+def get_capsule_delivery_datetime(capsule):
+    """
+    Combines the capsule's delivery date and time into an aware datetime in the default timezone.
+    """
+    delivery_datetime_naive = datetime.datetime.combine(capsule.delivery_date, capsule.delivery_time)
+    return timezone.make_aware(delivery_datetime_naive, timezone.get_default_timezone())
+
+
+def get_unlocked_recipient_for_token(access_token_str):
+    """
+    Looks up the recipient for a public access token and checks that the capsule can be viewed.
+    Returns the recipient with its capsule and owner selected; raises Http404 otherwise.
+    """
+    try:
+        # Validate UUID format before querying
+        access_token = uuid.UUID(str(access_token_str), version=4)
+        logger.debug(f"Access token UUID validated: {access_token}")
+    except ValueError:
+        raise Http404("Invalid token format.")
+
+    try:
+        # Fetch the recipient by the access token
+        # Ensure the capsule is selected to avoid extra DB hit
+        recipient = CapsuleRecipient.objects.select_related('capsule', 'capsule__owner').get(access_token=access_token)
+    except CapsuleRecipient.DoesNotExist:
+        raise Http404("Capsule not found or access token is invalid.") # Corrected error message
+
+    capsule = recipient.capsule
+
+    # A capsule transferred after the owner's inactivity is available to its transfer recipient right away
+    is_transfer_recipient = capsule.transferred_at is not None and recipient.recipient_email == capsule.transfer_recipient_email
+
+    # Check if the capsule is actually "unlocked" for viewing based on delivery date and time
+    if get_capsule_delivery_datetime(capsule) > timezone.now() and not is_transfer_recipient and not settings.DEBUG:
+        logger.warning(f"Attempt to access capsule ID {capsule.id} via token {access_token} before delivery time.")
+        raise Http404("This time capsule is not yet available.")
+
+    # Additionally, check if the capsule itself is marked as unlocked
+    if not capsule.is_unlocked and not settings.DEBUG: # Allow viewing in DEBUG even if not explicitly unlocked
+        logger.warning(f"Attempt to access capsule ID {capsule.id} (not unlocked) via token {access_token}.")
+        raise Http404("This time capsule is not currently accessible.")
+
+    return recipient
+
+
 class PublicCapsuleRetrieveView(generics.RetrieveAPIView):
     """
     Allows unauthenticated access to view a specific capsule's details using a unique access token.
@@ -149,38 +395,19 @@ class PublicCapsuleRetrieveView(generics.RetrieveAPIView):
     serializer_class = PublicCapsuleSerializer
     queryset = Capsule.objects.all() # Base queryset, will be filtered in get_object
 
-    def get_object(self):
-        access_token_str = str(self.kwargs.get('access_token'))
-        try:
-            # Validate UUID format before querying
-            access_token = uuid.UUID(access_token_str, version=4)
-            logger.debug(f"Access token UUID validated: {access_token}")
-        except ValueError:
-            raise Http404("Invalid token format.")
-
-        try:
-            # Fetch the recipient by the access token
-            # Ensure the capsule is selected to avoid extra DB hit
-            recipient = CapsuleRecipient.objects.select_related('capsule', 'capsule__owner').get(access_token=access_token)
-        except CapsuleRecipient.DoesNotExist:
-            raise Http404("Capsule not found or access token is invalid.") # Corrected error message
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        # Media URLs point at the token-checked public media endpoint
+        context['access_token'] = self.kwargs.get('access_token')
+        return context
 
+    def get_object(self):
+        recipient = get_unlocked_recipient_for_token(self.kwargs.get('access_token'))
         capsule = recipient.capsule
-
-        # Check if the capsule is actually "unlocked" for viewing based on delivery date and time
+        prefetch_related_objects([capsule], 'contents__variants')
+        access_token = recipient.access_token
         current_datetime = timezone.now()
-        # Combine date and time from the capsule model, then make it timezone-aware
-        delivery_datetime_naive = datetime.datetime.combine(capsule.delivery_date, capsule.delivery_time)
-        delivery_datetime_aware = timezone.make_aware(delivery_datetime_naive, timezone.get_default_timezone())
-
-        if delivery_datetime_aware > current_datetime and not settings.DEBUG:
-            logger.warning(f"Attempt to access capsule ID {capsule.id} via token {access_token} before delivery time.")
-            raise Http404("This time capsule is not yet available.")
-
-        # Additionally, check if the capsule itself is marked as unlocked
-        if not capsule.is_unlocked and not settings.DEBUG: # Allow viewing in DEBUG even if not explicitly unlocked
-            logger.warning(f"Attempt to access capsule ID {capsule.id} (not unlocked) via token {access_token}.")
-            raise Http404("This time capsule is not currently accessible.")
+        delivery_datetime_aware = get_capsule_delivery_datetime(capsule)
 
 
         # Log access and update recipient status to 'OPENED' if it was 'SENT'
@@ -225,6 +452,66 @@ class PublicCapsuleRetrieveView(generics.RetrieveAPIView):
 
         return capsule
 
+class PublicCapsuleDownloadView(APIView):
+    """
+    Streams every file in a delivered capsule as a single ZIP, using the recipient's access token.
+    """
+    permission_classes = [AllowAny]
+
+    def get(self, request, access_token, *args, **kwargs):
+        recipient = get_unlocked_recipient_for_token(access_token)
+        capsule = recipient.capsule
+        archive_name = slugify(capsule.title) or f"capsule-{capsule.id}"
+
+        response = StreamingHttpResponse(iter_capsule_zip(capsule), content_type='application/zip')
+        response['Content-Disposition'] = f'attachment; filename="{archive_name}.zip"'
+        logger.info(f"Streaming ZIP of capsule ID {capsule.id} to recipient {recipient.recipient_email}.")
+        return response
+
+def serve_content_media(request, content):
+    """
+    Delivers a content item's media to a client that passed the access checks: the original,
+    or one of its variants when the request names one with ?variant=<id>. HLS variants are
+    served as rewritten playlists (?rendition=<index> selects a rendition).
+    """
+    variant_id = request.query_params.get('variant')
+    if variant_id:
+        if not variant_id.isdigit():
+            raise Http404("Variant not found.")
+        variant = get_object_or_404(CapsuleContentVariant, pk=variant_id, content=content)
+        if variant.kind == CapsuleContentVariantKind.HLS:
+            return serve_hls_playlist(request, variant.file, request.query_params.get('rendition'))
+        return serve_media_file(request, variant.file)
+    if not content.file:
+        raise Http404("This content has no file.")
+    return serve_media_file(request, content.file, content.download_name)
+
+
+class CapsuleContentMediaView(APIView):
+    """
+    Serves a media file of one of the user's own capsules, with HTTP Range support.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, content_id, *args, **kwargs):
+        content = get_object_or_404(
+            CapsuleContent.objects.select_related('capsule'), pk=content_id, capsule__owner=request.user
+        )
+        return serve_content_media(request, content)
+
+
+class PublicCapsuleContentMediaView(APIView):
+    """
+    Serves a media file of a delivered capsule to a recipient holding its access token,
+    with HTTP Range support so video players can seek.
+    """
+    permission_classes = [AllowAny]
+
+    def get(self, request, access_token, content_id, *args, **kwargs):
+        recipient = get_unlocked_recipient_for_token(access_token)
+        content = get_object_or_404(CapsuleContent, pk=content_id, capsule_id=recipient.capsule_id)
+        return serve_content_media(request, content)
+
 # In your urls.py, you would have a path like:
 # path('capsules/<int:pk>/', CapsuleDetailView.as_view(), name='capsule-detail'),
 # path('public-capsule/<uuid:access_token>/', PublicCapsuleRetrieveView.as_view(), name='public-capsule-detail')
@@ -243,14 +530,14 @@ class NotificationListView(generics.ListAPIView):
 
     def get_queryset(self):
         user = self.request.user
-        queryset = Notification.objects.filter(user=user).order_by('-created_at')
+        queryset = Notification.objects.filter(user=user).select_related('capsule').order_by('-created_at')
         
         is_read_param = self.request.query_params.get('is_read')
         if is_read_param is not None:
             if is_read_param.lower() == 'true':
-                queryset = queryset.filter(is_read=True)
+                queryset = Notification.objects.read_for(user).select_related('capsule').order_by('-created_at')
             elif is_read_param.lower() == 'false':
-                queryset = queryset.filter(is_read=False)
+                queryset = Notification.objects.unread_for(user).select_related('capsule').order_by('-created_at')
         return queryset
 
 class NotificationMarkReadView(APIView):
@@ -274,14 +561,25 @@ class NotificationMarkReadView(APIView):
 
 class NotificationMarkAllReadView(APIView):
     """
-    Mark all unread notifications for the user as read.
+    Mark all notifications for the user as read.
+    Only moves the user's notifications_read_until high-water mark, so the cost does not
+    depend on how many notifications the user has.
     """
     permission_classes = [IsAuthenticated]
     renderer_classes = [CapsuleRenderer]
 
     def post(self, request, *args, **kwargs):
-        updated_count = Notification.objects.filter(user=request.user, is_read=False).update(is_read=True, read_at=timezone.now())
-        return Response({"message": f"{updated_count} notifications marked as read."}, status=status.HTTP_200_OK)
+        user = request.user
+        user.notifications_read_until = timezone.now()
+        user.save(update_fields=['notifications_read_until'])
+        invalidate_user_cache_on_commit(user.id)
+        return Response(
+            {
+                "message": "All notifications marked as read.",
+                "read_until": user.notifications_read_until.isoformat(),
+            },
+            status=status.HTTP_200_OK
+        )
 
 class UnreadNotificationCountView(APIView):
     """
@@ -291,5 +589,5 @@ class UnreadNotificationCountView(APIView):
     renderer_classes = [CapsuleRenderer] # Or default JSONRenderer
 
     def get(self, request, *args, **kwargs):
-        count = Notification.objects.filter(user=request.user, is_read=False).count()
+        count = Notification.objects.unread_for(request.user).count()
         return Response({'unread_count': count}, status=status.HTTP_200_OK)
\ No newline at end of file
@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 import os
+import datetime
+from celery.schedules import crontab
 from decouple import config
 from urllib.parse import urlparse
 import cloudinary
@@ -24,8 +26,6 @@ CLOUDINARY_STORAGE = {
     'API_SECRET': 'your_api_secret',
 }
 
-DEFAULT_FILE_STORAGE = 'cloudinary_storage.storage.MediaCloudinaryStorage'
-
 # Optional: If you want to use Cloudinary for static files (not common)
 # STATICFILES_STORAGE = 'cloudinary_storage.storage.StaticHashedCloudinaryStorage'
 
@@ -76,6 +76,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'accounts.middleware.ActivityTrackingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -171,6 +172,11 @@ REST_FRAMEWORK = {
     ],
 }
 
+SIMPLE_JWT = {
+    # Token logins stamp User.last_login like session logins do
+    'UPDATE_LAST_LOGIN': True,
+}
+
 
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
@@ -192,6 +198,15 @@ EMAIL_HOST = 'smtp.gmail.com'
 EMAIL_PORT = 587
 EMAIL_USE_TLS = True
 
+# Cluster-wide send rate per email provider (keyed by EMAIL_HOST): (emails per second, burst size).
+# Delivery workers share one token bucket in Redis and defer sends over the limit to their reserved slot.
+EMAIL_PROVIDER_RATE_LIMITS = {
+    'smtp.gmail.com': (1.0, 20),
+    'default': (config('EMAIL_SEND_RATE_PER_SECOND', default=5.0, cast=float), config('EMAIL_SEND_BURST', default=20, cast=int)),
+}
+RATE_LIMIT_REDIS_TIMEOUT_SECONDS = 0.5
+RATE_LIMIT_MAX_DEFERRAL_SECONDS = 15 * 60  # Longest send slot handed out in advance
+
 # Frontend URL (used for constructing links in emails)
 FRONTEND_BASE_URL = 'http://localhost:5173' # Or your frontend's actual URL
 
@@ -199,6 +214,16 @@ FRONTEND_BASE_URL = 'http://localhost:5173' # Or your frontend's actual URL
 # This is the same Client ID used by your frontend.
 GOOGLE_CLIENT_ID = config('VITE_GOOGLE_CLIENT_ID', default=None) # Or a separate backend env var like GOOGLE_OAUTH_CLIENT_ID
 
+# Cache (Redis): per-user dashboard/calendar aggregates, signed media URLs
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': config('CACHE_URL', default='redis://localhost:6379/2'),
+    }
+}
+# Shared email rate limiter buckets (see EMAIL_PROVIDER_RATE_LIMITS)
+RATE_LIMIT_REDIS_URL = config('RATE_LIMIT_REDIS_URL', default=CACHES['default']['LOCATION'])
+
 # Celery Configuration Options
 # Make sure your Redis server is running
 CELERY_BROKER_URL = 'redis://localhost:6379/0'  # Using Redis as the broker
@@ -208,8 +233,199 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE # Use Django's timezone
 CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler' # If you use Celery Beat for periodic tasks
-CELERY_RESULT_BACKEND = 'django-db'
-CELERY_RESULT_EXTENDED= True  # Store extended results in the database
+# Results are opt-in per task: nothing reads delivery results, so by default they are dropped.
+# Tasks that do need a result set ignore_result=False and get a compact entry in Redis with a TTL.
+CELERY_RESULT_BACKEND = config('CELERY_RESULT_BACKEND', default='redis://localhost:6379/1')
+CELERY_RESULT_EXTENDED = False  # Don't store args/kwargs/worker info alongside results
+CELERY_RESULT_EXPIRES = datetime.timedelta(hours=6)
+CELERY_TASK_IGNORE_RESULT = True
+
+# Queues: each one gets its own worker (see README), so a backlog of retries, media processing or
+# housekeeping never delays on-time deliveries. Within a queue, Redis emulates priorities with one
+# list per priority step; 0 is the highest priority.
+CELERY_TASK_DEFAULT_QUEUE = 'default'
+CELERY_TASK_DEFAULT_PRIORITY = 5
+CELERY_BROKER_TRANSPORT_OPTIONS = {
+    'priority_steps': list(range(10)),
+    'sep': ':',
+    'queue_order_strategy': 'priority',
+    # Tasks waiting on an ETA stay unacknowledged, and Redis hands them to another worker once
+    # this passes. Kept above the longest rate-limit deferral (RATE_LIMIT_MAX_DEFERRAL_SECONDS)
+    # and retry backoff (DELIVERY_RETRY_MAX_SECONDS). Capsule deliveries scheduled further ahead
+    # are redelivered at this interval; deliver_capsule only dispatches recipients still pending
+    # and the email task skips recipients already sent to, so a redelivery only picks up what
+    # has not been delivered yet.
+    'visibility_timeout': 2 * 60 * 60,
+}
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1  # Long media jobs must not hold back prefetched tasks
+CELERY_TASK_ROUTES = {
+    # Time-critical: the fan-out first, then the individual emails
+    'capsules.deliver_capsule': {'queue': 'deliveries', 'priority': 0},
+    'capsules.deliver_capsule_recipients': {'queue': 'deliveries', 'priority': 0},
+    'capsules.deliver_capsule_email': {'queue': 'deliveries', 'priority': 1},
+    'capsules.generate_image_variants': {'queue': 'media', 'priority': 3},
+    'capsules.transcode_video': {'queue': 'media', 'priority': 6},
+    'capsules.send_capsule_reminders': {'queue': 'housekeeping', 'priority': 2},
+    'capsules.transfer_inactive_owner_capsules': {'queue': 'housekeeping', 'priority': 2},
+    'accounts.flush_user_activity': {'queue': 'housekeeping', 'priority': 3},
+    'capsules.prune_task_results': {'queue': 'housekeeping', 'priority': 8},
+    'capsules.maintain_delivery_log_partitions': {'queue': 'housekeeping', 'priority': 4},
+    'capsules.rollup_delivery_logs': {'queue': 'housekeeping', 'priority': 6},
+    'capsules.prune_read_notifications': {'queue': 'housekeeping', 'priority': 8},
+    'capsules.prune_stale_uploads': {'queue': 'housekeeping', 'priority': 8},
+    'capsules.prune_outbox': {'queue': 'housekeeping', 'priority': 8},
+    # Publishes delivery tasks: must not wait behind housekeeping
+    'capsules.relay_outbox': {'queue': 'deliveries', 'priority': 0},
+}
+# Delivery retries are re-queued here instead of on 'deliveries'
+DELIVERY_RETRY_QUEUE = 'delivery_retries'
+# Transient delivery failures are retried after a random delay between 0 and
+# min(MAX, BASE * 2**retry) seconds; after the last retry (or on a permanent error) the delivery
+# goes to the dead-letter table, see the replay_dead_letters command
+DELIVERY_MAX_RETRIES = 5
+DELIVERY_RETRY_BASE_SECONDS = 60
+DELIVERY_RETRY_MAX_SECONDS = 60 * 60
+# Pending recipients handed to a delivery channel per batch (see capsules.channels)
+DELIVERY_DISPATCH_BATCH_SIZE = 1000
+# SMS delivery: capsules.sms.ConsoleSmsBackend, capsules.sms.LocMemSmsBackend (tests) or a provider
+# backend. Without one, SMS capsules go to their recipients by email (see capsules.channels)
+SMS_BACKEND = config(
+    'SMS_BACKEND',
+    default='capsules.sms.ConsoleSmsBackend' if DEBUG else 'capsules.sms.DisabledSmsBackend'
+)
+
+# Transactional outbox: tasks written with capsules.outbox.enqueue_task are published by the
+# relay_outbox command (and a per-minute fallback task); published rows are pruned after a while
+OUTBOX_RELAY_BATCH_SIZE = 500
+OUTBOX_RELAY_POLL_SECONDS = 1.0
+OUTBOX_RETENTION_HOURS = 72
+OUTBOX_PRUNE_BATCH_SIZE = 5000
+
+# Periodic housekeeping jobs. The DatabaseScheduler syncs these entries into django_celery_beat on startup.
+CELERY_BEAT_SCHEDULE = {
+    'prune-task-results': {
+        'task': 'capsules.prune_task_results',
+        'schedule': crontab(hour=3, minute=15),
+    },
+    'maintain-delivery-log-partitions': {
+        'task': 'capsules.maintain_delivery_log_partitions',
+        'schedule': crontab(hour=2, minute=30),
+    },
+    'rollup-delivery-logs': {
+        'task': 'capsules.rollup_delivery_logs',
+        'schedule': crontab(hour=0, minute=45),
+    },
+    'prune-read-notifications': {
+        'task': 'capsules.prune_read_notifications',
+        'schedule': crontab(hour=4, minute=0),
+    },
+    'prune-stale-uploads': {
+        'task': 'capsules.prune_stale_uploads',
+        'schedule': crontab(minute=20),
+    },
+    'send-capsule-reminders': {
+        'task': 'capsules.send_capsule_reminders',
+        'schedule': crontab(hour=8, minute=0),
+    },
+    'transfer-inactive-owner-capsules': {
+        'task': 'capsules.transfer_inactive_owner_capsules',
+        'schedule': crontab(hour=5, minute=0),
+    },
+    'flush-user-activity': {
+        'task': 'accounts.flush_user_activity',
+        'schedule': crontab(minute='*/5'),
+    },
+    'relay-outbox': {
+        'task': 'capsules.relay_outbox',
+        'schedule': crontab(),  # Every minute, in case the relay_outbox process is not running
+    },
+    'prune-outbox': {
+        'task': 'capsules.prune_outbox',
+        'schedule': crontab(hour=3, minute=45),
+    },
+}
+
+# Historical django_celery_results rows (from when results were stored in Postgres) are trimmed in batches
+TASK_RESULT_RETENTION_DAYS = 7
+TASK_RESULT_PRUNE_BATCH_SIZE = 5000
+
+# DeliveryLog is partitioned by month on PostgreSQL. Partitions older than the retention window
+# are rolled up into DeliveryLogDailySummary and dropped whole.
+# There is no DEFAULT partition: if the maintenance task stops for longer than this many months,
+# DeliveryLog inserts fail once the last prepared month is reached
+DELIVERY_LOG_PARTITIONS_AHEAD = 3  # Months of empty partitions to keep ready
+DELIVERY_LOG_RETENTION_MONTHS = 12
+DELIVERY_LOG_ROLLUP_DAYS = 2  # The nightly rollup recomputes this many trailing UTC days
+
+# Read notifications older than this are deleted by the nightly retention job, a small batch at a time
+NOTIFICATION_RETENTION_DAYS = 90
+NOTIFICATION_RETENTION_BATCH_SIZE = 1000
+
+# Owners get a reminder notification this many days before a capsule's delivery date (one per stage)
+REMINDER_WINDOWS_DAYS = (30, 7, 1)
+REMINDER_BATCH_SIZE = 1000
+REMINDER_LOCK_TIMEOUT_SECONDS = 60 * 60
+
+# Capsules with transfer_on_inactivity go to their transfer recipient once the owner has not
+# been active (User.last_activity_at) for this many days
+INACTIVITY_TRANSFER_DAYS = config('INACTIVITY_TRANSFER_DAYS', default=365, cast=int)
+INACTIVITY_TRANSFER_BATCH_SIZE = 500
+# When User.last_activity_at started being recorded on this deployment (ISO 8601 with offset, e.g.
+# 2026-10-19T00:00:00+00:00). Until INACTIVITY_TRANSFER_DAYS have passed since then, owners without
+# recorded activity are skipped rather than taken as inactive; while unset they are always skipped
+ACTIVITY_TRACKING_STARTED_AT = config(
+    'ACTIVITY_TRACKING_STARTED_AT',
+    default='',
+    cast=lambda value: datetime.datetime.fromisoformat(value) if value else None
+)
+
+# User activity is recorded in Redis at most once per user and interval per process, and flushed
+# to User.last_activity_at by a periodic task. The throttle is an in-memory cache of each worker
+# process, so with N processes a busy user costs up to N ZADDs per interval, not one. The ZADD is a
+# blocking call made on the request path: a slow or unreachable Redis adds up to
+# ACTIVITY_REDIS_TIMEOUT_SECONDS to the first request of each user and interval
+ACTIVITY_REDIS_URL = config('ACTIVITY_REDIS_URL', default=CACHES['default']['LOCATION'])
+ACTIVITY_REDIS_TIMEOUT_SECONDS = 0.05  # Requests never wait on a slow Redis for long
+ACTIVITY_RECORD_INTERVAL_SECONDS = 60
+ACTIVITY_THROTTLE_CACHE_SIZE = 100_000
+ACTIVITY_FLUSH_BATCH_SIZE = 1000
+
+# Upper bound on recipients per capsule (single address, list and CSV upload combined)
+MAX_RECIPIENTS_PER_CAPSULE = 10000
+
+# Responsive image variants generated in the background for every uploaded image
+IMAGE_VARIANT_WIDTHS = (320, 640, 1280)
+IMAGE_VARIANT_FORMATS = ('webp', 'jpeg')
+IMAGE_VARIANT_QUALITY = 80
+
+# Video transcoding (ffmpeg must be installed on the Celery workers)
+FFMPEG_BINARY = config('FFMPEG_BINARY', default='ffmpeg')
+FFPROBE_BINARY = config('FFPROBE_BINARY', default='ffprobe')
+VIDEO_TRANSCODE_TIMEOUT_SECONDS = 60 * 60
+VIDEO_HLS_ENABLED = config('VIDEO_HLS_ENABLED', default=False, cast=bool)
+VIDEO_HLS_RENDITIONS = ((360, '800k'), (720, '2800k'), (1080, '5000k'))  # (height, video bitrate)
+VIDEO_HLS_SEGMENT_SECONDS = 6
+MEDIA_PROCESSING_TMP_DIR = config('MEDIA_PROCESSING_TMP_DIR', default=None)  # None = system temp dir
+
+# Resumable (tus-style) uploads are staged here until attached to a capsule; must be shared by all web processes
+RESUMABLE_UPLOAD_DIR = config('RESUMABLE_UPLOAD_DIR', default=str(BASE_DIR / 'upload_staging'))
+RESUMABLE_UPLOAD_MAX_SIZE = 5 * 1024 * 1024 * 1024  # 5 GB
+RESUMABLE_UPLOAD_READ_SIZE = 1024 * 1024  # Bytes read from the request body per write
+RESUMABLE_UPLOAD_EXPIRY_HOURS = 24  # Uploads idle this long are deleted
+
+# Dashboard summary: cached per user, invalidated on capsule/notification writes
+DASHBOARD_CACHE_TIMEOUT = 5 * 60
+DASHBOARD_UPCOMING_LIMIT = 5
+
+# Delivery calendar: cached per user like the dashboard; longest range one request may cover
+CALENDAR_CACHE_TIMEOUT = 15 * 60
+CALENDAR_MAX_RANGE_DAYS = {'day': 366, 'month': 3660}
+
+# Text search configuration used for Capsule.search_vector and search queries
+SEARCH_CONFIG = 'english'
+
+# Admin changelists on large tables report PostgreSQL's row estimate above this many rows instead of COUNT(*)
+ADMIN_ESTIMATED_COUNT_THRESHOLD = 10000
 
 
 # LOGGING CONFIGURATION
@@ -259,24 +475,65 @@ LOGGING = {
 
 
 
-DEFAULT_FILE_STORAGE = 'cloudinary_storage.storage.MediaCloudinaryStorage'
+# Media storage backend: 'cloudinary', 's3' (any S3-compatible service, e.g. MinIO) or 'local' (MEDIA_ROOT)
+MEDIA_STORAGE_BACKEND = config('MEDIA_STORAGE_BACKEND', default='cloudinary')
+MEDIA_STORAGE_BACKENDS = {
+    'cloudinary': 'capsules.storage.CloudinaryMediaStorage',
+    's3': 'capsules.storage.S3MediaStorage',
+    'local': 'capsules.storage.LocalMediaStorage',
+}
+STORAGES = {
+    'default': {
+        'BACKEND': MEDIA_STORAGE_BACKENDS[MEDIA_STORAGE_BACKEND],
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
 
 CLOUDINARY_STORAGE = {
-    'CLOUD_NAME': config('CLOUDINARY_CLOUD_NAME'),
-    'API_KEY': config('CLOUDINARY_API_KEY'),
-    'API_SECRET': config('CLOUDINARY_API_SECRET'),
+    'CLOUD_NAME': config('CLOUDINARY_CLOUD_NAME', default=''),
+    'API_KEY': config('CLOUDINARY_API_KEY', default=''),
+    'API_SECRET': config('CLOUDINARY_API_SECRET', default=''),
 }
 
 
 cloudinary.config(
-    cloud_name=config('CLOUDINARY_CLOUD_NAME'),
-    api_key=config('CLOUDINARY_API_KEY'),
-    api_secret=config('CLOUDINARY_API_SECRET'),
+    cloud_name=config('CLOUDINARY_CLOUD_NAME', default=''),
+    api_key=config('CLOUDINARY_API_KEY', default=''),
+    api_secret=config('CLOUDINARY_API_SECRET', default=''),
 )
 
+# S3-compatible storage (MEDIA_STORAGE_BACKEND='s3'); set AWS_S3_ENDPOINT_URL for MinIO
+AWS_ACCESS_KEY_ID = config('AWS_ACCESS_KEY_ID', default=None)
+AWS_SECRET_ACCESS_KEY = config('AWS_SECRET_ACCESS_KEY', default=None)
+AWS_STORAGE_BUCKET_NAME = config('AWS_STORAGE_BUCKET_NAME', default='time-capsule-media')
+AWS_S3_REGION_NAME = config('AWS_S3_REGION_NAME', default=None)
+AWS_S3_ENDPOINT_URL = config('AWS_S3_ENDPOINT_URL', default=None)
+AWS_S3_CUSTOM_DOMAIN = config('AWS_S3_CUSTOM_DOMAIN', default=None)
+# Objects are private: every URL is presigned and expires (media is served through the access-checked endpoints)
+AWS_DEFAULT_ACL = 'private'
+AWS_QUERYSTRING_AUTH = True
+AWS_QUERYSTRING_EXPIRE = 5 * 60
+AWS_S3_FILE_OVERWRITE = False
+MEDIA_S3_MULTIPART_THRESHOLD = 16 * 1024 * 1024  # Files above this are uploaded in parallel parts
+MEDIA_S3_MULTIPART_CHUNKSIZE = 16 * 1024 * 1024
+MEDIA_S3_MAX_CONCURRENCY = 8
+
 MEDIA_URL = '/media/'
 
-# MEDIA_ROOT = BASE_DIR / "media"
+MEDIA_ROOT = config('MEDIA_ROOT', default=str(BASE_DIR / 'media'))  # Used by the 'local' storage backend
+
+# Private media endpoints. Remote storage answers with a redirect to a signed URL valid at least this
+# long (each URL is reused for one such period, see capsules.media_delivery, so at most twice as long);
+# local files are offloaded to the web server when MEDIA_SENDFILE_BACKEND is 'x-accel-redirect' (nginx,
+# internal location MEDIA_ACCEL_REDIRECT_LOCATION aliased to MEDIA_ROOT) or 'x-sendfile' (Apache/lighttpd).
+MEDIA_REDIRECT_URL_TTL_SECONDS = 5 * 60
+# HLS segment URLs are signed when the rendition playlist is served and must outlive the playback
+MEDIA_HLS_URL_TTL_SECONDS = 6 * 60 * 60
+MEDIA_HLS_PLAYLIST_CACHE_SECONDS = 24 * 60 * 60
+MEDIA_SENDFILE_BACKEND = config('MEDIA_SENDFILE_BACKEND', default='')
+MEDIA_ACCEL_REDIRECT_LOCATION = '/protected-media/'
 
 
 OTPOTP_VALIDITY_DURATION_SECONDS = 600
\ No newline at end of file